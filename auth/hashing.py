@@ -0,0 +1,93 @@
+import asyncio
+import time
+from concurrent.futures import (Executor, ProcessPoolExecutor,
+                                ThreadPoolExecutor)
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from src.config import Config as settings
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.PASSWORD_BCRYPT_ROUNDS)
+
+
+# module level functions so they can be shipped to a process pool.
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    # the new hash is only returned when the stored one uses outdated settings (e.g. fewer rounds).
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+class PasswordHasher:
+    # bcrypt takes hundreds of milliseconds per call, it never runs on the event loop: calls go to a
+    # bounded thread (or process) pool and are rejected with a 503 once too many are already waiting.
+
+    def __init__(self, executor_kind: str, workers: int, max_pending: int):
+        self.executor_kind = executor_kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.busy_time = 0.0
+        self._executor: Executor | None = None
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hasher")
+        return self._executor
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many authentication requests, please retry shortly.",
+                headers={"Retry-After": "1"},
+            )
+
+        self.pending += 1
+        started_at = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+            self.busy_time += time.perf_counter() - started_at
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await self._run(verify_and_update_password, plain_password, hashed_password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "executor": self.executor_kind,
+            "workers": self.workers,
+            "queue_depth": self.pending,
+            "max_queue_depth": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_latency": self.busy_time / self.completed if self.completed else 0.0,
+        }
+
+
+password_hasher = PasswordHasher(
+    executor_kind=settings.PASSWORD_HASH_EXECUTOR,
+    workers=settings.PASSWORD_HASH_WORKERS,
+    max_pending=settings.PASSWORD_HASH_MAX_PENDING,
+)
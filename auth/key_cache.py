@@ -0,0 +1,68 @@
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from src.config import Config as settings
+from src.models import UserKey
+from src.websockets_conn import manager as connection_manager
+
+USER_KEYS_TOPIC = "user_keys"
+
+
+class UserKeyCache:
+    # user id -> public key on record, so sends and deliveries do not read the recipient's key every time.
+    # only keys on record are cached (a key registered later is found on the next lookup), entries are
+    # dropped on every node when the key changes (see invalidate_user_key) and expire after `ttl` seconds.
+    # `generation` moves on every invalidation: keys read before an invalidation are not put in afterwards.
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.generation = 0
+        self._entries: "OrderedDict[str, Tuple[UserKey, float]]" = OrderedDict()
+
+    def get(self, user_id: str) -> Optional[UserKey]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+
+        user_key, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[user_id]
+            return None
+
+        self._entries.move_to_end(user_id)
+        return user_key
+
+    def set(self, user_key: UserKey, generation: int):
+        if self.max_size <= 0 or generation != self.generation:
+            return
+        # a copy bound to no session, shared read-only by every request.
+        user_id = str(user_key.user_id)
+        self._entries[user_id] = (UserKey(**user_key.model_dump()), time.monotonic() + self.ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str):
+        self.generation += 1
+        self._entries.pop(user_id, None)
+
+
+user_key_cache = UserKeyCache(max_size=settings.USER_KEY_CACHE_SIZE, ttl=settings.USER_KEY_CACHE_TTL)
+
+
+async def invalidate_user_key(user_id: str):
+    # here right away, on the other nodes through the broker. called once the change is committed.
+    try:
+        await connection_manager.broker.broadcast(USER_KEYS_TOPIC, {"user_id": str(user_id)})
+    except Exception as e:
+        user_key_cache.invalidate(str(user_id))
+        print(f"User key invalidation broadcast failed: {e}")
+
+
+async def _on_user_key_changed(data: dict):
+    user_key_cache.invalidate(data["user_id"])
+
+
+connection_manager.broker.on_broadcast(USER_KEYS_TOPIC, _on_user_key_changed)
@@ -0,0 +1,160 @@
+import asyncio
+import base64
+import os
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+import aiofiles
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from src.config import Config as settings
+
+
+def serialize_private_key(private_key: ec.EllipticCurvePrivateKey) -> bytes:
+    return private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    )
+
+
+class KeyStoreBackend(ABC):
+    @abstractmethod
+    async def write(self, user_id: str, pem: bytes): ...
+
+    @abstractmethod
+    async def read(self, user_id: str) -> Optional[bytes]: ...
+
+
+class PemDirectoryBackend(KeyStoreBackend):
+    # one `{user_id}.pem` file per user inside PRIVATE_KEY_DIR (the historical layout).
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def get_path(self, user_id: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, f"{user_id}.pem")
+
+    async def write(self, user_id: str, pem: bytes):
+        async with aiofiles.open(self.get_path(user_id), "wb") as f:
+            await f.write(pem)
+
+    async def read(self, user_id: str) -> Optional[bytes]:
+        try:
+            async with aiofiles.open(self.get_path(user_id), "rb") as f:
+                return await f.read()
+        except FileNotFoundError:
+            return None
+
+
+class IndexedFileBackend(KeyStoreBackend):
+    # all keys live in a single append-only file, one `<user_id>\t<base64 pem>\n` record per line.
+    # the offsets of the latest record of every user are indexed in memory on first access,
+    # so a read is a single seek instead of one open() per user.
+
+    def __init__(self, path: str):
+        self.path = path
+        self._index: Dict[str, Tuple[int, int]] | None = None
+        self._lock = asyncio.Lock()
+
+    async def _load_index(self) -> Dict[str, Tuple[int, int]]:
+        if self._index is not None:
+            return self._index
+
+        index = {}
+        if os.path.exists(self.path):
+            offset = 0
+            async with aiofiles.open(self.path, "rb") as f:
+                async for line in f:
+                    user_id, _, _ = line.partition(b"\t")
+                    index[user_id.decode()] = (offset, len(line))
+                    offset += len(line)
+        self._index = index
+        return index
+
+    async def write(self, user_id: str, pem: bytes):
+        record = user_id.encode() + b"\t" + base64.b64encode(pem) + b"\n"
+        async with self._lock:
+            index = await self._load_index()
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            async with aiofiles.open(self.path, "ab") as f:
+                offset = await f.tell()
+                await f.write(record)
+            index[user_id] = (offset, len(record))
+
+    async def read(self, user_id: str) -> Optional[bytes]:
+        async with self._lock:
+            index = await self._load_index()
+        location = index.get(user_id)
+        if location is None:
+            return None
+
+        offset, length = location
+        async with aiofiles.open(self.path, "rb") as f:
+            await f.seek(offset)
+            record = await f.read(length)
+        _, _, encoded = record.rstrip(b"\n").partition(b"\t")
+        return base64.b64decode(encoded)
+
+
+class KeyStore:
+    # keeps parsed private keys in a bounded LRU so hot users never hit the disk
+    # nor re-parse their PEM on every encrypt/decrypt.
+
+    def __init__(self, backend: KeyStoreBackend, max_size: int):
+        self.backend = backend
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._keys: "OrderedDict[str, ec.EllipticCurvePrivateKey]" = OrderedDict()
+
+    def _remember(self, user_id: str, private_key: ec.EllipticCurvePrivateKey):
+        if self.max_size <= 0:
+            return
+        self._keys[user_id] = private_key
+        self._keys.move_to_end(user_id)
+        while len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+
+    async def save(self, user_id: str, private_key: ec.EllipticCurvePrivateKey):
+        await self.backend.write(user_id, serialize_private_key(private_key))
+        self._remember(user_id, private_key)
+
+    async def load(self, user_id: str) -> Optional[ec.EllipticCurvePrivateKey]:
+        private_key = self._keys.get(user_id)
+        if private_key is not None:
+            self._keys.move_to_end(user_id)
+            self.hits += 1
+            return private_key
+
+        self.misses += 1
+        pem = await self.backend.read(user_id)
+        if pem is None:
+            return None
+
+        private_key = serialization.load_pem_private_key(pem, password=None)
+        self._remember(user_id, private_key)
+        return private_key
+
+    async def preload(self, user_ids: Iterable[str]):
+        for user_id in user_ids:
+            if str(user_id) not in self._keys:
+                await self.load(str(user_id))
+
+    def forget(self, user_id: str):
+        self._keys.pop(str(user_id), None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._keys), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+def get_backend() -> KeyStoreBackend:
+    if settings.KEYSTORE_BACKEND == "indexed_file":
+        return IndexedFileBackend(os.path.join(settings.PRIVATE_KEY_DIR, settings.KEYSTORE_INDEX_FILE))
+    return PemDirectoryBackend(settings.PRIVATE_KEY_DIR)
+
+
+keystore = KeyStore(get_backend(), max_size=settings.KEYSTORE_CACHE_SIZE)
@@ -1,14 +1,22 @@
 import uuid
-from typing import Optional, Union
+from typing import Dict, Iterable, Optional, Set, Union
 
+from sqlalchemy.orm import selectinload
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
+from encryption import session_key_cache
 from src.base import BaseManager
 from src.models import User, UserKey
 
+from .key_cache import invalidate_user_key, user_key_cache
+from .principal_cache import principal_cache
+
 
 class UserManager(BaseManager[User]):
+    # opt-in loader options, see BaseManager.get_by_id
+    WITH_CONVERSATIONS = (selectinload(User.conversations),)
+
     def __init__(self, session: AsyncSession):
         super().__init__(session, User)
 
@@ -17,10 +25,48 @@ class UserManager(BaseManager[User]):
         result = await self.session.exec(statement)
         return result.first()
 
+    async def get_existing_ids(self, user_ids: Iterable[Union[str, uuid.UUID]]) -> Set[str]:
+        user_ids = {str(user_id) for user_id in user_ids}
+        if not user_ids:
+            return set()
+        result = await self.session.exec(select(User.id).where(User.id.in_(user_ids)))
+        return {str(user_id) for user_id in result.all()}
+
+    # read through the key cache (see auth.key_cache), the keys returned are shared: read-only.
     async def get_user_key(self, user_id: Union[str, uuid.UUID]) -> Optional[UserKey]:
-        statement = select(UserKey).where(UserKey.user_id == user_id)
+        user_id = str(uuid.UUID(str(user_id)))
+        return (await self.get_user_keys([user_id])).get(user_id)
+
+    async def get_user_keys(self, user_ids: Iterable[Union[str, uuid.UUID]]) -> Dict[str, UserKey]:
+        # keyed by the canonical user ids.
+        user_ids = {str(uuid.UUID(str(user_id))) for user_id in user_ids}
+        user_keys = {user_id: user_key_cache.get(user_id) for user_id in user_ids}
+        user_keys = {user_id: user_key for user_id, user_key in user_keys.items() if user_key is not None}
+        missing = user_ids - user_keys.keys()
+        if not missing:
+            return user_keys
+
+        generation = user_key_cache.generation
+        statement = select(UserKey).where(UserKey.user_id.in_(missing))
         result = await self.session.exec(statement)
-        return result.first()
+        for user_key in result.all():
+            if str(user_key.user_id) not in user_keys:
+                user_keys[str(user_key.user_id)] = user_key
+                user_key_cache.set(user_key, generation)
+        return user_keys
+
+    async def revoke_user_key(self, user_id: Union[str, uuid.UUID]) -> bool:
+        # the row itself, never the cached copy.
+        user_key = (await self.session.exec(select(UserKey).where(UserKey.user_id == user_id))).first()
+        if not user_key:
+            return False
+
+        user_key.revoked = True
+        await self.update(user_key)
+        session_key_cache.invalidate_user(str(user_id))
+        await principal_cache.invalidate_user(user_id)
+        await invalidate_user_key(user_id)
+        return True
 
     async def get_by_email(self, email: str) -> Optional[User]:
         statement = select(User).where(User.email == email)
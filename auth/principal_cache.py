@@ -0,0 +1,142 @@
+import hashlib
+import json
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Dict, Optional, Tuple
+
+from src.config import Config as settings
+
+
+@dataclass
+class Principal:
+    # slim snapshot of the authenticated user, all that the routes need from get_current_user.
+    id: uuid.UUID
+    username: str
+    has_key: bool = False
+    key_revoked: bool = False
+
+    def to_json(self) -> str:
+        return json.dumps({**asdict(self), "id": str(self.id)})
+
+    @classmethod
+    def from_json(cls, raw: str | bytes) -> "Principal":
+        data = json.loads(raw)
+        return cls(**{**data, "id": uuid.UUID(data["id"])})
+
+
+def principal_cache_key(token: str, payload: dict) -> str:
+    if payload.get("iat") is not None:
+        return f"{payload['sub']}:{payload['iat']}"
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class PrincipalCacheBackend(ABC):
+    # entries are tagged with the user's generation: invalidating a user bumps it, so every
+    # principal cached for any of their tokens becomes stale at once.
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Principal]: ...
+
+    @abstractmethod
+    async def set(self, key: str, principal: Principal, expires_at: float): ...
+
+    @abstractmethod
+    async def invalidate_user(self, user_id: str): ...
+
+
+class InMemoryPrincipalBackend(PrincipalCacheBackend):
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[Principal, float, int]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+
+    async def get(self, key: str) -> Optional[Principal]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        principal, expires_at, generation = entry
+        if expires_at <= time.time() or generation != self._generations.get(str(principal.id), 0):
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return principal
+
+    async def set(self, key: str, principal: Principal, expires_at: float):
+        if self.max_size <= 0:
+            return
+        self._entries[key] = (principal, expires_at, self._generations.get(str(principal.id), 0))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def invalidate_user(self, user_id: str):
+        self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+
+class RedisPrincipalBackend(PrincipalCacheBackend):
+    # shared between workers, entries expire in redis itself when their token does.
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("PRINCIPAL_CACHE_BACKEND=redis requires the `redis` package to be installed")
+        self.redis = redis.from_url(url)
+
+    async def get(self, key: str) -> Optional[Principal]:
+        raw = await self.redis.get(f"principal:{key}")
+        if raw is None:
+            return None
+
+        entry = json.loads(raw)
+        principal = Principal.from_json(entry["principal"])
+        generation = await self.redis.get(f"principal_generation:{principal.id}")
+        if int(generation or 0) != entry["generation"]:
+            return None
+        return principal
+
+    async def set(self, key: str, principal: Principal, expires_at: float):
+        generation = await self.redis.get(f"principal_generation:{principal.id}")
+        entry = json.dumps({"principal": principal.to_json(), "generation": int(generation or 0)})
+        await self.redis.set(f"principal:{key}", entry, exat=int(expires_at))
+
+    async def invalidate_user(self, user_id: str):
+        await self.redis.incr(f"principal_generation:{user_id}")
+
+
+class PrincipalCache:
+    def __init__(self, backend: PrincipalCacheBackend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[Principal]:
+        principal = await self.backend.get(key)
+        if principal is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return principal
+
+    async def set(self, key: str, principal: Principal, expires_at: float):
+        await self.backend.set(key, principal, expires_at)
+
+    async def invalidate_user(self, user_id: str | uuid.UUID):
+        await self.backend.invalidate_user(str(user_id))
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def get_backend() -> PrincipalCacheBackend:
+    if settings.PRINCIPAL_CACHE_BACKEND == "redis":
+        return RedisPrincipalBackend(settings.REDIS_URL)
+    return InMemoryPrincipalBackend(max_size=settings.PRINCIPAL_CACHE_SIZE)
+
+
+principal_cache = PrincipalCache(get_backend())
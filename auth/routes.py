@@ -1,40 +1,34 @@
+import time
 from datetime import datetime, timedelta
 from typing import Annotated, List, Optional
 
 import jwt
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from passlib.context import CryptContext
 from sqlmodel import select
 
 from auth.manager import UserManager
 from auth.schemas import PublicKeyResponse, Token, UserCreate, UserResponse
-from encryption import generate_key_pair
-from src.db_config import SessionDep, settings
+from encryption import generate_key_pair, session_key_cache
+from src.db_config import SessionDep, async_session, settings
 from src.models import User, UserKey
 
+from .hashing import password_hasher
+from .principal_cache import Principal, principal_cache, principal_cache_key
 from .utils import save_private_key
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
-
-
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
-
-
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.now() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    # `iat` tells two tokens of the same user apart, it is part of the principal cache key.
+    to_encode.update({"exp": expire, "iat": datetime.utcnow()})
     encoded_jwt = jwt.encode(to_encode, settings.JWT_SECRET, algorithm=settings.JWT_ALGORITHM)
     return encoded_jwt
 
@@ -50,9 +44,8 @@ def decode_token(token: str) -> dict | None:
 
 
 async def get_current_user(
-    session: SessionDep,
     token: str = Depends(oauth2_scheme),
-) -> User:
+) -> Principal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -66,11 +59,29 @@ async def get_current_user(
     except Exception:
         raise credentials_exception
 
-    manager = UserManager(session)
-    user = await manager.get_by_username(username)
-    if user is None:
-        raise credentials_exception
-    return user
+    # hot path: the principal of an already seen token is served without touching the database.
+    cache_key = principal_cache_key(token, payload)
+    principal = await principal_cache.get(cache_key)
+    if principal is not None:
+        return principal
+
+    async with async_session() as session:
+        manager = UserManager(session)
+        user = await manager.get_by_username(username)
+        if user is None:
+            raise credentials_exception
+        user_key = await manager.get_user_key(user.id)
+
+    principal = Principal(
+        id=user.id,
+        username=user.username,
+        has_key=user_key is not None,
+        key_revoked=bool(user_key and user_key.revoked),
+    )
+    # a token without `exp` never expires, its principal is still only cached for a token lifetime.
+    expires_at = payload.get("exp") or time.time() + settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    await principal_cache.set(cache_key, principal, expires_at=expires_at)
+    return principal
 
 
 @router.post("/register", response_model=UserResponse)
@@ -88,7 +99,7 @@ async def register(user_create: UserCreate, session: SessionDep):
         username=user_create.username,
         email=user_create.email,
         phone_number=user_create.phone_number,
-        password_hash=get_password_hash(user_create.password),
+        password_hash=await password_hasher.hash(user_create.password),
     )
     user_db = await user_repo.create(user)
     return user
@@ -99,27 +110,35 @@ async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm,
     user_repo = UserManager(session)
     user = await user_repo.get_by_username(form_data.username)
 
-    if not user or not verify_password(form_data.password, user.password_hash):
+    verified, new_hash = (
+        await password_hasher.verify_and_update(form_data.password, user.password_hash) if user else (False, None)
+    )
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    # the hash was made with outdated settings (e.g. fewer bcrypt rounds), store the upgraded one.
+    if new_hash:
+        user.password_hash = new_hash
+        await user_repo.update(user, refresh=False)
+
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(data={"sub": user.username}, expires_delta=access_token_expires)
     return {"access_token": access_token, "token_type": "bearer"}
 
 
 @router.get("/users/list")
-async def get_users(session: SessionDep, _: User = Depends(get_current_user)) -> List[UserResponse] | None:
+async def get_users(session: SessionDep, _: Principal = Depends(get_current_user)) -> List[UserResponse] | None:
     user_manager = UserManager(session)
     users = await user_manager.get_all()
     return users
 
 
 @router.post("/auth/key-exchange", response_model=PublicKeyResponse)
-async def generate_key(session: SessionDep, authenticated_user: User = Depends(get_current_user)):
+async def generate_key(session: SessionDep, authenticated_user: Principal = Depends(get_current_user)):
     user_id = authenticated_user.id
     userkey_exists = (await session.exec(select(UserKey).where(UserKey.user_id == user_id))).first()
     if userkey_exists:
@@ -136,4 +155,8 @@ async def generate_key(session: SessionDep, authenticated_user: User = Depends(g
     session.add(user_key_info)
     await session.commit()
 
+    # session keys derived before this registration are stale now, and so is the key status of the principal.
+    session_key_cache.invalidate_user(str(user_id))
+    await principal_cache.invalidate_user(user_id)
+
     return PublicKeyResponse(public_key=public_key)
@@ -0,0 +1,163 @@
+import asyncio
+import math
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Iterator, List, Optional
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    # nearest-rank percentile, good enough for latency reporting and stable between runs.
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    latencies: List[float] = field(default_factory=list)  # seconds
+    errors: int = 0
+    wall_time: float = 0.0
+    queries: int = 0
+    commits: int = 0
+    items_per_request: int = 1  # messages per request for the batched paths
+
+    def summary(self) -> dict:
+        count = len(self.latencies)
+        return {
+            "requests": count,
+            "errors": self.errors,
+            "wall_time_s": round(self.wall_time, 4),
+            "throughput_rps": round(count / self.wall_time, 2) if self.wall_time else 0.0,
+            "items_per_s": round(count * self.items_per_request / self.wall_time, 2) if self.wall_time else 0.0,
+            "latency_ms": {
+                "p50": round(percentile(self.latencies, 50) * 1000, 3),
+                "p95": round(percentile(self.latencies, 95) * 1000, 3),
+                "p99": round(percentile(self.latencies, 99) * 1000, 3),
+                "max": round(max(self.latencies, default=0.0) * 1000, 3),
+            },
+            "queries_total": self.queries,
+            "queries_per_request": round(self.queries / count, 2) if count else 0.0,
+            "commits_per_request": round(self.commits / count, 2) if count else 0.0,
+        }
+
+
+class QueryCounter:
+    # counts the statements the app sends to the database, hooked on the engine cursor events
+    # so it sees the ORM, core statements and raw SQL alike. commits are counted apart, each one
+    # is a round trip of its own.
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        self.commits = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+        event.listen(engine.sync_engine, "commit", self._on_commit)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def _on_commit(self, *args):
+        self.commits += 1
+
+
+async def run_scenario(
+    name: str,
+    call: Callable[[int], Awaitable[None]],
+    requests: int,
+    concurrency: int,
+    query_counter: QueryCounter,
+    items_per_request: int = 1,
+) -> ScenarioResult:
+    # runs `call(i)` for i in range(requests), at most `concurrency` at a time.
+    result = ScenarioResult(name=name, items_per_request=items_per_request)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed(i: int):
+        async with semaphore:
+            started_at = time.perf_counter()
+            try:
+                await call(i)
+            except Exception as e:
+                result.errors += 1
+                print(f"[{name}] request {i} failed: {e!r}")
+                return
+            result.latencies.append(time.perf_counter() - started_at)
+
+    queries_before, commits_before = query_counter.count, query_counter.commits
+    started_at = time.perf_counter()
+    await asyncio.gather(*(timed(i) for i in range(requests)))
+    result.wall_time = time.perf_counter() - started_at
+    result.queries = query_counter.count - queries_before
+    result.commits = query_counter.commits - commits_before
+    return result
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def temporary_postgres(bin_dir: Optional[str] = None) -> Iterator[str]:
+    # stands in for a provisioned database: a throwaway cluster (initdb and pg_ctl from `bin_dir` or the PATH)
+    # on a free port, deleted on exit. initdb refuses to run as root, run the benchmark as a regular user.
+    def tool(name: str) -> str:
+        path = os.path.join(bin_dir, name) if bin_dir else shutil.which(name)
+        if not path or not os.path.exists(path):
+            raise RuntimeError(f"{name} not found, pass --pg-bin or --database-url")
+        return path
+
+    with tempfile.TemporaryDirectory(prefix="chat-bench-pg-") as directory:
+        data_dir, port = os.path.join(directory, "data"), free_port()
+        subprocess.run(
+            [tool("initdb"), "-D", data_dir, "-U", "postgres", "--auth=trust"], check=True, capture_output=True
+        )
+        subprocess.run(
+            [
+                tool("pg_ctl"),
+                "-D",
+                data_dir,
+                "-l",
+                os.path.join(directory, "postgres.log"),
+                "-o",
+                f"-p {port} -k {directory}",
+                "-w",
+                "start",
+            ],
+            check=True,
+            capture_output=True,
+        )
+        try:
+            yield f"postgresql+asyncpg://postgres@127.0.0.1:{port}/postgres"
+        finally:
+            subprocess.run([tool("pg_ctl"), "-D", data_dir, "-m", "fast", "-w", "stop"], capture_output=True)
+
+
+@asynccontextmanager
+async def running_server(app, port: int):
+    # the app runs in-process under a real uvicorn server, so HTTP and websocket traffic
+    # goes through the same stack as in production while sharing the engine with the harness.
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.05)
+    try:
+        yield f"127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        await task
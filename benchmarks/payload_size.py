@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import json
+import os
+import uuid
+from datetime import datetime
+
+# row and response sizes of messages, per message type:
+#
+#     python -m benchmarks.payload_size                      # responses only, no database needed
+#     python -m benchmarks.payload_size --database-url ...   # + average row sizes of an existing database
+#
+# `legacy_response_bytes` is the same message serialized in the former flat layout, where every
+# response carried all the media fields (as nulls when unused).
+
+LEGACY_MEDIA_FIELDS = [
+    "image_url",
+    "image_filename",
+    "image_size",
+    "file_url",
+    "file_filename",
+    "file_size",
+    "file_mime_type",
+    "voice_url",
+    "voice_filename",
+    "voice_duration",
+    "video_url",
+    "video_filename",
+    "video_size",
+    "video_duration",
+    "video_thumbnail_url",
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="message row and response sizes")
+    parser.add_argument("--database-url", help="overrides DATABASE_URL, must point to a Postgres database")
+    return parser.parse_args()
+
+
+def sample_messages():
+    from src.models import Message, MessageAttachment, MessageType
+
+    common = {
+        "timestamp": datetime(2026, 1, 1, 12, 0, 0, 123456),
+        "sender_id": uuid.uuid4(),
+        "recipient_id": uuid.uuid4(),
+        "conversation_id": uuid.uuid4(),
+    }
+    attachments = {
+        MessageType.IMAGE: MessageAttachment(url="https://cdn.example.com/i/1.jpg", filename="1.jpg", size=183422),
+        MessageType.FILE: MessageAttachment(
+            url="https://cdn.example.com/f/1.pdf", filename="1.pdf", size=90211, mime_type="application/pdf"
+        ),
+        MessageType.VOICE: MessageAttachment(url="https://cdn.example.com/v/1.ogg", filename="1.ogg", duration=12),
+        MessageType.VIDEO: MessageAttachment(
+            url="https://cdn.example.com/m/1.mp4",
+            filename="1.mp4",
+            size=4812003,
+            duration=31,
+            thumbnail_url="https://cdn.example.com/m/1.jpg",
+        ),
+    }
+
+    messages = [Message(id=uuid.uuid4(), message_type=MessageType.TEXT, content="x" * 64, **common)]
+    for message_type, attachment in attachments.items():
+        message = Message(id=uuid.uuid4(), message_type=message_type, caption="a caption", **common)
+        attachment.message_id = message.id
+        message.attachment = attachment
+        messages.append(message)
+    return messages
+
+
+def legacy_payload(message) -> dict:
+    # the former MessageResponse: every field of every type, flattened on the message.
+    from src.models import MessageType
+
+    payload = {
+        "id": str(message.id),
+        "timestamp": message.timestamp.isoformat(),
+        "message_type": message.message_type.value,
+        "is_read": message.is_read,
+        "sender_id": str(message.sender_id),
+        "recipient_id": str(message.recipient_id),
+        "conversation_id": str(message.conversation_id),
+        "content": message.content,
+        **{field: None for field in LEGACY_MEDIA_FIELDS},
+        "caption": message.caption,
+    }
+    if message.message_type != MessageType.TEXT:
+        prefix = message.message_type.value
+        for field, value in message.attachment.model_dump(exclude={"message_id"}).items():
+            if f"{prefix}_{field}" in payload:
+                payload[f"{prefix}_{field}"] = value
+    return payload
+
+
+def response_sizes() -> dict:
+    from message.schemas import message_response
+
+    sizes = {}
+    for message in sample_messages():
+        sizes[message.message_type.value] = {
+            "response_bytes": len(message_response(message).model_dump_json()),
+            "legacy_response_bytes": len(json.dumps(legacy_payload(message), separators=(",", ":"))),
+        }
+    return sizes
+
+
+async def row_sizes() -> dict:
+    from sqlalchemy import text
+
+    from src.db_config import main_engine
+
+    statements = {
+        "message": "SELECT message_type::text, count(*), avg(pg_column_size(m.*)) FROM message m GROUP BY 1",
+        "messageattachment": (
+            "SELECT m.message_type::text, count(*), avg(pg_column_size(a.*)) "
+            "FROM messageattachment a JOIN message m ON m.id = a.message_id GROUP BY 1"
+        ),
+    }
+    sizes = {}
+    async with main_engine.connect() as connection:
+        for table, statement in statements.items():
+            rows = (await connection.execute(text(statement))).all()
+            sizes[table] = {
+                message_type.lower(): {"rows": count, "avg_row_bytes": round(float(avg), 1)}
+                for message_type, count, avg in rows
+            }
+            total = (await connection.execute(text(f"SELECT pg_total_relation_size('{table}')"))).scalar()
+            sizes[table]["total_relation_bytes"] = total
+    await main_engine.dispose()
+    return sizes
+
+
+async def main():
+    args = parse_args()
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    # the app package first, once the settings are final: the apps import each other through it.
+    import src  # noqa: F401
+
+    report = {"responses": response_sizes()}
+    if args.database_url:
+        report["rows"] = await row_sizes()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
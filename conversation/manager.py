@@ -1,50 +1,184 @@
-from typing import List
+import uuid
+from datetime import datetime
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence
 
-from sqlalchemy.orm import selectinload
+from sqlalchemy import func, true, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import aliased, selectinload
+from sqlalchemy.sql.base import ExecutableOption
 from sqlmodel import Session, and_, select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from auth.manager import UserManager
+from message.pagination import Cursor
 from src.base import BaseManager
-from src.models import Conversation, ConversationParticipant, User
+from src.db_config import local_store
+from src.models import (Conversation, ConversationParticipant, GroupSenderKey,
+                        Message, User, pair_key, private_conversation_id)
+
+from .membership import (invalidate_membership, membership_index,
+                         private_conversation_index)
 
 
 class ConversationManager(BaseManager[Conversation]):
+    # opt-in loader options, see BaseManager.get_by_id
+    WITH_MESSAGES = (selectinload(Conversation.messages),)
+    WITH_PARTICIPANTS = (selectinload(Conversation.participants),)
+
     def __init__(self, session: AsyncSession):
         super().__init__(session, Conversation)
         self.user_manager = UserManager(session)
 
-    async def get_by_user(self, user_id: str) -> List[Conversation]:
+    async def get_by_user(self, user_id: str, options: Sequence[ExecutableOption] = ()) -> List[Conversation]:
         statement = (
             select(Conversation)
             .join(ConversationParticipant)
             .where(ConversationParticipant.user_id == user_id)
             .order_by(Conversation.last_activity.desc())
+            .options(*options)
         )
         result = await self.session.exec(statement)
         return result.all()
 
-    async def get_or_create_private_conversation(self, user1_id: str, user2_id: str) -> Conversation:
-        # Check if conversation already exists
+    async def get_inbox(self, user_id: str, limit: int, before: Optional[Cursor] = None) -> List[Row]:
+        # one round trip: the page of conversations (keyset on last_activity, id), each joined laterally
+        # to its last message, with the user's unread count and the participant ids as scalar subqueries.
+        page = (
+            select(Conversation.id, Conversation.conversation_name, Conversation.is_group, Conversation.last_activity)
+            .join(ConversationParticipant, ConversationParticipant.conversation_id == Conversation.id)
+            .where(ConversationParticipant.user_id == user_id)
+        )
+        if before:
+            page = page.where(tuple_(Conversation.last_activity, Conversation.id) < tuple_(*before))
+        page = page.order_by(Conversation.last_activity.desc(), Conversation.id.desc()).limit(limit).cte("page")
+
+        last_message = (
+            select(Message)
+            .where(Message.conversation_id == page.c.id)
+            .order_by(Message.timestamp.desc(), Message.id.desc())
+            .limit(1)
+            .lateral("last_message")
+        )
+        unread_count = (
+            select(func.count())
+            .select_from(Message)
+            .where(Message.conversation_id == page.c.id, Message.recipient_id == user_id, Message.is_read == False)
+            .scalar_subquery()
+        )
+        participant_ids = (
+            select(func.array_agg(ConversationParticipant.user_id))
+            .where(ConversationParticipant.conversation_id == page.c.id)
+            .scalar_subquery()
+        )
+
         statement = (
-            select(Conversation)
-            .join(ConversationParticipant)
-            .where(and_(Conversation.is_group == False, ConversationParticipant.user_id.in_([user1_id, user2_id])))
-            .group_by(Conversation.id)
+            select(
+                page.c.id,
+                page.c.conversation_name,
+                page.c.is_group,
+                page.c.last_activity,
+                aliased(Message, last_message, name="last_message"),
+                unread_count.label("unread_count"),
+                participant_ids.label("participant_ids"),
+            )
+            .select_from(page)
+            .outerjoin(last_message, true())
+            .order_by(page.c.last_activity.desc(), page.c.id.desc())
         )
+        result = await self.session.exec(statement)
+        return result.all()
 
-        conversation = (await self.session.exec(statement)).first()
-        if conversation:
-            return conversation
+    async def get_or_create_private_conversation(self, user1_id: str, user2_id: str) -> Conversation:
+        conversation_id = await self.get_or_create_private_conversation_id(user1_id, user2_id)
+        return await self.get_by_id(conversation_id)
 
-        user1_obj = await self.user_manager.get_by_id(user1_id)
-        user2_obj = await self.user_manager.get_by_id(user2_id)
+    async def get_or_create_private_conversation_id(self, user1_id: str, user2_id: str) -> uuid.UUID:
+        # a cache hit costs nothing, a miss is one lookup on the unique pair key, whatever the
+        # number of conversations the users are in.
+        key = pair_key(user1_id, user2_id)
+        conversation_id = private_conversation_index.get(key)
+        if conversation_id is not None:
+            return conversation_id
 
-        # creating a new conversation if there is no current convo...
-        conversation = Conversation(is_group=False, participants=[user1_obj, user2_obj])
-        conversation = await self.create(conversation)
+        if local_store.enabled:
+            return await self._get_or_create_private_conversation_locally(key)
 
-        return conversation
+        statement = select(Conversation.id).where(Conversation.pair_key == key)
+        conversation_id = (await self.session.exec(statement)).first()
+        if conversation_id is None:
+            conversation_id = await self._insert_private_conversation(key)
+            if conversation_id is not None:
+                # only cached once committed, the caller's transaction may still roll back.
+                return conversation_id
+            # a concurrent request created it first, the insert waited for it to commit.
+            conversation_id = (await self.session.exec(statement)).first()
+
+        private_conversation_index.set(key, conversation_id)
+        return conversation_id
+
+    async def _get_or_create_private_conversation_locally(self, key: str) -> uuid.UUID:
+        # local-first writes: nothing is written to the main database here, a new conversation goes to the
+        # local store, which syncs it before the messages referencing it. a pair created before ids were
+        # derived from it can only be found in the main database: while that is unreachable, the derived id
+        # is used and the sync of its messages fails (see LocalStore.requeue_failed).
+        try:
+            statement = select(Conversation.id).where(Conversation.pair_key == key)
+            conversation_id = (await self.session.exec(statement)).first()
+        except Exception as e:
+            print(f"Private conversation lookup failed, using the derived id: {e}")
+            await self.session.rollback()
+            conversation_id = None
+
+        if conversation_id is None:
+            conversation_id = private_conversation_id(key)
+            now = datetime.now()
+            conversation = Conversation(
+                id=conversation_id,
+                conversation_name=None,
+                is_group=False,
+                pair_key=key,
+                created_at=now,
+                last_activity=now,
+            )
+            participants = [
+                ConversationParticipant(conversation_id=conversation_id, user_id=uuid.UUID(user_id))
+                for user_id in set(key.split(":"))
+            ]
+            await local_store.write([conversation, *participants])
+
+        private_conversation_index.set(key, conversation_id)
+        return conversation_id
+
+    async def _insert_private_conversation(self, key: str) -> Optional[uuid.UUID]:
+        now = datetime.now()
+        statement = (
+            pg_insert(Conversation)
+            .values(id=private_conversation_id(key), is_group=False, pair_key=key, created_at=now, last_activity=now)
+            .on_conflict_do_nothing(index_elements=[Conversation.pair_key])
+            .returning(Conversation.id)
+        )
+        conversation_id = (await self.session.exec(statement)).scalar()
+        if conversation_id is None:
+            return None
+
+        # the canonical ids of the key, a conversation with oneself has a single participant.
+        participants = [{"conversation_id": conversation_id, "user_id": user_id} for user_id in set(key.split(":"))]
+        await self.session.exec(pg_insert(ConversationParticipant).values(participants).on_conflict_do_nothing())
+        if not self.in_unit_of_work:
+            await self.session.commit()
+        return conversation_id
+
+    async def touch(self, conversation_ids: Iterable[str], last_activity: Optional[datetime] = None):
+        # bumps last_activity with a single UPDATE, no need to load (or refresh) the conversations.
+        statement = (
+            update(Conversation)
+            .where(Conversation.id.in_(list(conversation_ids)))
+            .values(last_activity=last_activity or datetime.now())
+        )
+        await self.session.exec(statement)
+        if not self.in_unit_of_work:
+            await self.session.commit()
 
     async def add_participant(self, conversation_id: str, user_id: str) -> bool:
 
@@ -52,11 +186,7 @@ class ConversationManager(BaseManager[Conversation]):
 
         # fetching the conversation using selectinload to avoid lazy loadings in related objects.
         # lazy loading is not allowed outside an async context; it triggers errors.
-        statement = (
-            select(Conversation)
-            .options(selectinload(Conversation.participants))
-            .where(Conversation.id == conversation_id)
-        )
+        statement = select(Conversation).options(*self.WITH_PARTICIPANTS).where(Conversation.id == conversation_id)
 
         conversation = (await self.session.exec(statement)).first()
         if not conversation:
@@ -68,14 +198,13 @@ class ConversationManager(BaseManager[Conversation]):
         # conversation.validate_conversation()
 
         self.session.add(conversation)
+        await self.rotate_sender_keys(conversation_id)
         await self.session.commit()
+        await invalidate_membership(conversation_id)
         return True
 
     async def remove_participant(self, conversation_id: str, user_id: str) -> bool:
 
-        user = self.user_manager.get_by_id(user_id)
-        conversation = self.get_by_id(conversation_id)
-
         statement = select(ConversationParticipant).where(
             and_(
                 ConversationParticipant.conversation_id == conversation_id, ConversationParticipant.user_id == user_id
@@ -83,8 +212,60 @@ class ConversationManager(BaseManager[Conversation]):
         )
         participant = (await self.session.exec(statement)).first()
         if participant:
-            conversation.participants.remove(user)
-            self.session.add(conversation)
-            await self.session.commit(conversation)
+            await self.session.delete(participant)
+            await self.rotate_sender_keys(conversation_id)
+            await self.session.commit()
+            await invalidate_membership(conversation_id)
             return True
         return False
+
+    async def create_group(self, conversation_name: str, creator_id: str, member_ids: Iterable[str]) -> Conversation:
+        async with self.unit_of_work():
+            conversation = await self.create(Conversation(conversation_name=conversation_name, is_group=True))
+            participant_ids = {str(creator_id), *(str(member_id) for member_id in member_ids)}
+            self.session.add_all(
+                ConversationParticipant(conversation_id=conversation.id, user_id=participant_id)
+                for participant_id in participant_ids
+            )
+        membership_index.set(str(conversation.id), frozenset(participant_ids))
+        return conversation
+
+    async def get_participant_ids(self, conversation_id: str) -> FrozenSet[str]:
+        participant_ids = membership_index.get(str(conversation_id))
+        if participant_ids is None:
+            generation = membership_index.generation
+            statement = select(ConversationParticipant.user_id).where(
+                ConversationParticipant.conversation_id == conversation_id
+            )
+            participant_ids = frozenset(str(user_id) for user_id in (await self.session.exec(statement)).all())
+            membership_index.set(str(conversation_id), participant_ids, generation)
+        return participant_ids
+
+    async def get_active_sender_key(self, conversation_id: str, sender_id: str) -> Optional[GroupSenderKey]:
+        statement = (
+            select(GroupSenderKey)
+            .where(
+                GroupSenderKey.conversation_id == conversation_id,
+                GroupSenderKey.sender_id == sender_id,
+                GroupSenderKey.revoked == False,
+            )
+            .order_by(GroupSenderKey.created_at.desc())
+            .limit(1)
+        )
+        return (await self.session.exec(statement)).first()
+
+    async def get_sender_keys(self, sender_key_ids: Iterable[int]) -> Dict[int, GroupSenderKey]:
+        sender_key_ids = set(sender_key_ids)
+        if not sender_key_ids:
+            return {}
+        statement = select(GroupSenderKey).where(GroupSenderKey.id.in_(sender_key_ids))
+        return {sender_key.id: sender_key for sender_key in (await self.session.exec(statement)).all()}
+
+    async def rotate_sender_keys(self, conversation_id: str):
+        # revoked sender keys still decrypt the history, members just start new ones on their next send.
+        statement = (
+            update(GroupSenderKey)
+            .where(GroupSenderKey.conversation_id == conversation_id, GroupSenderKey.revoked == False)
+            .values(revoked=True)
+        )
+        await self.session.exec(statement)
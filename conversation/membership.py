@@ -0,0 +1,84 @@
+import uuid
+from collections import OrderedDict
+from typing import FrozenSet, Optional
+
+from src.config import Config as settings
+from src.websockets_conn import manager as connection_manager
+
+MEMBERSHIP_TOPIC = "membership"
+
+
+class MembershipIndex:
+    # conversation id -> participant ids, so fan-out does not hit the participants table on every send.
+    # entries are dropped on every node whenever the membership of the conversation changes (see
+    # invalidate_membership). `generation` moves on every invalidation: members read from the database
+    # before an invalidation are not put in afterwards.
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.generation = 0
+        self._members: "OrderedDict[str, FrozenSet[str]]" = OrderedDict()
+
+    def get(self, conversation_id: str) -> Optional[FrozenSet[str]]:
+        members = self._members.get(conversation_id)
+        if members is not None:
+            self._members.move_to_end(conversation_id)
+        return members
+
+    def set(self, conversation_id: str, members: FrozenSet[str], generation: Optional[int] = None):
+        if self.max_size <= 0 or (generation is not None and generation != self.generation):
+            return
+        self._members[conversation_id] = members
+        self._members.move_to_end(conversation_id)
+        while len(self._members) > self.max_size:
+            self._members.popitem(last=False)
+
+    def invalidate(self, conversation_id: str):
+        self.generation += 1
+        self._members.pop(conversation_id, None)
+
+
+class PrivateConversationIndex:
+    # pair key -> private conversation id. a pair never changes conversation, so entries are only ever
+    # evicted, and only conversations known to be committed are put in.
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._conversations: "OrderedDict[str, uuid.UUID]" = OrderedDict()
+
+    def get(self, pair_key: str) -> Optional[uuid.UUID]:
+        conversation_id = self._conversations.get(pair_key)
+        if conversation_id is not None:
+            self._conversations.move_to_end(pair_key)
+        return conversation_id
+
+    def set(self, pair_key: str, conversation_id: uuid.UUID):
+        if self.max_size <= 0:
+            return
+        self._conversations[pair_key] = conversation_id
+        self._conversations.move_to_end(pair_key)
+        while len(self._conversations) > self.max_size:
+            self._conversations.popitem(last=False)
+
+    def invalidate(self, pair_key: str):
+        self._conversations.pop(pair_key, None)
+
+
+membership_index = MembershipIndex(max_size=settings.MEMBERSHIP_INDEX_SIZE)
+private_conversation_index = PrivateConversationIndex(max_size=settings.PRIVATE_CONVERSATION_INDEX_SIZE)
+
+
+async def invalidate_membership(conversation_id: str):
+    # here right away, on the other nodes through the broker. called once the change is committed.
+    try:
+        await connection_manager.broker.broadcast(MEMBERSHIP_TOPIC, {"conversation_id": str(conversation_id)})
+    except Exception as e:
+        membership_index.invalidate(str(conversation_id))
+        print(f"Membership invalidation broadcast failed: {e}")
+
+
+async def _on_membership_changed(data: dict):
+    membership_index.invalidate(data["conversation_id"])
+
+
+connection_manager.broker.on_broadcast(MEMBERSHIP_TOPIC, _on_membership_changed)
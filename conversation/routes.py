@@ -1,24 +1,30 @@
 import json
-import os
-from typing import Annotated, List
+from typing import Annotated, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from starlette import status
 
 from auth.manager import UserManager
+from auth.principal_cache import Principal
 from auth.routes import get_current_user
-from message.schemas import MessageResponse
+from message.pagination import decode_cursor, encode_cursor, encode_keyset
+from message.receipts import push_read_receipts
+from message.schemas import (GroupMessageCreate, MessagePage, MessageResponse,
+                             ReadReceiptResponse, message_response,
+                             new_message_payload)
 from message.service import MessageService
-from src.db_config import SessionDep, user_log_file
-from src.models import User
+from src.config import Config as settings
+from src.db_config import SessionDep, async_session, message_log
+from src.websockets_conn import manager
 
 from .manager import ConversationManager
-from .schemas import ConversationResponse
+from .schemas import ConversationResponse, GroupCreate, InboxEntry, InboxPage
 
 router = APIRouter(prefix="/conversations", tags=["conversations"])
 
 # authentication dependency
-UserAuthentication = Annotated[User, Depends(get_current_user)]
+UserAuthentication = Annotated[Principal, Depends(get_current_user)]
 
 
 @router.get("/", response_model=List[ConversationResponse])
@@ -31,6 +37,52 @@ async def get_user_conversations(
     return conversations
 
 
+@router.get("/inbox", response_model=InboxPage)
+async def get_inbox(
+    session: SessionDep,
+    current_user: UserAuthentication,
+    before: Optional[str] = None,
+    limit: int = Query(default=settings.INBOX_PAGE_DEFAULT_LIMIT, ge=1, le=settings.INBOX_PAGE_MAX_LIMIT),
+):
+    message_service = MessageService(session)
+    rows = await message_service.get_inbox(str(current_user.id), limit=limit, before=decode_cursor(before))
+
+    conversations = [
+        InboxEntry(
+            id=row.id,
+            conversation_name=row.conversation_name,
+            is_group=row.is_group,
+            last_activity=row.last_activity,
+            unread_count=row.unread_count,
+            participant_ids=row.participant_ids or [],
+            last_message=message_response(row.last_message) if row.last_message else None,
+        )
+        for row in rows
+    ]
+    next_cursor = encode_keyset(rows[-1].last_activity, rows[-1].id) if len(rows) == limit else None
+    return InboxPage(conversations=conversations, next_cursor=next_cursor)
+
+
+@router.post("/groups", response_model=ConversationResponse, status_code=status.HTTP_201_CREATED)
+async def create_group(
+    group_create: GroupCreate,
+    session: SessionDep,
+    current_user: UserAuthentication,
+):
+    member_ids = {str(member_id) for member_id in group_create.participant_ids}
+    unknown_ids = member_ids - await UserManager(session).get_existing_ids(member_ids)
+    if unknown_ids:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown users: {', '.join(sorted(unknown_ids))}"
+        )
+
+    conversation_manager = ConversationManager(session)
+    conversation = await conversation_manager.create_group(
+        group_create.conversation_name, str(current_user.id), group_create.participant_ids
+    )
+    return conversation
+
+
 @router.get("/{conversation_id}", response_model=ConversationResponse)
 async def get_conversation(
     conversation_id: str,
@@ -60,6 +112,10 @@ async def get_conversation_messages(
     recipient_id: str,
     session: SessionDep,
     auth_user: UserAuthentication,
+    offset: int = Query(default=0, ge=0),
+    limit: Optional[int] = Query(default=None, ge=1),
+    tail: Optional[int] = Query(default=None, ge=1),
+    stream: bool = False,
 ):
     user_manager = UserManager(session)
     recipient = await user_manager.get_by_id(recipient_id)
@@ -67,26 +123,102 @@ async def get_conversation_messages(
     if not recipient:
         raise HTTPException(status_code=404, detail="Recipient not found")
 
-    path = user_log_file(str(auth_user.id), str(recipient.id))
+    entries = message_log.read(str(auth_user.id), str(recipient.id), offset=offset, limit=limit, tail=tail)
+
+    if stream:
+
+        async def stream_entries():
+            async for entry in entries:
+                yield json.dumps(entry) + "\n"
+
+        return StreamingResponse(stream_entries(), media_type="application/x-ndjson")
 
-    if not os.path.exists(path):
-        return {"messages": []}
-    with open(path, "r") as f:
-        messages = json.load(f)
-    return {"messages": messages}
+    return {"messages": [entry async for entry in entries]}
 
 
-@router.get("/{conversation_id}/received_messages")
+@router.get("/{conversation_id}/received_messages", response_model=MessagePage)
 async def get_conversation_messages(
     conversation_id: str,
     session: SessionDep,
     _: UserAuthentication,
-) -> List[MessageResponse]:
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(default=settings.MESSAGE_PAGE_DEFAULT_LIMIT, ge=1, le=settings.MESSAGE_PAGE_MAX_LIMIT),
+    stream: bool = False,
+):
+    before_cursor, after_cursor = decode_cursor(before), decode_cursor(after)
+
+    if stream:
+        # the request-scoped session is closed before the body is streamed,
+        # so the generator works with a session of its own.
+        async def stream_messages():
+            async with async_session() as stream_session:
+                message_service = MessageService(stream_session)
+                async for batch in message_service.iter_conversation_messages(
+                    conversation_id, before=before_cursor, after=after_cursor
+                ):
+                    for message in batch:
+                        yield message_response(message).model_dump_json() + "\n"
+
+        return StreamingResponse(stream_messages(), media_type="application/x-ndjson")
+
     message_service = MessageService(session)
+    messages = await message_service.get_conversation_messages(
+        conversation_id, before=before_cursor, after=after_cursor, limit=limit
+    )
+
+    return MessagePage(
+        messages=[message_response(message) for message in messages],
+        previous_cursor=encode_cursor(messages[0]) if messages else before,
+        next_cursor=encode_cursor(messages[-1]) if messages else after,
+    )
+
 
-    messages = await message_service.get_conversation_messages(conversation_id)
+@router.post("/{conversation_id}/messages", response_model=MessageResponse)
+async def send_group_message(
+    conversation_id: str,
+    message_create: GroupMessageCreate,
+    session: SessionDep,
+    current_user: UserAuthentication,
+):
+    if not current_user.has_key:
+        raise HTTPException(
+            status_code=404,
+            detail="Something is wrong with your account settings. Please contact support.",
+        )
 
-    return messages
+    message_service = MessageService(session)
+    message, participant_ids = await message_service.send_group_message(
+        sender_id=str(current_user.id), conversation_id=conversation_id, message_data=message_create
+    )
+
+    # a single publish reaches every other member, wherever they are connected.
+    recipient_ids = participant_ids - {str(current_user.id)}
+    seqs = {recipient_id: message_service.delivery_seq(recipient_id, message.id) for recipient_id in recipient_ids}
+    try:
+        await manager.send_to_many(
+            message=new_message_payload(message, message_create.content, seqs=seqs),
+            user_ids=recipient_ids,
+            sender_id=str(current_user.id),
+        )
+    except Exception as e:
+        print(f"Error sending WebSocket message: {e}")
+
+    return message
+
+
+@router.post("/{conversation_id}/read", response_model=ReadReceiptResponse)
+async def mark_conversation_read(
+    conversation_id: str,
+    up_to: str,
+    session: SessionDep,
+    current_user: UserAuthentication,
+):
+    # a single UPDATE marks everything received up to the cursor, however many messages that is.
+    message_service = MessageService(session)
+    receipts = await message_service.mark_read_up_to(str(current_user.id), conversation_id, decode_cursor(up_to))
+    await push_read_receipts(str(current_user.id), receipts)
+    return ReadReceiptResponse(updated=sum(len(message_ids) for message_ids in receipts.values()))
 
 
 @router.post("/{conversation_id}/participants", status_code=status.HTTP_200_OK)
@@ -94,7 +226,7 @@ async def add_participant(
     conversation_id: str,
     user_id: str,
     session: SessionDep,
-    _: User = Depends(get_current_user),
+    _: Principal = Depends(get_current_user),
 ):
     conversation_manager = ConversationManager(session)
     success = await conversation_manager.add_participant(conversation_id, user_id)
@@ -30,3 +30,23 @@ class ConversationResponse(BaseModel):
     #
     #     if not model.is_group:
     #         pass
+
+
+class GroupCreate(BaseModel):
+    conversation_name: str
+    participant_ids: List[uuid.UUID]
+
+
+class InboxEntry(BaseModel):
+    id: uuid.UUID
+    conversation_name: Optional[str]
+    is_group: bool
+    last_activity: datetime
+    unread_count: int = 0
+    participant_ids: List[uuid.UUID] = []
+    last_message: Optional[MessageResponse] = None
+
+
+class InboxPage(BaseModel):
+    conversations: List[InboxEntry]
+    next_cursor: Optional[str] = None
@@ -1 +1,4 @@
 from .auth_keys import *
+from .group_keys import *
+from .media_keys import *
+from .session_cache import *
@@ -1,4 +1,5 @@
 import os
+from typing import List, Tuple
 
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import ec
@@ -8,6 +9,8 @@ from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from auth.utils import load_private_key
 from src.models import UserKey
 
+from .session_cache import session_key_cache
+
 
 async def generate_key_pair():
     private_key = ec.generate_private_key(ec.SECP384R1())
@@ -45,8 +48,37 @@ async def decrypt_message(ciphertext: bytes, session_key: bytes, nonce: bytes) -
     return plaintext.decode()
 
 
+def encrypt_message_batch(messages: List[str], session_key: bytes) -> List[Tuple[bytes, bytes]]:
+    aesgcm = AESGCM(session_key)
+    encrypted = []
+    for message in messages:
+        nonce = os.urandom(12)
+        encrypted.append((nonce, aesgcm.encrypt(nonce, message.encode(), None)))
+    return encrypted
+
+
+def decrypt_message_batch(payloads: List[Tuple[bytes, bytes]], session_key: bytes) -> List[str]:
+    # synchronous on purpose: it is safe to run in a worker thread for large histories.
+    aesgcm = AESGCM(session_key)
+    return [aesgcm.decrypt(nonce, ciphertext, None).decode() for ciphertext, nonce in payloads]
+
+
 async def get_session_key(sender_id: str, recipient_userkey: UserKey) -> bytes:
+    sender_id = str(sender_id)
+
+    # a revoked key must never be served from the cache, drop whatever we derived from it.
+    if recipient_userkey.revoked:
+        session_key_cache.invalidate_key(recipient_userkey.id)
+    else:
+        session_key = session_key_cache.get(sender_id, recipient_userkey.id)
+        if session_key is not None:
+            return session_key
+
     sender_private_key = await load_private_key(sender_id)
     recipient_key = serialization.load_pem_public_key(recipient_userkey.public_key)
     shared_secret = await get_shared_secret(sender_private_key, recipient_key)
-    return await derive_key(shared_secret)
+    session_key = await derive_key(shared_secret)
+
+    if not recipient_userkey.revoked:
+        session_key_cache.set(sender_id, recipient_userkey.id, str(recipient_userkey.user_id), session_key)
+    return session_key
@@ -0,0 +1,36 @@
+import os
+from typing import Tuple
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from src.config import Config as settings
+from src.models import GroupSenderKey, UserKey
+
+from .auth_keys import get_session_key
+from .session_cache import SessionKeyCache
+
+# unwrapped sender keys, keyed on (sender id, GroupSenderKey id)
+sender_key_cache = SessionKeyCache(max_size=settings.SESSION_KEY_CACHE_SIZE, ttl=settings.SESSION_KEY_CACHE_TTL)
+
+
+def generate_sender_key() -> bytes:
+    return AESGCM.generate_key(bit_length=256)
+
+
+async def wrap_sender_key(sender_id: str, sender_userkey: UserKey, sender_key: bytes) -> Tuple[bytes, bytes]:
+    # the wrapping key is the ECDH of the sender's key pair with itself, only the sender's private key opens it.
+    wrapping_key = await get_session_key(sender_id, sender_userkey)
+    nonce = os.urandom(12)
+    return nonce, AESGCM(wrapping_key).encrypt(nonce, sender_key, None)
+
+
+async def get_sender_key(sender_userkey: UserKey, group_sender_key: GroupSenderKey) -> bytes:
+    sender_id = str(group_sender_key.sender_id)
+    sender_key = sender_key_cache.get(sender_id, group_sender_key.id)
+    if sender_key is not None:
+        return sender_key
+
+    wrapping_key = await get_session_key(sender_id, sender_userkey)
+    sender_key = AESGCM(wrapping_key).decrypt(group_sender_key.nonce, group_sender_key.wrapped_key, None)
+    sender_key_cache.set(sender_id, group_sender_key.id, str(group_sender_key.conversation_id), sender_key)
+    return sender_key
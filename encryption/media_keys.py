@@ -0,0 +1,27 @@
+import hashlib
+import hmac
+import os
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+# media is stored as a sequence of frames, one per plaintext chunk: nonce (12 bytes) + ciphertext + tag (16 bytes).
+# the chunk index is authenticated with every frame, frames cannot be reordered without failing to decrypt.
+CHUNK_NONCE_SIZE = 12
+CHUNK_OVERHEAD = CHUNK_NONCE_SIZE + 16
+
+
+def encrypt_chunk(aesgcm: AESGCM, index: int, chunk: bytes) -> bytes:
+    nonce = os.urandom(CHUNK_NONCE_SIZE)
+    return nonce + aesgcm.encrypt(nonce, chunk, index.to_bytes(8, "big"))
+
+
+def decrypt_chunk(aesgcm: AESGCM, index: int, frame: bytes) -> bytes:
+    return aesgcm.decrypt(frame[:CHUNK_NONCE_SIZE], frame[CHUNK_NONCE_SIZE:], index.to_bytes(8, "big"))
+
+
+def media_address_hasher(session_key: bytes) -> "hmac.HMAC":
+    # content addresses use a key of their own, derived from the session key.
+    address_key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"chat-media-address").derive(session_key)
+    return hmac.new(address_key, digestmod=hashlib.sha256)
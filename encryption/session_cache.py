@@ -0,0 +1,91 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Hashable, Tuple
+
+from src.config import Config as settings
+
+
+@dataclass
+class CachedSessionKey:
+    key: bytes
+    sender_id: str
+    recipient_id: str
+    expires_at: float
+
+
+class SessionKeyCache:
+    # bounded LRU cache of derived session keys, keyed on (sender id, recipient key id).
+    # entries also expire after `ttl` seconds so rotated keys never live forever in memory.
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Tuple[str, Hashable], CachedSessionKey]" = OrderedDict()
+
+    def get(self, sender_id: str, key_id: Hashable) -> bytes | None:
+        cache_key = (sender_id, key_id)
+        entry = self._entries.get(cache_key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if entry.expires_at <= time.monotonic():
+            del self._entries[cache_key]
+            self.evictions += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(cache_key)
+        self.hits += 1
+        return entry.key
+
+    def set(self, sender_id: str, key_id: Hashable, recipient_id: str, session_key: bytes):
+        if self.max_size <= 0:
+            return
+
+        cache_key = (sender_id, key_id)
+        self._entries[cache_key] = CachedSessionKey(
+            key=session_key,
+            sender_id=sender_id,
+            recipient_id=recipient_id,
+            expires_at=time.monotonic() + self.ttl,
+        )
+        self._entries.move_to_end(cache_key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate_key(self, key_id: Hashable):
+        for cache_key in [k for k in self._entries if k[1] == key_id]:
+            del self._entries[cache_key]
+
+    def invalidate_user(self, user_id: str):
+        # drops every pair the user takes part in, either as the sender (private key side)
+        # or as the recipient (public key side).
+        user_id = str(user_id)
+        stale = [k for k, entry in self._entries.items() if user_id in (entry.sender_id, entry.recipient_id)]
+        for cache_key in stale:
+            del self._entries[cache_key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+session_key_cache = SessionKeyCache(
+    max_size=settings.SESSION_KEY_CACHE_SIZE,
+    ttl=settings.SESSION_KEY_CACHE_TTL,
+)
@@ -0,0 +1,41 @@
+import uuid
+from typing import Dict, Iterable, Optional, Union
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from src.base import BaseManager
+from src.models import Media, MediaBlob, MediaStatus
+
+
+class MediaManager(BaseManager[Media]):
+    def __init__(self, session: AsyncSession):
+        super().__init__(session, Media)
+
+    async def get_ready(self, media_ids: Iterable[Union[str, uuid.UUID]], owner_id: str) -> Dict[uuid.UUID, Media]:
+        # the complete uploads of `owner_id` among `media_ids`, the ones a message of theirs may reference.
+        media_ids = list(media_ids)
+        if not media_ids:
+            return {}
+
+        statement = select(Media).where(
+            Media.id.in_(media_ids), Media.owner_id == owner_id, Media.status == MediaStatus.READY
+        )
+        result = await self.session.exec(statement)
+        return {media.id: media for media in result.all()}
+
+    async def get_blob(self, address: str) -> Optional[MediaBlob]:
+        return await self.session.get(MediaBlob, address)
+
+    async def complete(self, media: Media, address: str):
+        # the blob may already exist (same content uploaded before), the first one stays.
+        statement = (
+            pg_insert(MediaBlob)
+            .values(address=address, size=media.size, chunk_size=media.chunk_size)
+            .on_conflict_do_nothing()
+        )
+        await self.session.exec(statement)
+        media.blob_address = address
+        media.status = MediaStatus.READY
+        await self.update(media, refresh=False)
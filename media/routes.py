@@ -0,0 +1,92 @@
+import uuid
+from typing import Annotated
+from urllib.parse import quote
+
+from fastapi import APIRouter, Depends, Header, Request
+from fastapi.responses import StreamingResponse
+from starlette import status
+
+from auth.principal_cache import Principal
+from auth.routes import get_current_user
+from src.db_config import SessionDep, async_session
+
+from .schemas import MediaUploadCreate, MediaUploadResponse
+from .service import MediaService, receive_chunks, upload_lock
+
+router = APIRouter(prefix="/media", tags=["media"])
+
+# authentication dependency
+UserAuthentication = Annotated[Principal, Depends(get_current_user)]
+
+
+# resumable uploads: create the upload, then PATCH the content from the offset the server reports
+# (`Upload-Offset` header), as many times as needed. the media is ready once the last byte is received.
+@router.post("/uploads", response_model=MediaUploadResponse, status_code=status.HTTP_201_CREATED)
+async def create_upload(
+    upload_create: MediaUploadCreate,
+    session: SessionDep,
+    current_user: UserAuthentication,
+):
+    media_service = MediaService(session)
+    media = await media_service.create_upload(str(current_user.id), upload_create)
+    return media_service.upload_response(media)
+
+
+@router.get("/uploads/{media_id}", response_model=MediaUploadResponse)
+async def get_upload(
+    media_id: uuid.UUID,
+    session: SessionDep,
+    current_user: UserAuthentication,
+):
+    media_service = MediaService(session)
+    media = await media_service.get_upload(media_id, str(current_user.id))
+    return media_service.upload_response(media)
+
+
+@router.patch("/uploads/{media_id}", response_model=MediaUploadResponse)
+async def append_upload(
+    media_id: uuid.UUID,
+    request: Request,
+    current_user: UserAuthentication,
+    upload_offset: int = Header(alias="Upload-Offset", ge=0),
+):
+    # no request-scoped session here: a body can take long to arrive, connections are only taken around it.
+    async with upload_lock(media_id):
+        async with async_session() as session:
+            media_service = MediaService(session)
+            media = await media_service.get_upload(media_id, str(current_user.id))
+            session_key = await media_service.get_session_key(media)
+
+        await receive_chunks(media, session_key, upload_offset, request.stream())
+
+        async with async_session() as session:
+            media = await MediaService(session).complete_if_received(media, session_key)
+
+    return MediaService.upload_response(media)
+
+
+@router.get("/{media_id}")
+async def download_media(
+    media_id: uuid.UUID,
+    request: Request,
+    session: SessionDep,
+    current_user: UserAuthentication,
+):
+    media_service = MediaService(session)
+    media, blob, byte_range, content = await media_service.open_download(
+        media_id, str(current_user.id), request.headers.get("Range")
+    )
+
+    first, last = byte_range or (0, blob.size - 1)
+    headers = {"Accept-Ranges": "bytes", "Content-Length": str(last - first + 1)}
+    if byte_range:
+        headers["Content-Range"] = f"bytes {first}-{last}/{blob.size}"
+    if media.filename:
+        headers["Content-Disposition"] = f"inline; filename*=utf-8''{quote(media.filename)}"
+
+    return StreamingResponse(
+        content,
+        status_code=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+        media_type=media.mime_type or "application/octet-stream",
+        headers=headers,
+    )
@@ -0,0 +1,26 @@
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+from src.models import MediaStatus
+
+
+class MediaUploadCreate(BaseModel):
+    recipient_id: uuid.UUID
+    size: int = Field(gt=0)  # plaintext bytes
+    filename: Optional[str] = None
+    mime_type: Optional[str] = None
+
+
+class MediaUploadResponse(BaseModel):
+    id: uuid.UUID
+    recipient_id: uuid.UUID
+    filename: Optional[str] = None
+    mime_type: Optional[str] = None
+    size: int
+    chunk_size: int  # bodies should be multiples of it, a trailing partial chunk is only kept at the very end
+    offset: int  # bytes received so far, where the upload resumes
+    status: MediaStatus
+    created_at: datetime
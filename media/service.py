@@ -0,0 +1,210 @@
+import asyncio
+import uuid
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Tuple
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from fastapi import HTTPException
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette import status
+
+from auth.manager import UserManager
+from encryption import (decrypt_chunk, encrypt_chunk, get_session_key,
+                        media_address_hasher)
+from src.config import Config as settings
+from src.models import Media, MediaBlob, MediaStatus
+
+from .manager import MediaManager
+from .schemas import MediaUploadCreate, MediaUploadResponse
+from .store import media_store, upload_progress
+
+ByteRange = Tuple[int, int]  # first and last byte, both included
+
+# appends to the same upload are serialized, concurrent ones would interleave their frames.
+_upload_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+@asynccontextmanager
+async def upload_lock(media_id):
+    lock = _upload_locks.setdefault(str(media_id), asyncio.Lock())
+    async with lock:
+        yield
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[ByteRange]:
+    # a single `bytes=` range, anything else (no header, several ranges, other units) gets the whole content.
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes=") :].strip().partition("-")
+    try:
+        if start:
+            first, last = int(start), min(int(end), size - 1) if end else size - 1
+        else:
+            # `bytes=-N`, the last N bytes
+            first, last = max(size - int(end), 0), size - 1
+    except ValueError:
+        return None
+
+    if first >= size or first > last:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers={"Content-Range": f"bytes */{size}"}
+        )
+    return first, last
+
+
+async def receive_chunks(media: Media, session_key: bytes, offset: int, body: AsyncIterator[bytes]) -> int:
+    # encrypts the body chunk by chunk into the upload file and returns the new offset. the request
+    # body is consumed as it arrives, only the chunk being filled is kept in memory.
+    current, valid_bytes = upload_progress(media_store.stored_bytes(media.id), media.size, media.chunk_size)
+    if offset != current:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"the upload is at offset {current}.",
+            headers={"Upload-Offset": str(current)},
+        )
+
+    aesgcm = AESGCM(session_key)
+
+    async def frames():
+        index, received, buffer = offset // media.chunk_size, 0, bytearray()
+        async for data in body:
+            received += len(data)
+            if offset + received > media.size:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail="the body goes past the declared size of the media.",
+                )
+            buffer += data
+            while len(buffer) >= media.chunk_size:
+                chunk = bytes(buffer[: media.chunk_size])
+                del buffer[: media.chunk_size]
+                yield await asyncio.to_thread(encrypt_chunk, aesgcm, index, chunk)
+                index += 1
+
+        # a partial chunk is only kept when it ends the media, otherwise the client resends it.
+        if buffer and offset + received == media.size:
+            yield await asyncio.to_thread(encrypt_chunk, aesgcm, index, bytes(buffer))
+
+    await media_store.append_frames(media.id, valid_bytes, frames())
+    return upload_progress(media_store.stored_bytes(media.id), media.size, media.chunk_size)[0]
+
+
+class MediaService:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self.media_manager = MediaManager(session)
+        self.user_manager = UserManager(session)
+
+    async def create_upload(self, owner_id: str, upload_create: MediaUploadCreate) -> Media:
+        if upload_create.size > settings.MEDIA_MAX_SIZE:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"media can not be larger than {settings.MEDIA_MAX_SIZE} bytes.",
+            )
+        if not await self.user_manager.get_user_key(upload_create.recipient_id):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="the recipient does not use our messaging system.",
+            )
+
+        media = Media(
+            id=uuid.uuid4(),
+            owner_id=owner_id,
+            recipient_id=upload_create.recipient_id,
+            filename=upload_create.filename,
+            mime_type=upload_create.mime_type,
+            size=upload_create.size,
+            chunk_size=settings.MEDIA_CHUNK_SIZE,
+        )
+        return await self.media_manager.create(media, refresh=False)
+
+    async def get_upload(self, media_id: uuid.UUID, owner_id: str) -> Media:
+        media = await self.media_manager.get_by_id(media_id)
+        if not media or str(media.owner_id) != str(owner_id):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+        return media
+
+    @staticmethod
+    def upload_response(media: Media) -> MediaUploadResponse:
+        if media.status == MediaStatus.READY:
+            offset = media.size
+        else:
+            offset = upload_progress(media_store.stored_bytes(media.id), media.size, media.chunk_size)[0]
+        return MediaUploadResponse(
+            id=media.id,
+            recipient_id=media.recipient_id,
+            filename=media.filename,
+            mime_type=media.mime_type,
+            size=media.size,
+            chunk_size=media.chunk_size,
+            offset=offset,
+            status=media.status,
+            created_at=media.created_at,
+        )
+
+    async def get_session_key(self, media: Media) -> bytes:
+        # the pair's session key, the same whichever of the two is asking.
+        recipient_userkey = await self.user_manager.get_user_key(media.recipient_id)
+        if not recipient_userkey:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="the recipient does not use our messaging system.",
+            )
+        return await get_session_key(str(media.owner_id), recipient_userkey)
+
+    async def complete_if_received(self, media: Media, session_key: bytes) -> Media:
+        if media.status == MediaStatus.READY:
+            return media
+        offset, _ = upload_progress(media_store.stored_bytes(media.id), media.size, media.chunk_size)
+        if offset < media.size:
+            return media
+
+        # decrypting the whole upload once checks every frame and gives the content address.
+        aesgcm, hasher = AESGCM(session_key), media_address_hasher(session_key)
+        last = (media.size - 1) // media.chunk_size
+        try:
+            async for index, frame in media_store.read_frames(
+                media_store.upload_path(media.id), media.chunk_size, 0, last
+            ):
+                hasher.update(await asyncio.to_thread(decrypt_chunk, aesgcm, index, frame))
+        except InvalidTag:
+            media_store.discard(media.id)
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="the upload is corrupted, it must be sent again from offset 0.",
+            )
+
+        address = hasher.hexdigest()
+        media_store.commit(media.id, address)
+        await self.media_manager.complete(media, address)
+        return media
+
+    async def open_download(
+        self, media_id: uuid.UUID, user_id: str, range_header: Optional[str]
+    ) -> Tuple[Media, MediaBlob, Optional[ByteRange], AsyncIterator[bytes]]:
+        media = await self.media_manager.get_by_id(media_id)
+        if (
+            not media
+            or media.status != MediaStatus.READY
+            or str(user_id) not in (str(media.owner_id), str(media.recipient_id))
+        ):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Media not found")
+
+        blob = await self.media_manager.get_blob(media.blob_address)
+        byte_range = parse_range(range_header, blob.size)
+        first, last = byte_range or (0, blob.size - 1)
+        aesgcm = AESGCM(await self.get_session_key(media))
+        return media, blob, byte_range, self._decrypt_range(aesgcm, blob, first, last)
+
+    @staticmethod
+    async def _decrypt_range(aesgcm: AESGCM, blob: MediaBlob, first: int, last: int) -> AsyncIterator[bytes]:
+        # only the chunks overlapping the range are read and decrypted, one at a time.
+        chunk_size = blob.chunk_size
+        async for index, frame in media_store.read_frames(
+            media_store.object_path(blob.address), chunk_size, first // chunk_size, last // chunk_size
+        ):
+            chunk = await asyncio.to_thread(decrypt_chunk, aesgcm, index, frame)
+            chunk_start = index * chunk_size
+            yield chunk[max(first - chunk_start, 0) : last - chunk_start + 1]
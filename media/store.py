@@ -0,0 +1,83 @@
+import os
+from typing import AsyncIterator, Tuple
+
+import aiofiles
+
+from encryption import CHUNK_OVERHEAD
+from src.config import Config as settings
+
+# the local object store, encrypted frames only (see encryption.media_keys):
+#
+#     local_messages /
+#     └── media/
+#         ├── uploads/
+#         │   └── <media id>          ← frames appended while the upload is in progress
+#         └── objects/
+#             └── <ab>/<address>      ← complete and deduplicated, `ab` being the address prefix
+
+
+def frame_size(chunk_size: int) -> int:
+    return chunk_size + CHUNK_OVERHEAD
+
+
+def upload_progress(stored_bytes: int, size: int, chunk_size: int) -> Tuple[int, int]:
+    # (plaintext offset, valid stored bytes) of an upload file: every frame is complete except, possibly,
+    # the one a dropped connection or a crash interrupted, which does not count and gets overwritten.
+    full_frames, rest = divmod(stored_bytes, frame_size(chunk_size))
+    offset = full_frames * chunk_size
+    if rest and rest - CHUNK_OVERHEAD == size - offset:
+        return size, stored_bytes
+    return offset, full_frames * frame_size(chunk_size)
+
+
+class MediaStore:
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, "uploads"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+
+    def upload_path(self, media_id) -> str:
+        return os.path.join(self.directory, "uploads", str(media_id))
+
+    def object_path(self, address: str) -> str:
+        return os.path.join(self.directory, "objects", address[:2], address)
+
+    def stored_bytes(self, media_id) -> int:
+        try:
+            return os.path.getsize(self.upload_path(media_id))
+        except FileNotFoundError:
+            return 0
+
+    async def append_frames(self, media_id, valid_bytes: int, frames: AsyncIterator[bytes]):
+        # frames are written as they come, nothing but the current chunk is ever held in memory.
+        async with aiofiles.open(self.upload_path(media_id), "ab") as f:
+            await f.truncate(valid_bytes)
+            async for frame in frames:
+                await f.write(frame)
+                await f.flush()
+
+    async def read_frames(self, path: str, chunk_size: int, first: int, last: int) -> AsyncIterator[Tuple[int, bytes]]:
+        # frames `first` to `last` (included) with their index, the last frame of a file may be shorter.
+        size = frame_size(chunk_size)
+        async with aiofiles.open(path, "rb") as f:
+            await f.seek(first * size)
+            for index in range(first, last + 1):
+                yield index, await f.read(size)
+
+    def discard(self, media_id):
+        try:
+            os.remove(self.upload_path(media_id))
+        except FileNotFoundError:
+            pass
+
+    def commit(self, media_id, address: str):
+        # a complete upload becomes the object of its address, unless that content is already stored.
+        upload_path, object_path = self.upload_path(media_id), self.object_path(address)
+        if os.path.exists(object_path):
+            os.remove(upload_path)
+            return
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        os.replace(upload_path, object_path)
+
+
+media_store = MediaStore(directory=os.path.join(settings.LOCAL_DB_DIR, "media"))
@@ -1,34 +1,241 @@
-from typing import List
+import uuid
+from collections import Counter
+from typing import (AsyncIterator, Dict, Iterable, List, Optional, Sequence,
+                    Tuple)
 
+from sqlalchemy import delete, func, insert, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Row
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlmodel import Session, select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from src.base import BaseManager
-from src.models import Message
+from src.config import Config as settings
+from src.db_config import local_store
+from src.models import (Message, MessageAttachment, MessageDelivery,
+                        MessageType, UserSequence)
+
+from .pagination import Cursor
 
 
 class MessageManager(BaseManager[Message]):
     def __init__(self, session: AsyncSession):
         super().__init__(session, Message)
 
-    async def get_by_conversation(self, conversation_id: str) -> List[Message]:
-        statement = select(Message).where(Message.conversation_id == conversation_id).order_by(Message.timestamp)
+    async def bulk_create(self, messages: List[Message]) -> List[Message]:
+        # a single multi-row INSERT (executemany batched by the driver) instead of one unit-of-work
+        # flush per object. ids and defaults are python-side, so nothing needs reading back.
+        if not messages:
+            return messages
+
+        await self.session.exec(insert(Message), params=[message.model_dump() for message in messages])
+        attachments = [message.attachment for message in messages if message.attachment is not None]
+        if attachments:
+            await self.session.exec(
+                insert(MessageAttachment), params=[attachment.model_dump() for attachment in attachments]
+            )
+        if not self.in_unit_of_work:
+            await self.session.commit()
+        return messages
+
+    async def load_attachments(self, messages: Iterable[Message], use_local_db: bool = False):
+        # one query for the media messages of a page, text messages never touch the attachment table.
+        # `use_local_db` looks in the local store first, see BaseManager.get_by_id.
+        messages = [message for message in messages if message.message_type != MessageType.TEXT]
+        if not messages:
+            return
+
+        attachments = {}
+        if use_local_db and local_store.enabled:
+            for message in messages:
+                attachment = await local_store.get(MessageAttachment, message.id)
+                if attachment is not None:
+                    attachments[message.id] = attachment
+        missing = [message.id for message in messages if message.id not in attachments]
+        if missing:
+            statement = select(MessageAttachment).where(MessageAttachment.message_id.in_(missing))
+            for attachment in (await self.session.exec(statement)).all():
+                attachments[attachment.message_id] = attachment
+        for message in messages:
+            # set as loaded rather than assigned, the message is not marked as modified.
+            set_committed_value(message, "attachment", attachments.get(message.id))
+
+    async def get_by_conversation(
+        self,
+        conversation_id: str,
+        before: Optional[Cursor] = None,
+        after: Optional[Cursor] = None,
+        limit: Optional[int] = None,
+        from_oldest: bool = False,
+    ) -> List[Message]:
+        # keyset pagination on (timestamp, id), backed by ix_message_conversation_timestamp_id.
+        # the page is always returned oldest first; unless `after` or `from_oldest` is given,
+        # a limited page is the newest one before the cursor.
+        statement = select(Message).where(Message.conversation_id == conversation_id)
+        key = tuple_(Message.timestamp, Message.id)
+
+        if before:
+            statement = statement.where(key < tuple_(*before))
+        if after:
+            statement = statement.where(key > tuple_(*after))
+
+        if limit is None or after or from_oldest:
+            statement = statement.order_by(Message.timestamp, Message.id)
+            if limit is not None:
+                statement = statement.limit(limit)
+            result = await self.session.exec(statement)
+            return result.all()
+
+        statement = statement.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit)
         result = await self.session.exec(statement)
-        return result.all()
+        return list(reversed(result.all()))
+
+    async def iter_by_conversation(
+        self,
+        conversation_id: str,
+        batch_size: int,
+        before: Optional[Cursor] = None,
+        after: Optional[Cursor] = None,
+    ) -> AsyncIterator[List[Message]]:
+        while True:
+            batch = await self.get_by_conversation(
+                conversation_id, before=before, after=after, limit=batch_size, from_oldest=True
+            )
+            if not batch:
+                return
+            yield batch
+            if len(batch) < batch_size:
+                return
+            after = (batch[-1].timestamp, batch[-1].id)
 
     async def get_unread_messages(self, user_id: str) -> List[Message]:
+        # the messages still waiting in the user's delivery queue: acknowledged entries are trimmed,
+        # so this only walks what the user missed instead of their whole history.
         statement = (
             select(Message)
-            .where(Message.recipient_id == user_id, Message.is_read == False)
-            .order_by(Message.timestamp)
+            .join(MessageDelivery, MessageDelivery.message_id == Message.id)
+            .where(MessageDelivery.user_id == user_id)
+            .order_by(MessageDelivery.seq)
         )
         result = await self.session.exec(statement)
         return result.all()
 
-    async def mark_as_read(self, message_id: str) -> bool:
-        message = await self.get_by_id(message_id)
-        if message:
-            message.is_read = True
-            await self.update(message)
-            return True
-        return False
+    async def mark_as_read(self, message_ids: Iterable[str], reader_id: str) -> List[Row]:
+        # one UPDATE for any number of receipts, without loading the messages. only the recipient
+        # can mark a message as read, the (id, sender_id) of the rows that changed are returned.
+        message_ids = list(message_ids)
+        if not message_ids:
+            return []
+
+        statement = (
+            update(Message)
+            .where(Message.id.in_(message_ids), Message.recipient_id == reader_id, Message.is_read == False)
+            .values(is_read=True)
+            .returning(Message.id, Message.sender_id)
+        )
+        return await self._mark_read(statement)
+
+    async def mark_read_up_to(self, conversation_id: str, reader_id: str, up_to: Cursor) -> List[Row]:
+        # everything the reader received in the conversation up to (and including) the cursor.
+        statement = (
+            update(Message)
+            .where(
+                Message.conversation_id == conversation_id,
+                Message.recipient_id == reader_id,
+                Message.is_read == False,
+                tuple_(Message.timestamp, Message.id) <= tuple_(*up_to),
+            )
+            .values(is_read=True)
+            .returning(Message.id, Message.sender_id)
+        )
+        return await self._mark_read(statement)
+
+    async def _mark_read(self, statement) -> List[Row]:
+        rows = (await self.session.exec(statement)).all()
+        if not self.in_unit_of_work:
+            await self.session.commit()
+        return rows
+
+
+class DeliveryManager(BaseManager[MessageDelivery]):
+    def __init__(self, session: AsyncSession):
+        super().__init__(session, MessageDelivery)
+
+    async def enqueue(self, deliveries: Sequence[Tuple[str, uuid.UUID]]) -> Dict[Tuple[str, uuid.UUID], int]:
+        # takes (recipient id, message id) pairs and returns their sequence numbers. every recipient reserves
+        # its whole range with a single upsert ... RETURNING, rows are locked in user id order so concurrent
+        # senders cannot deadlock on each other's counters.
+        # the queue and its cursor are per user, not per device: it holds what none of the user's sockets
+        # acknowledged yet, a device that missed something another one acknowledged syncs from the history.
+        counts = Counter(str(user_id) for user_id, _ in deliveries)
+        if not counts:
+            return {}
+
+        statement = pg_insert(UserSequence).values(
+            [{"user_id": user_id, "last_seq": counts[user_id], "acked_seq": 0} for user_id in sorted(counts)]
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[UserSequence.user_id],
+            set_={"last_seq": UserSequence.last_seq + statement.excluded.last_seq},
+        ).returning(UserSequence.user_id, UserSequence.last_seq, UserSequence.acked_seq)
+        result = await self.session.exec(statement)
+        counters = result.all()
+        next_seq = {str(user_id): last_seq - counts[str(user_id)] for user_id, last_seq, _ in counters}
+
+        sequences, rows = {}, []
+        for user_id, message_id in deliveries:
+            user_id = str(user_id)
+            next_seq[user_id] += 1
+            sequences[(user_id, message_id)] = next_seq[user_id]
+            rows.append({"user_id": user_id, "seq": next_seq[user_id], "message_id": message_id})
+        await self.session.exec(insert(MessageDelivery), params=rows)
+
+        # a user who never acknowledges keeps at most `max_pending` entries, the oldest are dropped as if
+        # acknowledged.
+        max_pending = settings.DELIVERY_QUEUE_MAX_PENDING
+        for user_id, last_seq, acked_seq in counters:
+            if last_seq - acked_seq > max_pending:
+                await self._trim(str(user_id), last_seq - max_pending)
+
+        if not self.in_unit_of_work:
+            await self.session.commit()
+        return sequences
+
+    async def get_pending(self, user_id: str, after_seq: int, limit: int) -> List[Tuple[int, Message]]:
+        statement = (
+            select(MessageDelivery.seq, Message)
+            .join(Message, Message.id == MessageDelivery.message_id)
+            .where(MessageDelivery.user_id == user_id, MessageDelivery.seq > after_seq)
+            .order_by(MessageDelivery.seq)
+            .limit(limit)
+        )
+        result = await self.session.exec(statement)
+        return [(seq, message) for seq, message in result.all()]
+
+    async def get_acked_seq(self, user_id: str) -> int:
+        statement = select(UserSequence.acked_seq).where(UserSequence.user_id == user_id)
+        return (await self.session.exec(statement)).first() or 0
+
+    async def acknowledge(self, user_id: str, seq: int) -> int:
+        # acknowledging is cumulative, everything up to `seq` leaves the queue. returns the user's
+        # acknowledged sequence number afterwards.
+        acked_seq = await self._trim(user_id, seq)
+        if not self.in_unit_of_work:
+            await self.session.commit()
+        return acked_seq
+
+    async def _trim(self, user_id: str, seq: int) -> int:
+        # never past the last sequence number handed out: a stale client (one that cached a seq from before
+        # a reset, say) would otherwise acknowledge every message it is yet to receive.
+        result = await self.session.exec(
+            update(UserSequence)
+            .where(UserSequence.user_id == user_id)
+            .values(acked_seq=func.greatest(UserSequence.acked_seq, func.least(seq, UserSequence.last_seq)))
+            .returning(UserSequence.acked_seq)
+        )
+        acked_seq = result.scalar() or 0
+        await self.session.exec(
+            delete(MessageDelivery).where(MessageDelivery.user_id == user_id, MessageDelivery.seq <= acked_seq)
+        )
+        return acked_seq
@@ -0,0 +1,31 @@
+import base64
+import uuid
+from datetime import datetime
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+from starlette import status
+
+from src.models import Message
+
+Cursor = Tuple[datetime, uuid.UUID]
+
+
+# cursors are opaque to clients: base64 of "<iso timestamp>|<row id>"
+def encode_keyset(timestamp: datetime, row_id: uuid.UUID) -> str:
+    raw = f"{timestamp.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def encode_cursor(message: Message) -> str:
+    return encode_keyset(message.timestamp, message.id)
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Cursor]:
+    if not cursor:
+        return None
+    try:
+        timestamp, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), uuid.UUID(message_id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
@@ -0,0 +1,77 @@
+import asyncio
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set
+
+from src.db_config import async_session
+from src.websockets_conn import manager
+
+from .pagination import Cursor
+from .service import MessageService
+
+
+async def push_read_receipts(reader_id: str, receipts: Dict[str, List[str]]):
+    # every sender gets a single event listing which of their messages the reader has read.
+    for sender_id, message_ids in receipts.items():
+        try:
+            await manager.send_personal_message(
+                message={"type": "read_receipt", "data": {"reader_id": str(reader_id), "message_ids": message_ids}},
+                user_id=sender_id,
+                sender_id=str(reader_id),
+            )
+        except Exception as e:
+            print(f"Error sending read receipt: {e}")
+
+
+class ReceiptBuffer:
+    # receipts arriving over a socket are held for `window` seconds, then written with a single
+    # UPDATE per kind (ids / per conversation cursor) and pushed to the senders in one go.
+
+    def __init__(self, reader_id: str, window: float):
+        self.reader_id = reader_id
+        self.window = window
+        self.message_ids: Set[str] = set()
+        self.up_to: Dict[str, Cursor] = {}
+        self._flusher: Optional[asyncio.Task] = None
+
+    def add(self, message_ids: Iterable[str] = (), conversation_id: Optional[str] = None, up_to: Cursor = None):
+        self.message_ids.update(str(message_id) for message_id in message_ids)
+        if conversation_id and up_to:
+            self.up_to[conversation_id] = max(self.up_to.get(conversation_id, up_to), up_to)
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._flusher = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Error writing read receipts: {e}")
+
+    async def flush(self):
+        message_ids, up_to = self.message_ids, self.up_to
+        self.message_ids, self.up_to = set(), {}
+        if not message_ids and not up_to:
+            return
+
+        receipts: Dict[str, List[str]] = defaultdict(list)
+        async with async_session() as session:
+            message_service = MessageService(session)
+            async with message_service.message_manager.unit_of_work():
+                batches = [await message_service.mark_messages_as_read(self.reader_id, message_ids)]
+                for conversation_id, cursor in up_to.items():
+                    batches.append(await message_service.mark_read_up_to(self.reader_id, conversation_id, cursor))
+        for batch in batches:
+            for sender_id, sender_message_ids in batch.items():
+                receipts[sender_id].extend(sender_message_ids)
+
+        await push_read_receipts(self.reader_id, receipts)
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Error writing read receipts: {e}")
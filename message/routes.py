@@ -1,86 +1,64 @@
-from datetime import datetime
+import uuid
+from typing import Any, Dict, List, Optional
 
-from fastapi import (APIRouter, Depends, HTTPException, WebSocket,
+from fastapi import (APIRouter, Depends, HTTPException, Query, WebSocket,
                      WebSocketDisconnect, status)
+from pydantic import ValidationError
 
 from auth.manager import UserManager
-from auth.routes import decode_token, get_current_user
+from auth.principal_cache import Principal
+from auth.routes import get_current_user
+from auth.utils import preload_private_keys
+from src.config import Config as settings
 from src.db_config import SessionDep
-from src.models import User
+from src.models import MAX_SEQ
 from src.websockets_conn import manager
 
-from .schemas import MessageCreate, MessageResponse
+from .receipts import push_read_receipts
+from .schemas import (MessageBatchResponse, MessageBatchResult, MessageCreate,
+                      MessageResponse, ReadReceiptBatch, ReadReceiptResponse,
+                      SearchHit, SearchPage, message_response,
+                      new_message_payload)
+from .search import search_index
 from .service import MessageService
+from .ws_session import WebSocketSession
 
 router = APIRouter(prefix="/messages", tags=["messages"])
 
 
 @router.websocket("/{conversation_with}")
-async def websocket_endpoint(websocket: WebSocket, conversation_with: str, session: SessionDep):
-    print("in websocket endpoint")
-    token_data = decode_token(websocket.headers.get("Authorization"))
-    if not token_data:
+async def websocket_endpoint(
+    websocket: WebSocket, conversation_with: str, last_seq: Optional[int] = Query(default=None, ge=0, le=MAX_SEQ)
+):
+    # no request-scoped session here: the socket lives long, every write takes a pooled session of its own.
+    try:
+        principal = await get_current_user(websocket.headers.get("Authorization"))
+    except HTTPException:
         print("no token data")
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
 
-    user_manager = UserManager(session)
-
-    username = token_data.get("sub")
-    user_obj = await user_manager.get_by_username(username)
-
-    user_id = str(user_obj.id)
-
-    await manager.connect(websocket, str(user_id))
-
+    user_id = str(principal.id)
     try:
-        while True:
-            data = await websocket.receive_json()
-
-            message_service = MessageService(session)
-
-            message_create = MessageCreate(
-                message_type=data.get("message_type"),
-                content=data.get("content"),
-                recipient_id=conversation_with,
-                image_url=data.get("image_url"),
-                image_filename=data.get("image_filename"),
-                image_size=data.get("image_size"),
-                file_url=data.get("file_url"),
-                file_filename=data.get("file_filename"),
-                file_size=data.get("file_size"),
-                file_mime_type=data.get("file_mime_type"),
-                voice_url=data.get("voice_url"),
-                voice_filename=data.get("voice_filename"),
-            )
-
-            message = await message_service.send_message(sender_id=str(user_id), message_data=message_create)
-
-            message_payload = {
-                "type": "new_message",
-                "data": {
-                    "content": str(message_create.content),
-                    "sender_id": str(user_id),
-                    "recipient_id": str(message_create.recipient_id),
-                    "created_at": (
-                        message.created_at.isoformat()
-                        if hasattr(message, "created_at")
-                        else datetime.now().isoformat()
-                    ),
-                },
-            }
+        # the socket publishes to and looks up the recipient by its canonical id, whatever the spelling in the url.
+        conversation_with = str(uuid.UUID(conversation_with))
+    except ValueError:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
 
-            await manager.send_personal_message(
-                message=message_payload, user_id=str(message.recipient_id), sender_id=str(user_id)
-            )
+    await manager.connect(websocket, user_id, catching_up=True)
 
-            # Send confirmation back to sender
-            await websocket.send_json({"type": "message_sent", "data": message_payload})
+    # connected users are the ones encrypting, keep their private key parsed in memory.
+    await preload_private_keys([user_id])
 
+    try:
+        # `last_seq` is the last sequence number the client acknowledged, what came after it is replayed first.
+        await WebSocketSession(websocket, user_id, conversation_with).run(last_seq)
     except WebSocketDisconnect:
         await manager.disconnect(websocket, user_id)
     except Exception as e:
         print(f"WebSocket error: {e}")
+        await manager.disconnect(websocket, user_id)
         await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
 
 
@@ -131,13 +109,12 @@ async def websocket_endpoint(websocket: WebSocket, conversation_with: str, sessi
 async def send_message(
     message_create: MessageCreate,
     session: SessionDep,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
 ):
     user_manager = UserManager(session)
 
-    connected_userkey = await user_manager.get_user_key(current_user.id)
-
-    if not connected_userkey:
+    # the key status comes with the cached principal, no query needed.
+    if not current_user.has_key:
         raise HTTPException(
             status_code=404,
             detail="Something is wrong with your account settings. Please contact support.",
@@ -153,18 +130,9 @@ async def send_message(
     message_service = MessageService(session)
     message = await message_service.send_message(sender_id=str(current_user.id), message_data=message_create)
 
-    message_payload = {
-        "type": "new_message",
-        "data": {
-            # "id": str(message.id),
-            "content": str(message_create.content),
-            "sender_id": str(current_user.id),
-            "recipient_id": str(message.recipient_id),
-            "created_at": (
-                message.created_at.isoformat() if hasattr(message, "created_at") else datetime.now().isoformat()
-            ),
-        },
-    }
+    message_payload = new_message_payload(
+        message, message_create.content, seq=message_service.delivery_seq(message.recipient_id, message.id)
+    )
 
     try:
         await manager.send_personal_message(
@@ -176,16 +144,117 @@ async def send_message(
     return message
 
 
+@router.post("/batch", response_model=MessageBatchResponse)
+async def send_messages_batch(
+    payload: List[Dict[str, Any]],
+    session: SessionDep,
+    current_user: Principal = Depends(get_current_user),
+):
+    if len(payload) > settings.MESSAGE_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"a batch cannot hold more than {settings.MESSAGE_BATCH_MAX_SIZE} messages.",
+        )
+
+    # items are validated one by one so that a bad item fails alone instead of the whole batch.
+    results, items = [], []
+    for index, raw_message in enumerate(payload):
+        try:
+            items.append((index, MessageCreate.model_validate(raw_message)))
+        except ValidationError as e:
+            results.append(MessageBatchResult(index=index, status="error", error=str(e)))
+
+    message_service = MessageService(session)
+    results.extend(await message_service.send_messages_batch(sender_id=str(current_user.id), items=items))
+    results.sort(key=lambda result: result.index)
+
+    contents = {index: message_create.content for index, message_create in items}
+    for result in results:
+        if result.status != "created":
+            continue
+        try:
+            await manager.send_personal_message(
+                message=new_message_payload(
+                    result.message,
+                    contents[result.index],
+                    seq=message_service.delivery_seq(result.message.recipient_id, result.message.id),
+                ),
+                user_id=str(result.message.recipient_id),
+                sender_id=str(current_user.id),
+            )
+        except Exception as e:
+            print(f"Error sending WebSocket message: {e}")
+
+    created = sum(1 for result in results if result.status == "created")
+    return MessageBatchResponse(created=created, failed=len(results) - created, results=results)
+
+
+@router.get("/search", response_model=SearchPage)
+async def search_messages(
+    current_user: Principal = Depends(get_current_user),
+    q: str = Query(min_length=1),
+    conversation_id: Optional[str] = None,
+    limit: int = Query(default=settings.SEARCH_PAGE_DEFAULT_LIMIT, ge=1, le=settings.SEARCH_PAGE_MAX_LIMIT),
+    offset: int = Query(default=0, ge=0),
+):
+    # served from the user's local index: no database connection and nothing decrypted at query time.
+    rows = await search_index.search(str(current_user.id), q, conversation_id, limit=limit, offset=offset)
+    results = [SearchHit(**dict(row)) for row in rows]
+    return SearchPage(results=results, next_offset=offset + limit if len(results) == limit else None)
+
+
+@router.post("/search/rebuild")
+async def rebuild_search_index(
+    session: SessionDep,
+    current_user: Principal = Depends(get_current_user),
+):
+    message_service = MessageService(session)
+    indexed = await message_service.rebuild_search_index(str(current_user.id))
+    return {"indexed": indexed}
+
+
+@router.post("/read", response_model=ReadReceiptResponse)
+async def mark_messages_as_read(
+    receipt_batch: ReadReceiptBatch,
+    session: SessionDep,
+    current_user: Principal = Depends(get_current_user),
+):
+    if len(receipt_batch.message_ids) > settings.MESSAGE_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"a batch cannot hold more than {settings.MESSAGE_BATCH_MAX_SIZE} receipts.",
+        )
+
+    message_service = MessageService(session)
+    receipts = await message_service.mark_messages_as_read(str(current_user.id), receipt_batch.message_ids)
+    await push_read_receipts(str(current_user.id), receipts)
+    return ReadReceiptResponse(updated=sum(len(message_ids) for message_ids in receipts.values()))
+
+
+@router.get("/{message_id}", response_model=MessageResponse)
+async def get_message(
+    message_id: uuid.UUID,
+    session: SessionDep,
+    current_user: Principal = Depends(get_current_user),
+):
+    message_service = MessageService(session)
+    message = await message_service.get_message(str(current_user.id), str(message_id))
+    if message is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return message_response(message)
+
+
 @router.put("/{message_id}/read")
 async def mark_message_as_read(
     message_id: str,
     session: SessionDep,
-    _: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
 ):
     message_service = MessageService(session)
-    success = await message_service.mark_message_as_read(message_id)
-    if not success:
+    receipts = await message_service.mark_messages_as_read(str(current_user.id), [message_id])
+    if not receipts:
         raise HTTPException(status_code=404, detail="Message not found")
+    await push_read_receipts(str(current_user.id), receipts)
     return {"status": "success"}
 
 
@@ -193,7 +262,7 @@ async def mark_message_as_read(
 async def delete_message(
     message_id: str,
     session: SessionDep,
-    _: User = Depends(get_current_user),
+    _: Principal = Depends(get_current_user),
 ):
     message_service = MessageService(session)
     success = await message_service.delete_message(message_id)
@@ -1,41 +1,21 @@
 import uuid
 from datetime import datetime
-from typing import Optional
+from typing import Annotated, Dict, List, Literal, Optional, Union
 
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, Field, TypeAdapter, field_validator
 
-from src.models.message import MessageType
+from src.models.message import Message, MessageType
 
 
-class MessageCreate(BaseModel):
-    recipient_id: str
+class MessageContent(BaseModel):
     message_type: MessageType = MessageType.TEXT
 
     # Content fields - only populate based on message_type
     content: Optional[str] = None  # For TEXT messages
 
-    # Image message fields
-    image_url: Optional[str] = None
-    image_filename: Optional[str] = None
-    image_size: Optional[int] = None
-
-    # File message fields
-    file_url: Optional[str] = None
-    file_filename: Optional[str] = None
-    file_size: Optional[int] = None
-    file_mime_type: Optional[str] = None
-
-    # Voice message fields
-    voice_url: Optional[str] = None
-    voice_filename: Optional[str] = None
-    voice_duration: Optional[int] = None
-
-    # Video message fields
-    video_url: Optional[str] = None
-    video_filename: Optional[str] = None
-    video_size: Optional[int] = None
-    video_duration: Optional[int] = None
-    video_thumbnail_url: Optional[str] = None
+    # For the media types, an upload of the sender completed for this recipient (see media.routes)
+    media_id: Optional[uuid.UUID] = None
+    duration: Optional[int] = None  # Duration in seconds (voice, video)
 
     # Optional caption for media messages
     caption: Optional[str] = None
@@ -50,74 +30,208 @@ class MessageCreate(BaseModel):
             raise ValueError("Content should only be provided for text messages")
         return v
 
-    @field_validator("image_url")
+    @field_validator("media_id")
     @classmethod
-    def validate_image_url(cls, v, info):
+    def validate_media_id(cls, v, info):
         message_type = info.data.get("message_type")
-        if message_type == MessageType.IMAGE and not v:
-            raise ValueError("Image URL is required for image messages")
-        elif message_type != MessageType.IMAGE and v:
-            raise ValueError("Image URL should only be provided for image messages")
+        if message_type != MessageType.TEXT and not v:
+            raise ValueError("Media ID is required for media messages")
+        elif message_type == MessageType.TEXT and v:
+            raise ValueError("Media ID should only be provided for media messages")
         return v
 
-    @field_validator("file_url")
-    @classmethod
-    def validate_file_url(cls, v, info):
-        message_type = info.data.get("message_type")
-        if message_type == MessageType.FILE and not v:
-            raise ValueError("File URL is required for file messages")
-        elif message_type != MessageType.FILE and v:
-            raise ValueError("File URL should only be provided for file messages")
-        return v
 
-    @field_validator("voice_url")
-    @classmethod
-    def validate_voice_url(cls, v, info):
-        message_type = info.data.get("message_type")
-        if message_type == MessageType.VOICE and not v:
-            raise ValueError("Voice URL is required for voice messages")
-        elif message_type != MessageType.VOICE and v:
-            raise ValueError("Voice URL should only be provided for voice messages")
-        return v
+class MessageCreate(MessageContent):
+    recipient_id: str
 
-    @field_validator("video_url")
+    # one spelling per user id (case, hyphens): ids are compared and used as keys as strings downstream.
+    @field_validator("recipient_id")
     @classmethod
-    def validate_video_url(cls, v, info):
-        message_type = info.data.get("message_type")
-        if message_type == MessageType.VIDEO and not v:
-            raise ValueError("Video URL is required for video messages")
-        elif message_type != MessageType.VIDEO and v:
-            raise ValueError("Video URL should only be provided for video messages")
-        return v
+    def normalize_recipient_id(cls, v):
+        try:
+            return str(uuid.UUID(v))
+        except ValueError:
+            raise ValueError("recipient_id must be a user id")
+
+
+class GroupMessageCreate(MessageContent):
+    pass
 
 
-class MessageResponse(BaseModel):
+class MessageResponseBase(BaseModel):
     id: Optional[uuid.UUID] = None
     timestamp: Optional[datetime] = None
-    message_type: Optional[MessageType] = None
     is_read: Optional[bool] = None
     sender_id: Optional[uuid.UUID] = None
     recipient_id: Optional[uuid.UUID] = None
     conversation_id: uuid.UUID = None
 
-    # Content fields
+    class Config:
+        from_attributes = True
+
+
+class TextMessageResponse(MessageResponseBase):
+    message_type: Literal[MessageType.TEXT]
     content: Optional[str] = None
-    image_url: Optional[str] = None
-    image_filename: Optional[str] = None
-    image_size: Optional[int] = None
-    file_url: Optional[str] = None
-    file_filename: Optional[str] = None
-    file_size: Optional[int] = None
-    file_mime_type: Optional[str] = None
-    voice_url: Optional[str] = None
-    voice_filename: Optional[str] = None
-    voice_duration: Optional[int] = None
-    video_url: Optional[str] = None
-    video_filename: Optional[str] = None
-    video_size: Optional[int] = None
-    video_duration: Optional[int] = None
-    video_thumbnail_url: Optional[str] = None
-    caption: Optional[str] = None
+
+
+# every media type only exposes the attachment fields it uses.
+class ImageAttachment(BaseModel):
+    media_id: Optional[uuid.UUID] = None  # download it from /media/{media_id}
+    url: Optional[str] = None
+    filename: Optional[str] = None
+    mime_type: Optional[str] = None
+    size: Optional[int] = None
 
     class Config:
         from_attributes = True
+
+
+class FileAttachment(BaseModel):
+    media_id: Optional[uuid.UUID] = None
+    url: Optional[str] = None
+    filename: Optional[str] = None
+    size: Optional[int] = None
+    mime_type: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+
+class VoiceAttachment(BaseModel):
+    media_id: Optional[uuid.UUID] = None
+    url: Optional[str] = None
+    filename: Optional[str] = None
+    mime_type: Optional[str] = None
+    duration: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+
+class VideoAttachment(BaseModel):
+    media_id: Optional[uuid.UUID] = None
+    url: Optional[str] = None
+    filename: Optional[str] = None
+    mime_type: Optional[str] = None
+    size: Optional[int] = None
+    duration: Optional[int] = None
+    thumbnail_url: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+
+class ImageMessageResponse(MessageResponseBase):
+    message_type: Literal[MessageType.IMAGE]
+    attachment: Optional[ImageAttachment] = None
+    caption: Optional[str] = None
+
+
+class FileMessageResponse(MessageResponseBase):
+    message_type: Literal[MessageType.FILE]
+    attachment: Optional[FileAttachment] = None
+    caption: Optional[str] = None
+
+
+class VoiceMessageResponse(MessageResponseBase):
+    message_type: Literal[MessageType.VOICE]
+    attachment: Optional[VoiceAttachment] = None
+    caption: Optional[str] = None
+
+
+class VideoMessageResponse(MessageResponseBase):
+    message_type: Literal[MessageType.VIDEO]
+    attachment: Optional[VideoAttachment] = None
+    caption: Optional[str] = None
+
+
+# the response shape follows `message_type`, a text message serializes none of the media fields.
+MessageResponse = Annotated[
+    Union[TextMessageResponse, ImageMessageResponse, FileMessageResponse, VoiceMessageResponse, VideoMessageResponse],
+    Field(discriminator="message_type"),
+]
+
+message_response_adapter = TypeAdapter(MessageResponse)
+
+
+def message_response(message: Message) -> MessageResponseBase:
+    # media messages must have their attachment loaded (see MessageManager.load_attachments).
+    return message_response_adapter.validate_python(message, from_attributes=True)
+
+
+class MessagePage(BaseModel):
+    messages: List[MessageResponse]
+    # pass as `before` to fetch older messages, or as `after` to fetch newer ones.
+    previous_cursor: Optional[str] = None
+    next_cursor: Optional[str] = None
+
+
+class MessageBatchResult(BaseModel):
+    index: int
+    status: str  # "created" or "error"
+    message: Optional[MessageResponse] = None
+    error: Optional[str] = None
+
+
+class MessageBatchResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[MessageBatchResult]
+
+
+class ReadReceiptBatch(BaseModel):
+    message_ids: List[uuid.UUID]
+
+
+class ReadReceiptResponse(BaseModel):
+    updated: int
+
+
+class SearchHit(BaseModel):
+    message_id: uuid.UUID
+    conversation_id: uuid.UUID
+    sender_id: uuid.UUID
+    timestamp: datetime
+    snippet: str
+    rank: float  # bm25, lower is more relevant
+
+
+class SearchPage(BaseModel):
+    results: List[SearchHit]
+    next_offset: Optional[int] = None
+
+
+def new_message_payload(
+    message: Union[Message, MessageResponseBase],
+    content: Optional[str],
+    seq: Optional[int] = None,
+    seqs: Optional[Dict[str, int]] = None,
+) -> dict:
+    # `seq` is the message position in the recipient's delivery queue (`seqs` per member for group messages),
+    # clients acknowledge it so the message is not replayed on their next connection. a message not queued yet
+    # (local-first) goes out without one and gets it later, see delivery_seq_payload; the id dedupes the replay.
+    payload = {
+        "type": "new_message",
+        "data": {
+            "id": str(message.id),
+            "content": str(content),
+            "sender_id": str(message.sender_id),
+            # none for group messages, they go to every member of the conversation.
+            "recipient_id": str(message.recipient_id) if message.recipient_id is not None else None,
+            "conversation_id": str(message.conversation_id),
+            "created_at": (
+                message.created_at.isoformat() if hasattr(message, "created_at") else datetime.now().isoformat()
+            ),
+        },
+    }
+    if seq is not None:
+        payload["data"]["seq"] = seq
+    if seqs is not None:
+        payload["data"]["seqs"] = seqs
+    return payload
+
+
+def delivery_seq_payload(message_id: uuid.UUID, seq: int) -> dict:
+    # the seq of a message delivered live before it had one (local-first sends are queued once synced).
+    return {"type": "delivery_seq", "message_id": str(message_id), "seq": seq}
@@ -0,0 +1,214 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+
+from src.config import Config as settings
+from src.models import Message
+
+# one SQLite database per user, holding an FTS5 index of the plaintext of their history:
+#
+#     local_messages /
+#     └── search/
+#         └── <user id>.db
+
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(
+    content,
+    message_id UNINDEXED,
+    conversation_id UNINDEXED,
+    sender_id UNINDEXED,
+    timestamp UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+)
+"""
+
+# the rowid of every indexed message, so indexing it again replaces its row instead of adding a copy.
+# indexes written before the table existed keep their rowids and lose their duplicates.
+KEY_SCHEMA = """
+BEGIN;
+CREATE TABLE message_key (id INTEGER PRIMARY KEY, message_id TEXT NOT NULL UNIQUE);
+INSERT OR IGNORE INTO message_key (id, message_id) SELECT rowid, message_id FROM message_fts ORDER BY rowid;
+DELETE FROM message_fts WHERE rowid NOT IN (SELECT id FROM message_key);
+COMMIT;
+"""
+
+# (message id, conversation id, sender id, timestamp, content)
+IndexEntry = Tuple[str, str, str, str, str]
+
+
+def index_entry(message: Message, plaintext: Optional[str]) -> Optional[IndexEntry]:
+    text = plaintext or message.caption
+    if not text:
+        return None
+    return (
+        str(message.id),
+        str(message.conversation_id),
+        str(message.sender_id),
+        message.timestamp.isoformat(),
+        text,
+    )
+
+
+def user_key(user_id) -> str:
+    # names the user's database file, the same for any spelling of the id.
+    return str(uuid.UUID(str(user_id)))
+
+
+def match_expression(query: str) -> str:
+    # every term is quoted so user input can never be read as FTS5 syntax, the last one
+    # also matches as a prefix so results show up while typing.
+    terms = ['"' + term.replace('"', '""') + '"' for term in query.split()]
+    if terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+class SearchIndex:
+    # all the SQLite work runs on a single worker thread, which keeps connections single-threaded
+    # and orders a search after the writes queued before it. writes are buffered and the worker
+    # commits everything pending in one transaction per user, so indexing never slows a send down.
+
+    def __init__(self, directory: str, max_connections: int):
+        self.directory = directory
+        self.max_connections = max_connections
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-index")
+        self._connections: "OrderedDict[str, sqlite3.Connection]" = OrderedDict()
+        self._pending: List[Tuple[str, IndexEntry]] = []
+        self._pending_lock = threading.Lock()
+        self._flush_scheduled = False
+
+    def add(self, user_ids: Iterable[str], entries: Iterable[IndexEntry]):
+        entries = [entry for entry in entries if entry is not None]
+        if not entries:
+            return
+        # a message to oneself is indexed once.
+        user_ids = {user_key(user_id) for user_id in user_ids}
+        with self._pending_lock:
+            self._pending.extend((user_id, entry) for user_id in user_ids for entry in entries)
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        asyncio.get_running_loop().run_in_executor(self._executor, self._flush)
+
+    async def search(
+        self, user_id: str, query: str, conversation_id: Optional[str], limit: int, offset: int
+    ) -> List[sqlite3.Row]:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._search, user_key(user_id), query, conversation_id, limit, offset
+        )
+
+    async def clear(self, user_id: str):
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._clear, user_key(user_id))
+
+    async def write(self, user_id: str, entries: Iterable[IndexEntry]):
+        entries = [entry for entry in entries if entry is not None]
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._write, user_key(user_id), entries)
+
+    async def optimize(self, user_id: str):
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._optimize, user_key(user_id))
+
+    def stop(self):
+        self._executor.submit(self._flush)
+        self._executor.submit(self._close_connections)
+        self._executor.shutdown(wait=True)
+
+    def _connection(self, user_id: str) -> sqlite3.Connection:
+        connection = self._connections.get(user_id)
+        if connection is not None:
+            self._connections.move_to_end(user_id)
+            return connection
+
+        os.makedirs(self.directory, exist_ok=True)
+        connection = sqlite3.connect(os.path.join(self.directory, f"{user_id}.db"))
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(SCHEMA)
+        if connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'message_key'").fetchone() is None:
+            connection.executescript(KEY_SCHEMA)
+        self._connections[user_id] = connection
+        while len(self._connections) > self.max_connections:
+            _, evicted = self._connections.popitem(last=False)
+            evicted.close()
+        return connection
+
+    def _flush(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+            self._flush_scheduled = False
+
+        by_user = defaultdict(list)
+        for user_id, entry in pending:
+            by_user[user_id].append(entry)
+
+        for user_id, entries in by_user.items():
+            try:
+                self._write(user_id, entries)
+            except sqlite3.Error as e:
+                print(f"Search index write failed: {e}")
+
+    def _write(self, user_id: str, entries: List[IndexEntry]):
+        # a message indexed again (a rebuild racing a send, a retried write) replaces its row.
+        entries = list({entry[0]: entry for entry in entries}.values())
+        with self._connection(user_id) as connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO message_key (message_id) VALUES (?)", [(entry[0],) for entry in entries]
+            )
+            rows, statement = [], "SELECT id FROM message_key WHERE message_id = ?"
+            for entry in entries:
+                (rowid,) = connection.execute(statement, (entry[0],)).fetchone()
+                rows.append((rowid, *entry))
+            connection.executemany("DELETE FROM message_fts WHERE rowid = ?", [(row[0],) for row in rows])
+            connection.executemany(
+                "INSERT INTO message_fts (rowid, message_id, conversation_id, sender_id, timestamp, content) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def _search(
+        self, user_id: str, query: str, conversation_id: Optional[str], limit: int, offset: int
+    ) -> List[sqlite3.Row]:
+        expression = match_expression(query)
+        if not expression:
+            return []
+
+        statement = (
+            "SELECT message_id, conversation_id, sender_id, timestamp, "
+            "snippet(message_fts, 0, '[', ']', '...', 12) AS snippet, bm25(message_fts) AS rank "
+            "FROM message_fts WHERE message_fts MATCH ?"
+        )
+        params = [expression]
+        if conversation_id:
+            statement += " AND conversation_id = ?"
+            params.append(str(conversation_id))
+        statement += " ORDER BY rank LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+
+        return self._connection(user_id).execute(statement, params).fetchall()
+
+    def _clear(self, user_id: str):
+        # what is still buffered is part of the history about to be re-indexed.
+        self._flush()
+        with self._connection(user_id) as connection:
+            connection.execute("DELETE FROM message_fts")
+            connection.execute("DELETE FROM message_key")
+
+    def _optimize(self, user_id: str):
+        with self._connection(user_id) as connection:
+            connection.execute("INSERT INTO message_fts (message_fts) VALUES ('optimize')")
+
+    def _close_connections(self):
+        for connection in self._connections.values():
+            connection.close()
+        self._connections.clear()
+
+
+search_index = SearchIndex(
+    directory=os.path.join(settings.LOCAL_DB_DIR, "search"),
+    max_connections=settings.SEARCH_INDEX_CONNECTIONS,
+)
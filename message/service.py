@@ -1,22 +1,64 @@
+import asyncio
 import base64
+import uuid
+from collections import defaultdict
 from datetime import datetime
-from typing import List, Optional
+from typing import (AsyncIterator, Dict, FrozenSet, Iterable, List, Optional,
+                    Tuple)
 
 from cryptography.hazmat.primitives import serialization
 from fastapi import HTTPException
-from sqlmodel import select
+from sqlalchemy.engine import Row
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlmodel.ext.asyncio.session import AsyncSession
 from starlette import status
 
 from auth.manager import UserManager
 from auth.utils import load_private_key
 from conversation.manager import ConversationManager
-from encryption import decrypt_message, encrypt_message, get_session_key
-from src.db_config import register_sent_messages
-from src.models import Conversation, Message, MessageType, UserKey
+from encryption import (decrypt_message_batch, encrypt_message,
+                        encrypt_message_batch, generate_sender_key,
+                        get_sender_key, get_session_key, wrap_sender_key)
+from media.manager import MediaManager
+from src.config import Config as settings
+from src.db_config import local_store, register_sent_messages
+from src.models import (Conversation, ConversationParticipant, GroupSenderKey,
+                        Media, Message, MessageAttachment, MessageType,
+                        UserKey)
+from src.websockets_conn import manager
 
-from .manager import MessageManager
-from .schemas import MessageCreate
+from .manager import DeliveryManager, MessageManager
+from .pagination import Cursor
+from .schemas import (GroupMessageCreate, MessageBatchResult, MessageContent,
+                      MessageCreate, delivery_seq_payload, message_response)
+from .search import index_entry, search_index
+
+
+async def _on_messages_synced(session: AsyncSession, messages: List[Message]):
+    # messages written to the local store are queued for their recipients (and bump their
+    # conversations) in the transaction that finally inserts them in the main database.
+    delivery_manager = DeliveryManager(session)
+    async with delivery_manager.unit_of_work():
+        sequences = await delivery_manager.enqueue([(message.recipient_id, message.id) for message in messages])
+        await ConversationManager(session).touch({message.conversation_id for message in messages})
+
+    # their live frames went out without a seq, once committed the recipients get it so that their
+    # next cumulative ack covers these messages too.
+    senders = {message.id: str(message.sender_id) for message in messages}
+    for (recipient_id, message_id), seq in sequences.items():
+        try:
+            await manager.send_personal_message(
+                message=delivery_seq_payload(message_id, seq), user_id=recipient_id, sender_id=senders[message_id]
+            )
+        except Exception as e:
+            print(f"Error sending delivery seq: {e}")
+
+
+# parents first: private conversations created by local-first sends, then the messages referencing them.
+local_store.register(Conversation)
+local_store.register(ConversationParticipant)
+local_store.register(Message, after_sync=_on_messages_synced)
+local_store.register(MessageAttachment)
 
 
 class MessageService:
@@ -25,28 +67,53 @@ class MessageService:
         self.message_manager = MessageManager(session)
         self.conversation_manager = ConversationManager(session)
         self.user_manager = UserManager(session)
+        self.delivery_manager = DeliveryManager(session)
+        self.media_manager = MediaManager(session)
+        # (recipient id, message id) -> sequence number in the recipient's delivery queue
+        self.sequences: Dict[Tuple[str, uuid.UUID], int] = {}
         # self.notification_service = NotificationService()
 
     async def send_message(self, sender_id: str, message_data: MessageCreate) -> Message:
 
-        recipient_userkey = (
-            await self.session.exec(select(UserKey).where(UserKey.user_id == message_data.recipient_id))
-        ).first()
+        recipient_userkey = await self.user_manager.get_user_key(message_data.recipient_id)
         if not recipient_userkey:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="the recipient does not use our messaging system.",
             )
+        media = await self._get_media(sender_id, [message_data])
+
+        if local_store.enabled:
+            conversation_id = await self.conversation_manager.get_or_create_private_conversation_id(
+                sender_id, message_data.recipient_id
+            )
+            session_key = await get_session_key(sender_id, recipient_userkey)
+            [message] = self._build_messages(sender_id, conversation_id, session_key, [message_data], media)
+            await self._write_local([message])
+        else:
+            # the whole send (conversation, message, last activity) is committed once.
+            async with self.message_manager.unit_of_work():
+                message = await self._store_message(sender_id, message_data, recipient_userkey, media)
+
+        register_sent_messages(sender_id, message_data.recipient_id, message_data.content)
+        search_index.add([sender_id, message_data.recipient_id], [index_entry(message, message_data.content)])
+
+        return message
+
+    async def _store_message(
+        self, sender_id: str, message_data: MessageCreate, recipient_userkey: UserKey, media: Dict[uuid.UUID, Media]
+    ) -> Message:
         # Get or create a conversation if the user is registered with our system.
-        conversation = await self.conversation_manager.get_or_create_private_conversation(
+        conversation_id = await self.conversation_manager.get_or_create_private_conversation_id(
             sender_id, message_data.recipient_id
         )
 
         # Create messages with appropriate fields based on type
         message_dict = {
+            "id": uuid.uuid4(),
             "sender_id": sender_id,
             "recipient_id": message_data.recipient_id,
-            "conversation_id": conversation.id,
+            "conversation_id": conversation_id,
             "message_type": message_data.message_type,
         }
         nonce = None
@@ -58,80 +125,281 @@ class MessageService:
             nonce, cipher_text = await encrypt_message(message_data.content, session_key=session_key)
 
             message_dict["content"] = base64.b64encode(cipher_text).decode("utf-8")
-        elif message_data.message_type == MessageType.IMAGE:
-            message_dict.update(
-                {
-                    "image_url": message_data.image_url,
-                    "image_filename": message_data.image_filename,
-                    "image_size": message_data.image_size,
-                }
+
+        message = self._attach_media(Message(nonce=nonce, **message_dict), message_data, media)
+        message = await self.message_manager.create(message, refresh=False)
+        await self._enqueue_deliveries([(message_data.recipient_id, message.id)])
+
+        # Update conversation last activity
+        await self.conversation_manager.touch([conversation_id], message.timestamp)
+
+        return message
+
+    async def send_messages_batch(
+        self, sender_id: str, items: List[Tuple[int, MessageCreate]]
+    ) -> List[MessageBatchResult]:
+        # `items` are (position in the request, validated message) pairs, every one of them gets its own result.
+        results: Dict[int, MessageBatchResult] = {}
+
+        user_keys = await self.user_manager.get_user_keys(message_data.recipient_id for _, message_data in items)
+        media = await self._get_media(sender_id, [message_data for _, message_data in items])
+
+        by_recipient: Dict[str, List[Tuple[int, MessageCreate]]] = defaultdict(list)
+        for index, message_data in items:
+            if message_data.recipient_id not in user_keys:
+                results[index] = MessageBatchResult(
+                    index=index, status="error", error="the recipient does not use our messaging system."
+                )
+                continue
+            media_error = self._media_error(message_data, media)
+            if media_error:
+                results[index] = MessageBatchResult(index=index, status="error", error=media_error)
+                continue
+            by_recipient[message_data.recipient_id].append((index, message_data))
+
+        # one session key per pair. the sender's missing private key fails their items, not the whole batch.
+        session_keys: Dict[str, bytes] = {}
+        for recipient_id, recipient_items in list(by_recipient.items()):
+            try:
+                session_keys[recipient_id] = await get_session_key(sender_id, user_keys[recipient_id])
+            except HTTPException as e:
+                for index, _ in recipient_items:
+                    results[index] = MessageBatchResult(index=index, status="error", error=e.detail)
+                del by_recipient[recipient_id]
+
+        created: List[Tuple[int, Message, MessageCreate]] = []
+        async with self.message_manager.unit_of_work():
+            conversation_ids = []
+            for recipient_id, recipient_items in by_recipient.items():
+                conversation_id = await self.conversation_manager.get_or_create_private_conversation_id(
+                    sender_id, recipient_id
+                )
+                conversation_ids.append(conversation_id)
+
+                # all of the pair's texts encrypted in one go.
+                messages = self._build_messages(
+                    sender_id,
+                    conversation_id,
+                    session_keys[recipient_id],
+                    [message_data for _, message_data in recipient_items],
+                    media,
+                )
+                created.extend(
+                    (index, message, message_data) for (index, message_data), message in zip(recipient_items, messages)
+                )
+
+            await self.message_manager.bulk_create([message for _, message, _ in created])
+            await self._enqueue_deliveries([(message.recipient_id, message.id) for _, message, _ in created])
+            if conversation_ids:
+                await self.conversation_manager.touch(conversation_ids)
+
+        for index, message, message_data in created:
+            register_sent_messages(sender_id, message_data.recipient_id, message_data.content)
+            search_index.add([sender_id, message_data.recipient_id], [index_entry(message, message_data.content)])
+            results[index] = MessageBatchResult(index=index, status="created", message=message_response(message))
+
+        return [results[index] for index in sorted(results)]
+
+    async def send_bound_messages(
+        self, sender_id: str, recipient_userkey: UserKey, conversation_id: uuid.UUID, items: List[MessageCreate]
+    ) -> List[Message]:
+        # for callers that already resolved the recipient key and the conversation (the websocket loop),
+        # the whole batch is a single INSERT plus the last activity UPDATE.
+        session_key = await get_session_key(sender_id, recipient_userkey)
+        media = await self._get_media(sender_id, items)
+        messages = self._build_messages(sender_id, conversation_id, session_key, items, media)
+        if local_store.enabled:
+            await self._write_local(messages)
+        else:
+            async with self.message_manager.unit_of_work():
+                await self.message_manager.bulk_create(messages)
+                await self._enqueue_deliveries([(message.recipient_id, message.id) for message in messages])
+                await self.conversation_manager.touch([conversation_id])
+
+        for message_data in items:
+            register_sent_messages(sender_id, message_data.recipient_id, message_data.content)
+        if messages:
+            search_index.add(
+                [sender_id, messages[0].recipient_id],
+                [index_entry(message, message_data.content) for message, message_data in zip(messages, items)],
             )
-        elif message_data.message_type == MessageType.FILE:
-            message_dict.update(
-                {
-                    "file_url": message_data.file_url,
-                    "file_filename": message_data.file_filename,
-                    "file_size": message_data.file_size,
-                    "file_mime_type": message_data.file_mime_type,
-                }
+
+        return messages
+
+    @staticmethod
+    async def _write_local(messages: List[Message]):
+        attachments = [message.attachment for message in messages if message.attachment is not None]
+        await local_store.write(messages + attachments)
+
+    def _build_messages(
+        self,
+        sender_id: str,
+        conversation_id: uuid.UUID,
+        session_key: bytes,
+        items: List[MessageCreate],
+        media: Dict[uuid.UUID, Media],
+    ) -> List[Message]:
+        texts = [message_data.content for message_data in items if message_data.message_type == MessageType.TEXT]
+        encrypted = iter(encrypt_message_batch(texts, session_key))
+
+        messages = []
+        for message_data in items:
+            nonce, cipher_text = next(encrypted) if message_data.message_type == MessageType.TEXT else (None, None)
+            message = Message(
+                id=uuid.uuid4(),
+                sender_id=sender_id,
+                recipient_id=message_data.recipient_id,
+                conversation_id=conversation_id,
+                message_type=message_data.message_type,
+                content=base64.b64encode(cipher_text).decode("utf-8") if cipher_text else None,
+                nonce=nonce,
             )
-        elif message_data.message_type == MessageType.VOICE:
-            message_dict.update(
-                {
-                    "voice_url": message_data.voice_url,
-                    "voice_filename": message_data.voice_filename,
-                    "voice_duration": message_data.voice_duration,
-                }
+            messages.append(self._attach_media(message, message_data, media))
+        return messages
+
+    async def send_group_message(
+        self, sender_id: str, conversation_id: str, message_data: GroupMessageCreate
+    ) -> Tuple[Message, FrozenSet[str]]:
+        conversation = await self.conversation_manager.get_by_id(conversation_id)
+        if not conversation or not conversation.is_group:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Group conversation not found")
+
+        # uploads are encrypted for a pair of users, groups have no such key.
+        if message_data.message_type != MessageType.TEXT:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="media messages are only supported in private conversations.",
             )
-        elif message_data.message_type == MessageType.VIDEO:
-            message_dict.update(
-                {
-                    "video_url": message_data.video_url,
-                    "video_filename": message_data.video_filename,
-                    "video_size": message_data.video_size,
-                    "video_duration": message_data.video_duration,
-                    "video_thumbnail_url": message_data.video_thumbnail_url,
-                }
+
+        participant_ids = await self.conversation_manager.get_participant_ids(conversation_id)
+        if str(sender_id) not in participant_ids:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a member of this conversation")
+
+        sender_userkey = (await self.user_manager.get_user_keys([sender_id])).get(str(sender_id))
+        if not sender_userkey:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Generate your encryption key before sending messages.",
             )
 
-        # Add caption if provided
-        if message_data.caption:
-            message_dict["caption"] = message_data.caption
+        # the message is encrypted once with the sender's group key, whatever the number of members.
+        async with self.message_manager.unit_of_work():
+            group_sender_key = await self.conversation_manager.get_active_sender_key(conversation_id, sender_id)
+            if group_sender_key is None:
+                sender_key = generate_sender_key()
+                nonce, wrapped_key = await wrap_sender_key(str(sender_id), sender_userkey, sender_key)
+                group_sender_key = await self.conversation_manager.create(
+                    GroupSenderKey(
+                        conversation_id=conversation_id, sender_id=sender_id, wrapped_key=wrapped_key, nonce=nonce
+                    )
+                )
+            else:
+                sender_key = await get_sender_key(sender_userkey, group_sender_key)
 
-        message = Message(nonce=nonce, **message_dict)
-        message = await self.message_manager.create(message)
+            message = Message(
+                id=uuid.uuid4(),
+                sender_id=sender_id,
+                conversation_id=conversation_id,
+                message_type=message_data.message_type,
+                sender_key_id=group_sender_key.id,
+            )
+            if message_data.caption:
+                message.caption = message_data.caption
+            if message_data.message_type == MessageType.TEXT:
+                message.nonce, cipher_text = await encrypt_message(message_data.content, session_key=sender_key)
+                message.content = base64.b64encode(cipher_text).decode("utf-8")
 
-        register_sent_messages(sender_id, message_data.recipient_id, message_data.content)
+            message = await self.message_manager.create(message, refresh=False)
+            recipient_ids = participant_ids - {str(sender_id)}
+            await self._enqueue_deliveries([(recipient_id, message.id) for recipient_id in recipient_ids])
+            await self.conversation_manager.touch([conversation_id], message.timestamp)
 
-        # Update conversation last activity
-        conversation.last_activity = datetime.now()
-        await self.conversation_manager.update(conversation)
+        register_sent_messages(sender_id, str(conversation_id), message_data.content)
+        search_index.add(participant_ids, [index_entry(message, message_data.content)])
+
+        return message, participant_ids
+
+    async def _enqueue_deliveries(self, deliveries: List[Tuple[str, uuid.UUID]]):
+        # same transaction as the messages: a stored message is always queued for its recipients.
+        self.sequences.update(await self.delivery_manager.enqueue(deliveries))
+
+    def delivery_seq(self, user_id: str, message_id: uuid.UUID) -> Optional[int]:
+        return self.sequences.get((str(user_id), message_id))
+
+    async def get_pending_deliveries(self, user_id: str, after_seq: int, limit: int) -> List[Tuple[int, Message]]:
+        pending = await self.delivery_manager.get_pending(user_id, after_seq, limit)
+        await self.decrypt_messages([message for _, message in pending])
+        return pending
+
+    async def get_unread_messages(self, user_id: str) -> List[Message]:
+        messages = await self.message_manager.get_unread_messages(user_id)
+        await self.message_manager.load_attachments(messages)
+        return await self.decrypt_messages(messages)
+
+    async def _get_media(self, sender_id: str, items: List[MessageContent]) -> Dict[uuid.UUID, Media]:
+        # the uploads referenced by `items`, in one query.
+        return await self.media_manager.get_ready(
+            {message_data.media_id for message_data in items if message_data.media_id}, sender_id
+        )
+
+    @staticmethod
+    def _media_error(message_data: MessageCreate, media: Dict[uuid.UUID, Media]) -> Optional[str]:
+        if message_data.message_type == MessageType.TEXT:
+            return None
+        upload = media.get(message_data.media_id)
+        if upload is None or str(upload.recipient_id) != str(message_data.recipient_id):
+            return "the media must be a complete upload of yours for this recipient."
+        return None
+
+    def _attach_media(self, message: Message, message_data: MessageCreate, media: Dict[uuid.UUID, Media]) -> Message:
+        media_error = self._media_error(message_data, media)
+        if media_error:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=media_error)
+
+        if message_data.message_type != MessageType.TEXT:
+            # what the server knows of the upload is copied, the client only tells the duration.
+            upload = media[message_data.media_id]
+            message.attachment = MessageAttachment(
+                message_id=message.id,
+                media_id=upload.id,
+                filename=upload.filename,
+                size=upload.size,
+                mime_type=upload.mime_type,
+                duration=message_data.duration,
+            )
+
+        # Add caption if provided
+        if message_data.caption:
+            message.caption = message_data.caption
 
         return message
 
     async def get_conversation(self, conversation_id: str) -> Optional[Conversation]:
-        return await self.conversation_manager.get_by_id(conversation_id)
+        conversation = await self.conversation_manager.get_by_id(
+            conversation_id, options=ConversationManager.WITH_MESSAGES
+        )
+        if conversation is not None:
+            await self.message_manager.load_attachments(conversation.messages)
+        return conversation
 
-    async def get_conversation_messages(self, conversation_id: str) -> List[Message]:
-        received_messages = await self.message_manager.get_by_conversation(conversation_id)
+    async def get_conversation_messages(
+        self,
+        conversation_id: str,
+        before: Optional[Cursor] = None,
+        after: Optional[Cursor] = None,
+        limit: Optional[int] = None,
+    ) -> List[Message]:
+        received_messages = await self.message_manager.get_by_conversation(
+            conversation_id, before=before, after=after, limit=limit
+        )
+        await self.message_manager.load_attachments(received_messages)
+        await self.decrypt_messages(received_messages)
 
         # sent_messages = []
         # recipient_id = None
         # sender_id = None
         # read_participants = False
 
-        for message in received_messages:
-
-            if message.message_type == MessageType.TEXT and message.content:
-                recipient_userkey = await self.user_manager.get_user_key(message.recipient_id)
-                session_key = await get_session_key(str(message.sender_id), recipient_userkey)
-
-                # Decrypt the message content
-                decrypted_message = await decrypt_message(
-                    base64.b64decode(message.content), session_key, message.nonce
-                )
-                message.content = decrypted_message
-
         # ToDo: logic of merging local-based and database message for displaying...
 
         # json_file = user_log_file(sender_id, recipient_id)
@@ -152,11 +420,128 @@ class MessageService:
 
         return received_messages
 
-    async def mark_message_as_read(self, message_id: str) -> bool:
-        return await self.message_manager.mark_as_read(message_id)
+    async def iter_conversation_messages(
+        self,
+        conversation_id: str,
+        before: Optional[Cursor] = None,
+        after: Optional[Cursor] = None,
+    ) -> AsyncIterator[List[Message]]:
+        async for batch in self.message_manager.iter_by_conversation(
+            conversation_id, settings.MESSAGE_STREAM_BATCH_SIZE, before=before, after=after
+        ):
+            await self.message_manager.load_attachments(batch)
+            yield await self.decrypt_messages(batch)
+
+    async def decrypt_messages(self, messages: List[Message]) -> List[Message]:
+        # messages are grouped per (sender, recipient) pair so that every pair resolves its
+        # UserKey in a single query and derives its session key only once.
+        # group messages are grouped per sender key instead.
+        pairs: Dict[Tuple[str, str], List[Message]] = defaultdict(list)
+        groups: Dict[int, List[Message]] = defaultdict(list)
+        for message in messages:
+            if message.message_type != MessageType.TEXT or not message.content:
+                continue
+            if message.sender_key_id is not None:
+                groups[message.sender_key_id].append(message)
+            else:
+                pairs[(str(message.sender_id), str(message.recipient_id))].append(message)
+
+        if not pairs and not groups:
+            return messages
+
+        sender_keys = await self.conversation_manager.get_sender_keys(groups)
+        user_keys = await self.user_manager.get_user_keys(
+            [recipient_id for _, recipient_id in pairs] + [str(key.sender_id) for key in sender_keys.values()]
+        )
+
+        jobs = []
+        for sender_key_id, group_messages in groups.items():
+            group_sender_key = sender_keys.get(sender_key_id)
+            sender_userkey = user_keys.get(str(group_sender_key.sender_id)) if group_sender_key else None
+            if not sender_userkey:
+                continue
+            sender_key = await get_sender_key(sender_userkey, group_sender_key)
+            payloads = [(base64.b64decode(message.content), message.nonce) for message in group_messages]
+            jobs.append((group_messages, payloads, sender_key))
+
+        for (sender_id, recipient_id), pair_messages in pairs.items():
+            recipient_userkey = user_keys.get(recipient_id)
+            if not recipient_userkey:
+                continue
+            session_key = await get_session_key(sender_id, recipient_userkey)
+            payloads = [(base64.b64decode(message.content), message.nonce) for message in pair_messages]
+            jobs.append((pair_messages, payloads, session_key))
+
+        encrypted_count = sum(len(job_messages) for job_messages, _, _ in jobs)
+        if encrypted_count >= settings.HISTORY_DECRYPT_OFFLOAD_THRESHOLD:
+            # large histories are decrypted off the event loop so websockets keep flowing.
+            plaintexts = await asyncio.to_thread(
+                lambda: [decrypt_message_batch(payloads, session_key) for _, payloads, session_key in jobs]
+            )
+        else:
+            plaintexts = [decrypt_message_batch(payloads, session_key) for _, payloads, session_key in jobs]
+
+        for (pair_messages, _, _), pair_plaintexts in zip(jobs, plaintexts):
+            for message, plaintext in zip(pair_messages, pair_plaintexts):
+                # set as loaded, not assigned: an assignment would be flushed back to the database (as an
+                # UPDATE with the plaintext) by the next query of the session, e.g. the next streamed batch.
+                set_committed_value(message, "content", plaintext)
+
+        return messages
+
+    async def rebuild_search_index(self, user_id: str) -> int:
+        # decrypts the user's whole history once, batch by batch, searches never have to.
+        await search_index.clear(user_id)
+        indexed = 0
+        for conversation in await self.conversation_manager.get_by_user(user_id):
+            async for batch in self.iter_conversation_messages(str(conversation.id)):
+                entries = [index_entry(message, message.content) for message in batch]
+                await search_index.write(user_id, entries)
+                indexed += sum(1 for entry in entries if entry is not None)
+        await search_index.optimize(user_id)
+        return indexed
+
+    async def mark_messages_as_read(self, reader_id: str, message_ids: Iterable[str]) -> Dict[str, List[str]]:
+        rows = await self.message_manager.mark_as_read(message_ids, reader_id)
+        return self._receipts_by_sender(rows)
+
+    async def mark_read_up_to(self, reader_id: str, conversation_id: str, up_to: Cursor) -> Dict[str, List[str]]:
+        rows = await self.message_manager.mark_read_up_to(conversation_id, reader_id, up_to)
+        return self._receipts_by_sender(rows)
+
+    @staticmethod
+    def _receipts_by_sender(rows: List[Row]) -> Dict[str, List[str]]:
+        # sender id -> ids of their messages that were just read
+        receipts: Dict[str, List[str]] = defaultdict(list)
+        for message_id, sender_id in rows:
+            receipts[str(sender_id)].append(str(message_id))
+        return receipts
+
+    async def get_message(self, user_id: str, message_id: str) -> Optional[Message]:
+        # the local store first: a message sent a moment ago is found before it is synced.
+        message = await self.message_manager.get_by_id(message_id, use_local_db=True)
+        if message is None:
+            return None
+        readers = {str(message.sender_id), str(message.recipient_id)}
+        if message.recipient_id is None:
+            # group messages have no recipient, their readers are the members.
+            readers = await self.conversation_manager.get_participant_ids(message.conversation_id)
+        if str(user_id) not in readers:
+            return None
+
+        await self.message_manager.load_attachments([message], use_local_db=True)
+        await self.decrypt_messages([message])
+        return message
 
     async def delete_message(self, message_id: str) -> bool:
         return await self.message_manager.delete(message_id)
 
     async def get_user_conversations(self, user_id: str) -> List[Conversation]:
         return await self.conversation_manager.get_by_user(user_id)
+
+    async def get_inbox(self, user_id: str, limit: int, before: Optional[Cursor] = None) -> List[Row]:
+        rows = await self.conversation_manager.get_inbox(user_id, limit=limit, before=before)
+        last_messages = [row.last_message for row in rows if row.last_message is not None]
+        await self.message_manager.load_attachments(last_messages)
+        await self.decrypt_messages(last_messages)
+        return rows
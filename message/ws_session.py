@@ -0,0 +1,216 @@
+import asyncio
+import uuid
+from typing import List, Optional
+
+from fastapi import HTTPException, WebSocket
+from pydantic import ValidationError
+
+from auth.manager import UserManager
+from conversation.manager import ConversationManager
+from src.config import Config as settings
+from src.db_config import async_session
+from src.models import MAX_SEQ, MessageType, UserKey
+from src.websockets_conn import manager
+
+from .manager import DeliveryManager
+from .pagination import decode_cursor
+from .receipts import ReceiptBuffer
+from .schemas import MessageCreate, ReadReceiptBatch, new_message_payload
+from .service import MessageService
+
+
+class WebSocketSession:
+    # state of one chat socket, bound once per connection instead of once per frame: the sender,
+    # the recipient key and the conversation. a reader task only receives frames, the write loop
+    # drains whatever has piled up (single frames or arrays of messages) and persists it as one
+    # batch on a short-lived pooled session, so no database connection is held between writes.
+
+    def __init__(self, websocket: WebSocket, user_id: str, conversation_with: str):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.conversation_with = conversation_with
+        self.recipient_userkey: Optional[UserKey] = None
+        self.conversation_id: Optional[uuid.UUID] = None
+        self.inbound: asyncio.Queue = asyncio.Queue(maxsize=settings.WS_INBOUND_QUEUE_SIZE)
+        self.acked_seq: Optional[int] = None
+        self.receipts = ReceiptBuffer(user_id, settings.WS_RECEIPT_COALESCE_WINDOW)
+
+    async def run(self, last_seq: Optional[int] = None):
+        reader = asyncio.create_task(self._read_loop())
+        try:
+            await self.catch_up(last_seq)
+            await self._write_loop(reader)
+        finally:
+            reader.cancel()
+            await self.receipts.close()
+
+    async def catch_up(self, last_seq: Optional[int]):
+        # replays what the user missed since `last_seq` (their last acknowledged sequence number,
+        # or the server side one), batch by batch, each batch waiting for the previous one to be written.
+        async with async_session() as session:
+            delivery_manager = DeliveryManager(session)
+            if last_seq is None:
+                last_seq = await delivery_manager.get_acked_seq(self.user_id)
+            else:
+                last_seq = await delivery_manager.acknowledge(self.user_id, last_seq)
+
+        batch_size = settings.DELIVERY_CATCH_UP_BATCH_SIZE
+        while True:
+            async with async_session() as session:
+                pending = await MessageService(session).get_pending_deliveries(self.user_id, last_seq, batch_size)
+            if not pending:
+                break
+
+            # messages sent since the socket connected were already delivered to it live.
+            fresh = manager.claim_seqs(self.websocket, self.user_id, [seq for seq, _ in pending])
+            payloads = [
+                new_message_payload(message, message.content, seq=seq)["data"]
+                for seq, message in pending
+                if seq in fresh
+            ]
+            if payloads:
+                self._reply({"type": "catch_up", "data": payloads})
+                await manager.flush(self.websocket, self.user_id)
+            last_seq = pending[-1][0]
+            if len(pending) < batch_size:
+                break
+
+        manager.end_catch_up(self.websocket, self.user_id, last_seq)
+        self._reply({"type": "catch_up_done", "last_seq": last_seq})
+
+    async def _read_loop(self):
+        while True:
+            data = await self.websocket.receive_json()
+            await self.inbound.put(data)
+
+    async def _write_loop(self, reader: asyncio.Task):
+        while True:
+            get_frame = asyncio.create_task(self.inbound.get())
+            done, _ = await asyncio.wait({get_frame, reader}, return_when=asyncio.FIRST_COMPLETED)
+            if get_frame not in done:
+                get_frame.cancel()
+                # the reader only stops on disconnect (or error), surface it to the endpoint.
+                reader.result()
+                return
+
+            frames = [get_frame.result()]
+            while not self.inbound.empty():
+                frames.append(self.inbound.get_nowait())
+
+            batch = []
+            for frame in frames:
+                batch.extend(self._parse_frame(frame))
+            for start in range(0, len(batch), settings.MESSAGE_BATCH_MAX_SIZE):
+                await self._send_batch(batch[start : start + settings.MESSAGE_BATCH_MAX_SIZE])
+
+            # acks are cumulative, only the highest one of the drained frames is written.
+            if self.acked_seq is not None:
+                async with async_session() as session:
+                    await DeliveryManager(session).acknowledge(self.user_id, self.acked_seq)
+                self.acked_seq = None
+
+    def _parse_frame(self, frame) -> List[MessageCreate]:
+        items = []
+        for data in frame if isinstance(frame, list) else [frame]:
+            message_create = self._parse_message(data)
+            if message_create is not None:
+                items.append(message_create)
+        return items
+
+    def _parse_message(self, data) -> Optional[MessageCreate]:
+        if not isinstance(data, dict):
+            self._reply({"type": "error", "detail": "a message must be a JSON object."})
+            return None
+
+        # `{"type": "ack", "seq": N}` acknowledges the delivery queue up to N.
+        if data.get("type") == "ack":
+            seq = data.get("seq")
+            if type(seq) is not int or not 0 <= seq <= MAX_SEQ:
+                self._reply({"type": "error", "detail": "seq must be a sequence number."})
+                return None
+            self.acked_seq = max(self.acked_seq or 0, seq)
+            return None
+
+        # `{"type": "read", "message_ids": [...]}` or `{"type": "read", "up_to": "<cursor>"}`,
+        # the latter for the socket's conversation unless a `conversation_id` is given.
+        if data.get("type") == "read":
+            self._add_receipt(data)
+            return None
+
+        # plain text frames are by far the most common, they skip the per-type validators.
+        content = data.get("content")
+        if data.keys() <= {"message_type", "content"} and isinstance(content, str) and content:
+            if data.get("message_type", MessageType.TEXT) == MessageType.TEXT:
+                return MessageCreate.model_construct(
+                    message_type=MessageType.TEXT, content=content, recipient_id=self.conversation_with
+                )
+
+        try:
+            return MessageCreate.model_validate({**data, "recipient_id": self.conversation_with})
+        except ValidationError as e:
+            self._reply({"type": "error", "detail": str(e)})
+            return None
+
+    def _add_receipt(self, data: dict):
+        # a bad frame is rejected on its own, it must not reach the buffered UPDATE shared with the others.
+        if data.get("up_to") is not None and not isinstance(data["up_to"], str):
+            self._reply({"type": "error", "detail": "up_to must be a cursor."})
+            return
+        try:
+            up_to = decode_cursor(data.get("up_to"))
+        except HTTPException as e:
+            self._reply({"type": "error", "detail": e.detail})
+            return
+        try:
+            receipt_batch = ReadReceiptBatch.model_validate({"message_ids": data.get("message_ids") or []})
+            conversation_id = data.get("conversation_id") or self.conversation_id
+            conversation_id = str(uuid.UUID(str(conversation_id))) if conversation_id else None
+        except (ValidationError, ValueError):
+            self._reply({"type": "error", "detail": "message_ids and conversation_id must be ids."})
+            return
+
+        if up_to and not conversation_id:
+            self._reply({"type": "error", "detail": "conversation_id is required to mark messages as read."})
+            return
+        self.receipts.add(message_ids=receipt_batch.message_ids, conversation_id=conversation_id, up_to=up_to)
+
+    async def _bind(self, session) -> bool:
+        if self.recipient_userkey is None:
+            self.recipient_userkey = await UserManager(session).get_user_key(self.conversation_with)
+            if self.recipient_userkey is None:
+                self._reply({"type": "error", "detail": "the recipient does not use our messaging system."})
+                return False
+
+        if self.conversation_id is None:
+            self.conversation_id = await ConversationManager(session).get_or_create_private_conversation_id(
+                self.user_id, self.conversation_with
+            )
+        return True
+
+    async def _send_batch(self, items: List[MessageCreate]):
+        if not items:
+            return
+
+        async with async_session() as session:
+            if not await self._bind(session):
+                return
+            message_service = MessageService(session)
+            try:
+                messages = await message_service.send_bound_messages(
+                    self.user_id, self.recipient_userkey, self.conversation_id, items
+                )
+            except HTTPException as e:
+                self._reply({"type": "error", "detail": e.detail})
+                return
+
+        for message, message_create in zip(messages, items):
+            recipient_id = str(message.recipient_id)
+            message_payload = new_message_payload(
+                message, message_create.content, seq=message_service.delivery_seq(recipient_id, message.id)
+            )
+            await manager.send_personal_message(message=message_payload, user_id=recipient_id, sender_id=self.user_id)
+            # Send confirmation back to sender
+            self._reply({"type": "message_sent", "data": message_payload})
+
+    def _reply(self, message: dict):
+        manager.send_to_connection(self.websocket, self.user_id, message)
@@ -0,0 +1,117 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 09:00:00.000000
+
+The schema as it was before migrations were introduced. Databases created back then with
+`SQLModel.metadata.create_all` are brought under alembic with `alembic stamp 0001`.
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "user",
+        sa.Column("id", postgresql.UUID(), nullable=False),
+        sa.Column("username", sa.String(), nullable=False),
+        sa.Column("email", sa.String(), nullable=False),
+        sa.Column("phone_number", sa.String(), nullable=False),
+        sa.Column("password_hash", sa.String(), nullable=False),
+        sa.Column("is_online", sa.Boolean(), nullable=False),
+        sa.Column("last_seen", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_user_username", "user", ["username"], unique=True)
+    op.create_index("ix_user_email", "user", ["email"], unique=True)
+    op.create_index("ix_user_phone_number", "user", ["phone_number"], unique=True)
+
+    op.create_table(
+        "conversation",
+        sa.Column("id", postgresql.UUID(), nullable=False),
+        sa.Column("conversation_name", sa.String(), nullable=True),
+        sa.Column("is_group", sa.Boolean(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("last_activity", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+    op.create_table(
+        "conversationparticipant",
+        sa.Column("conversation_id", postgresql.UUID(), nullable=False),
+        sa.Column("user_id", postgresql.UUID(), nullable=False),
+        sa.ForeignKeyConstraint(["conversation_id"], ["conversation.id"]),
+        sa.ForeignKeyConstraint(["user_id"], ["user.id"]),
+        sa.PrimaryKeyConstraint("conversation_id", "user_id"),
+    )
+
+    op.create_table(
+        "userkey",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", postgresql.UUID(), nullable=False),
+        sa.Column("public_key", postgresql.BYTEA(), nullable=False),
+        sa.Column("algorithm", sa.String(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("revoked", sa.Boolean(), nullable=False),
+        sa.ForeignKeyConstraint(["user_id"], ["user.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+    op.create_table(
+        "message",
+        sa.Column("id", postgresql.UUID(), nullable=False),
+        sa.Column("timestamp", sa.DateTime(), nullable=False),
+        sa.Column(
+            "message_type", sa.Enum("TEXT", "IMAGE", "FILE", "VOICE", "VIDEO", name="messagetype"), nullable=False
+        ),
+        sa.Column("is_read", sa.Boolean(), nullable=False),
+        sa.Column("sender_id", postgresql.UUID(), nullable=True),
+        sa.Column("recipient_id", postgresql.UUID(), nullable=True),
+        sa.Column("conversation_id", postgresql.UUID(), nullable=True),
+        sa.Column("content", sa.String(), nullable=True),
+        sa.Column("image_url", sa.String(), nullable=True),
+        sa.Column("image_filename", sa.String(), nullable=True),
+        sa.Column("image_size", sa.Integer(), nullable=True),
+        sa.Column("file_url", sa.String(), nullable=True),
+        sa.Column("file_filename", sa.String(), nullable=True),
+        sa.Column("file_size", sa.Integer(), nullable=True),
+        sa.Column("file_mime_type", sa.String(), nullable=True),
+        sa.Column("voice_url", sa.String(), nullable=True),
+        sa.Column("voice_filename", sa.String(), nullable=True),
+        sa.Column("voice_duration", sa.Integer(), nullable=True),
+        sa.Column("video_url", sa.String(), nullable=True),
+        sa.Column("video_filename", sa.String(), nullable=True),
+        sa.Column("video_size", sa.Integer(), nullable=True),
+        sa.Column("video_duration", sa.Integer(), nullable=True),
+        sa.Column("video_thumbnail_url", sa.String(), nullable=True),
+        sa.Column("caption", sa.String(), nullable=True),
+        sa.Column("nonce", postgresql.BYTEA(), nullable=True),
+        sa.ForeignKeyConstraint(["sender_id"], ["user.id"]),
+        sa.ForeignKeyConstraint(["recipient_id"], ["user.id"]),
+        sa.ForeignKeyConstraint(["conversation_id"], ["conversation.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("message")
+    sa.Enum(name="messagetype").drop(op.get_bind(), checkfirst=True)
+    op.drop_table("userkey")
+    op.drop_table("conversationparticipant")
+    op.drop_table("conversation")
+    op.drop_index("ix_user_phone_number", table_name="user")
+    op.drop_index("ix_user_email", table_name="user")
+    op.drop_index("ix_user_username", table_name="user")
+    op.drop_table("user")
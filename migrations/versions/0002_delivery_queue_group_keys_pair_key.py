@@ -0,0 +1,100 @@
+"""delivery queue, group sender keys and private conversation pair keys
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 09:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_message_conversation_timestamp_id", "message", ["conversation_id", "timestamp", "id"])
+    op.create_index("ix_message_recipient_is_read", "message", ["recipient_id", "is_read"])
+
+    op.create_table(
+        "groupsenderkey",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("conversation_id", postgresql.UUID(), nullable=False),
+        sa.Column("sender_id", postgresql.UUID(), nullable=False),
+        sa.Column("wrapped_key", postgresql.BYTEA(), nullable=False),
+        sa.Column("nonce", postgresql.BYTEA(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("revoked", sa.Boolean(), nullable=False),
+        sa.ForeignKeyConstraint(["conversation_id"], ["conversation.id"]),
+        sa.ForeignKeyConstraint(["sender_id"], ["user.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_groupsenderkey_conversation_id", "groupsenderkey", ["conversation_id"])
+    op.add_column("message", sa.Column("sender_key_id", sa.Integer(), nullable=True))
+    op.create_foreign_key("message_sender_key_id_fkey", "message", "groupsenderkey", ["sender_key_id"], ["id"])
+
+    op.create_table(
+        "usersequence",
+        sa.Column("user_id", postgresql.UUID(), nullable=False),
+        sa.Column("last_seq", sa.Integer(), nullable=False),
+        sa.Column("acked_seq", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["user_id"], ["user.id"]),
+        sa.PrimaryKeyConstraint("user_id"),
+    )
+    op.create_table(
+        "messagedelivery",
+        sa.Column("user_id", postgresql.UUID(), nullable=False),
+        sa.Column("seq", sa.Integer(), nullable=False),
+        sa.Column("message_id", postgresql.UUID(), nullable=False),
+        sa.ForeignKeyConstraint(["user_id"], ["user.id"]),
+        sa.ForeignKeyConstraint(["message_id"], ["message.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("user_id", "seq"),
+    )
+    op.create_index("ix_messagedelivery_message_id", "messagedelivery", ["message_id"])
+
+    # existing private conversations get the key of their pair (see src.models.conversation.pair_key),
+    # ordered like python's sorted(). a pair that ended up with several conversations keeps the oldest
+    # one as its private conversation, the others stay reachable by id.
+    op.add_column("conversation", sa.Column("pair_key", sa.String(), nullable=True))
+    op.execute(
+        """
+        UPDATE conversation
+        SET pair_key = pairs.pair_key
+        FROM (
+            SELECT DISTINCT ON (participants.pair_key) participants.conversation_id, participants.pair_key
+            FROM (
+                SELECT
+                    conversation_id,
+                    min(user_id::text COLLATE "C") || ':' || max(user_id::text COLLATE "C") AS pair_key
+                FROM conversationparticipant
+                GROUP BY conversation_id
+                HAVING count(*) <= 2
+            ) AS participants
+            JOIN conversation ON conversation.id = participants.conversation_id
+            WHERE NOT conversation.is_group
+            ORDER BY participants.pair_key, conversation.created_at, conversation.id
+        ) AS pairs
+        WHERE conversation.id = pairs.conversation_id
+        """
+    )
+    op.create_unique_constraint("conversation_pair_key_key", "conversation", ["pair_key"])
+
+
+def downgrade() -> None:
+    op.drop_constraint("conversation_pair_key_key", "conversation", type_="unique")
+    op.drop_column("conversation", "pair_key")
+    op.drop_index("ix_messagedelivery_message_id", table_name="messagedelivery")
+    op.drop_table("messagedelivery")
+    op.drop_table("usersequence")
+    op.drop_constraint("message_sender_key_id_fkey", "message", type_="foreignkey")
+    op.drop_column("message", "sender_key_id")
+    op.drop_index("ix_groupsenderkey_conversation_id", table_name="groupsenderkey")
+    op.drop_table("groupsenderkey")
+    op.drop_index("ix_message_recipient_is_read", table_name="message")
+    op.drop_index("ix_message_conversation_timestamp_id", table_name="message")
@@ -0,0 +1,91 @@
+"""message attachments
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 09:20:00.000000
+
+Moves the per-type media columns of `message` to `messageattachment`, one row per non-text message.
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# message type -> its former message columns, by attachment column
+MEDIA_COLUMNS = {
+    "IMAGE": {"url": "image_url", "filename": "image_filename", "size": "image_size"},
+    "FILE": {"url": "file_url", "filename": "file_filename", "size": "file_size", "mime_type": "file_mime_type"},
+    "VOICE": {"url": "voice_url", "filename": "voice_filename", "duration": "voice_duration"},
+    "VIDEO": {
+        "url": "video_url",
+        "filename": "video_filename",
+        "size": "video_size",
+        "duration": "video_duration",
+        "thumbnail_url": "video_thumbnail_url",
+    },
+}
+
+LEGACY_COLUMN_TYPES = {
+    "url": sa.String,
+    "filename": sa.String,
+    "size": sa.Integer,
+    "mime_type": sa.String,
+    "duration": sa.Integer,
+    "thumbnail_url": sa.String,
+}
+
+
+def upgrade() -> None:
+    op.create_table(
+        "messageattachment",
+        sa.Column("message_id", postgresql.UUID(), nullable=False),
+        sa.Column("url", sa.String(), nullable=False),
+        sa.Column("filename", sa.String(), nullable=True),
+        sa.Column("size", sa.Integer(), nullable=True),
+        sa.Column("mime_type", sa.String(), nullable=True),
+        sa.Column("duration", sa.Integer(), nullable=True),
+        sa.Column("thumbnail_url", sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(["message_id"], ["message.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("message_id"),
+    )
+
+    for message_type, columns in MEDIA_COLUMNS.items():
+        targets = ", ".join(columns)
+        sources = ", ".join(columns.values())
+        op.execute(
+            f"""
+            INSERT INTO messageattachment (message_id, {targets})
+            SELECT id, {sources} FROM message
+            WHERE message_type = '{message_type}' AND {columns["url"]} IS NOT NULL
+            """
+        )
+
+    for columns in MEDIA_COLUMNS.values():
+        for source in columns.values():
+            op.drop_column("message", source)
+
+
+def downgrade() -> None:
+    for columns in MEDIA_COLUMNS.values():
+        for target, source in columns.items():
+            op.add_column("message", sa.Column(source, LEGACY_COLUMN_TYPES[target](), nullable=True))
+
+    for message_type, columns in MEDIA_COLUMNS.items():
+        assignments = ", ".join(f"{source} = attachment.{target}" for target, source in columns.items())
+        op.execute(
+            f"""
+            UPDATE message SET {assignments}
+            FROM messageattachment AS attachment
+            WHERE attachment.message_id = message.id AND message.message_type = '{message_type}'
+            """
+        )
+
+    op.drop_table("messageattachment")
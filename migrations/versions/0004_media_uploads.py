@@ -0,0 +1,64 @@
+"""media uploads
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 09:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "mediablob",
+        sa.Column("address", sa.String(), nullable=False),
+        sa.Column("size", sa.Integer(), nullable=False),
+        sa.Column("chunk_size", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("address"),
+    )
+    op.create_table(
+        "media",
+        sa.Column("id", postgresql.UUID(), nullable=False),
+        sa.Column("owner_id", postgresql.UUID(), nullable=False),
+        sa.Column("recipient_id", postgresql.UUID(), nullable=False),
+        sa.Column("filename", sa.String(), nullable=True),
+        sa.Column("mime_type", sa.String(), nullable=True),
+        sa.Column("size", sa.Integer(), nullable=False),
+        sa.Column("chunk_size", sa.Integer(), nullable=False),
+        sa.Column("status", sa.Enum("UPLOADING", "READY", name="mediastatus"), nullable=False),
+        sa.Column("blob_address", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["owner_id"], ["user.id"]),
+        sa.ForeignKeyConstraint(["recipient_id"], ["user.id"]),
+        sa.ForeignKeyConstraint(["blob_address"], ["mediablob.address"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_media_owner_id", "media", ["owner_id"])
+
+    op.add_column("messageattachment", sa.Column("media_id", postgresql.UUID(), nullable=True))
+    op.create_foreign_key("messageattachment_media_id_fkey", "messageattachment", "media", ["media_id"], ["id"])
+    op.alter_column("messageattachment", "url", existing_type=sa.String(), nullable=True)
+
+
+def downgrade() -> None:
+    # attachments of uploaded media have no url, they can not be represented before this revision.
+    op.execute("DELETE FROM messageattachment WHERE url IS NULL")
+    op.alter_column("messageattachment", "url", existing_type=sa.String(), nullable=False)
+    op.drop_constraint("messageattachment_media_id_fkey", "messageattachment", type_="foreignkey")
+    op.drop_column("messageattachment", "media_id")
+
+    op.drop_index("ix_media_owner_id", table_name="media")
+    op.drop_table("media")
+    sa.Enum(name="mediastatus").drop(op.get_bind(), checkfirst=True)
+    op.drop_table("mediablob")
@@ -1,8 +1,17 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
 
+from fastapi import APIRouter, Depends, FastAPI
+
+from auth.hashing import password_hasher
+from auth.routes import get_current_user
 from auth.routes import router as auth_router
 from conversation.routes import router as conversation_router
+from media.routes import router as media_router
 from message.routes import router as message_router
+from message.search import search_index
+from src.db_config import (dispose_pool, get_pool_status, local_store,
+                           message_log, warm_up_pool)
+from src.websockets_conn import manager
 
 version = "v1"
 
@@ -12,6 +21,24 @@ A simple messaging system API that allows users to send, receive, and manage mes
 
 version_prefix = f"/api/{version}"
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await warm_up_pool()
+    message_log.start()
+    await local_store.start()
+    await manager.start()
+    yield
+    await manager.stop()
+    # syncs what it can of the local store before the pool goes away.
+    await local_store.stop()
+    # drains and fsyncs the pending local log entries before going down.
+    await message_log.stop()
+    password_hasher.shutdown()
+    search_index.stop()
+    await dispose_pool()
+
+
 app = FastAPI(
     title="Messaging System API",
     description=description,
@@ -21,8 +48,43 @@ app = FastAPI(
         "email": "nchris3010@gmail.com",
         "url": "https://github.com/lightskrees",
     },
+    lifespan=lifespan,
 )
 
 app.include_router(auth_router)
 app.include_router(message_router)
 app.include_router(conversation_router)
+app.include_router(media_router)
+
+
+# the metrics describe the internals of the server, they are only served to authenticated users.
+metrics_router = APIRouter(prefix="/metrics", tags=["monitoring"], dependencies=[Depends(get_current_user)])
+
+
+@metrics_router.get("/db-pool")
+async def db_pool_metrics():
+    return get_pool_status()
+
+
+@metrics_router.get("/password-hashing")
+async def password_hashing_metrics():
+    return password_hasher.stats()
+
+
+@metrics_router.get("/websockets")
+async def websocket_metrics():
+    return manager.stats()
+
+
+@metrics_router.get("/local-sync")
+async def local_sync_metrics():
+    return await local_store.stats()
+
+
+@metrics_router.post("/local-sync/requeue")
+async def requeue_failed_local_records():
+    # after the cause of the failures is fixed, the rows marked failed are retried.
+    return {"requeued": await local_store.requeue_failed()}
+
+
+app.include_router(metrics_router)
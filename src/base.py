@@ -1,59 +1,92 @@
 from abc import ABC
-from typing import Generic, List, Optional, Type, TypeVar
+from contextlib import asynccontextmanager
+from typing import (AsyncIterator, Generic, List, Optional, Sequence, Type,
+                    TypeVar)
 
+from sqlalchemy.sql.base import ExecutableOption
 from sqlmodel import SQLModel, select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-T = TypeVar("T", bound="SQLModel")
+from src.db_config.local_store import local_store
 
-# ToDo: the local storage sync with with SQLite to be implemented soon...
+T = TypeVar("T", bound="SQLModel")
 
 
 class BaseManager(Generic[T], ABC):
-    def __init__(self, session: AsyncSession, model: Type[T], local_session: AsyncSession | None = None):
+    def __init__(self, session: AsyncSession, model: Type[T]):
         self.session = session
-        self.sqlite_session = local_session
         self.model = model
 
-    async def create(self, obj: T) -> T:
+    @asynccontextmanager
+    async def unit_of_work(self) -> AsyncIterator[AsyncSession]:
+        # groups several manager calls into a single transaction: inside the scope create/update/delete
+        # only flush, and the outermost scope commits once (or rolls back on error).
+        # the depth lives on the session so every manager sharing it joins the same unit of work.
+        depth = self.session.info.get("unit_of_work_depth", 0)
+        self.session.info["unit_of_work_depth"] = depth + 1
+        try:
+            yield self.session
+            if depth == 0:
+                await self.session.commit()
+        except BaseException:
+            if depth == 0:
+                await self.session.rollback()
+            raise
+        finally:
+            self.session.info["unit_of_work_depth"] = depth
+
+    @property
+    def in_unit_of_work(self) -> bool:
+        return self.session.info.get("unit_of_work_depth", 0) > 0
+
+    # `refresh` is only needed when the database fills columns itself (server defaults, triggers),
+    # our models set their defaults in python so callers may skip the extra SELECT.
+    async def create(self, obj: T, refresh: bool = True) -> T:
         self.session.add(obj)
-        await self.session.commit()
-        await self.session.refresh(obj)
+        if self.in_unit_of_work:
+            # flushing assigns primary keys, so the object can be referenced right away.
+            await self.session.flush()
+            return obj
 
-        # self.sqlite_session.add(obj)
-        # await self.sqlite_session.commit()
-        # await self.sqlite_session.refresh(obj)
+        await self.session.commit()
+        if refresh:
+            await self.session.refresh(obj)
         return obj
 
-    async def get_by_id(self, id: str, use_local_db: bool = False) -> Optional[T]:
-
-        # session = self.sqlite_session if use_local_db else self.session
-        return await self.session.get(self.model, id)
-
-    async def get_all(self) -> List[T]:
-        statement = select(self.model)
+    # relationships are not loaded by default (noload/raise), `options` takes the loader
+    # options (selectinload, joinedload, ...) a caller explicitly needs for this query.
+    # `use_local_db` reads the local store first, which also sees the rows not synced yet
+    # (detached objects, relationships are never loaded on them).
+    async def get_by_id(
+        self, id: str, use_local_db: bool = False, options: Sequence[ExecutableOption] = ()
+    ) -> Optional[T]:
+        if use_local_db and local_store.enabled:
+            obj = await local_store.get(self.model, id)
+            if obj is not None:
+                return obj
+
+        return await self.session.get(self.model, id, options=list(options))
+
+    async def get_all(self, options: Sequence[ExecutableOption] = ()) -> List[T]:
+        statement = select(self.model).options(*options)
         result = await self.session.exec(statement)
         return result.all()
 
-    async def update(self, obj: T) -> T:
+    async def update(self, obj: T, refresh: bool = True) -> T:
         self.session.add(obj)
-        await self.session.commit()
-        await self.session.refresh(obj)
-
-        # self.sqlite_session.add(obj)
-        # await self.sqlite_session.commit()
-        # await self.sqlite_session.refresh(obj)
+        if self.in_unit_of_work:
+            return obj
 
+        await self.session.commit()
+        if refresh:
+            await self.session.refresh(obj)
         return obj
 
     async def delete(self, id: str) -> bool:
         obj = await self.get_by_id(id)
         if obj:
             await self.session.delete(obj)
-            await self.session.commit()
-
-            # await self.sqlite_session.delete(obj)
-            # await self.sqlite_session.commit()
-
+            if not self.in_unit_of_work:
+                await self.session.commit()
             return True
         return False
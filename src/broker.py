@@ -0,0 +1,256 @@
+import asyncio
+import json
+import uuid
+from abc import ABC, abstractmethod
+from collections import Counter, defaultdict
+from typing import Awaitable, Callable, Dict, Iterable, List, Set
+
+from src.config import Config as settings
+
+# called on the node holding the users' sockets: (user_ids, envelope)
+DeliveryHandler = Callable[[List[str], dict], Awaitable[None]]
+# called on every node, the sending one included (possibly twice there, handlers must be idempotent): (data)
+BroadcastHandler = Callable[[dict], Awaitable[None]]
+
+
+class Broker(ABC):
+    # every user has a channel, a node subscribes to it while it holds at least one socket of that user
+    # and publishing to it reaches the user wherever they are connected. presence is tracked per node,
+    # so any node can tell whether a user is online somewhere.
+    # broadcasts reach every node, they keep the per-process caches (membership, keys) in sync.
+
+    def __init__(self, node_id: str | None = None):
+        self.node_id = node_id or uuid.uuid4().hex
+        self.handler: DeliveryHandler | None = None
+        self.broadcast_handlers: Dict[str, List[BroadcastHandler]] = defaultdict(list)
+
+    async def start(self, handler: DeliveryHandler):
+        self.handler = handler
+
+    async def stop(self): ...
+
+    def on_broadcast(self, topic: str, handler: BroadcastHandler):
+        self.broadcast_handlers[topic].append(handler)
+
+    @abstractmethod
+    async def broadcast(self, topic: str, data: dict): ...
+
+    async def _handle_broadcast(self, topic: str, data: dict):
+        for handler in self.broadcast_handlers.get(topic, []):
+            try:
+                await handler(data)
+            except Exception as e:
+                print(f"Broker broadcast handler error ({topic}): {e}")
+
+    @abstractmethod
+    async def publish(self, user_id: str, envelope: dict): ...
+
+    async def publish_many(self, user_ids: Iterable[str], envelope: dict):
+        for user_id in user_ids:
+            await self.publish(user_id, envelope)
+
+    @abstractmethod
+    async def subscribe(self, user_id: str): ...
+
+    @abstractmethod
+    async def unsubscribe(self, user_id: str): ...
+
+    @abstractmethod
+    async def set_online(self, user_id: str, connections: int): ...
+
+    @abstractmethod
+    async def online_users(self, user_ids: Iterable[str]) -> Set[str]: ...
+
+    async def is_online(self, user_id: str) -> bool:
+        return user_id in await self.online_users([user_id])
+
+
+class InMemoryBus:
+    # stands in for a real broker between the nodes (ConnectionManagers) of a single process.
+    def __init__(self):
+        self.subscriptions: Dict[str, Dict[str, "InMemoryBroker"]] = defaultdict(dict)
+        self.presence: Dict[str, Counter] = defaultdict(Counter)
+        self.nodes: Dict[str, "InMemoryBroker"] = {}
+
+
+default_bus = InMemoryBus()
+
+
+class InMemoryBroker(Broker):
+    def __init__(self, bus: InMemoryBus = default_bus, node_id: str | None = None):
+        super().__init__(node_id)
+        self.bus = bus
+
+    async def start(self, handler: DeliveryHandler):
+        await super().start(handler)
+        self.bus.nodes[self.node_id] = self
+
+    async def broadcast(self, topic: str, data: dict):
+        # this node too, started or not.
+        for broker in {**self.bus.nodes, self.node_id: self}.values():
+            await broker._handle_broadcast(topic, data)
+
+    async def publish(self, user_id: str, envelope: dict):
+        await self.publish_many([user_id], envelope)
+
+    async def publish_many(self, user_ids: Iterable[str], envelope: dict):
+        # every node gets the users it holds in a single call, so the payload is encoded once per node.
+        by_node: Dict[str, List[str]] = defaultdict(list)
+        nodes = {}
+        for user_id in user_ids:
+            for node_id, broker in self.bus.subscriptions.get(user_id, {}).items():
+                by_node[node_id].append(user_id)
+                nodes[node_id] = broker
+        for node_id, node_user_ids in by_node.items():
+            if nodes[node_id].handler is not None:
+                await nodes[node_id].handler(node_user_ids, envelope)
+
+    async def subscribe(self, user_id: str):
+        self.bus.subscriptions[user_id][self.node_id] = self
+
+    async def unsubscribe(self, user_id: str):
+        self.bus.subscriptions[user_id].pop(self.node_id, None)
+        if not self.bus.subscriptions[user_id]:
+            del self.bus.subscriptions[user_id]
+
+    async def set_online(self, user_id: str, connections: int):
+        if connections > 0:
+            self.bus.presence[user_id][self.node_id] = connections
+        else:
+            self.bus.presence[user_id].pop(self.node_id, None)
+            if not self.bus.presence[user_id]:
+                del self.bus.presence[user_id]
+
+    async def online_users(self, user_ids: Iterable[str]) -> Set[str]:
+        return {user_id for user_id in user_ids if self.bus.presence.get(user_id)}
+
+    async def stop(self):
+        self.bus.nodes.pop(self.node_id, None)
+        for user_id in [u for u, nodes in self.bus.subscriptions.items() if self.node_id in nodes]:
+            await self.unsubscribe(user_id)
+        for user_id in [u for u, nodes in self.bus.presence.items() if self.node_id in nodes]:
+            await self.set_online(user_id, 0)
+
+
+class RedisBroker(Broker):
+    # channels are `ws:user:{user_id}`, presence is the hash `ws:presence:{user_id}` (node id -> sockets count)
+    # and every node refreshes its own `ws:node:{node_id}` key so the sockets of a dead node stop counting.
+    # broadcasts go through the `ws:broadcast` channel every node subscribes to.
+
+    # losing the connection only pauses the node: the listener and the heartbeat retry every `reconnect_delay`
+    # seconds, the pubsub connection resubscribes its channels and the presence is written again if the
+    # server lost it. messages published in the meantime are not delivered live (the delivery queue has them).
+
+    def __init__(self, url: str, presence_ttl: int, reconnect_delay: float = 1.0, node_id: str | None = None):
+        super().__init__(node_id)
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("BROKER_BACKEND=redis requires the `redis` package to be installed")
+        self.redis = redis.from_url(url)
+        self.presence_ttl = presence_ttl
+        self.reconnect_delay = reconnect_delay
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self.presence: Dict[str, int] = {}  # this node's sockets per user, as last written
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self, handler: DeliveryHandler):
+        await super().start(handler)
+        # the node channel keeps the pubsub connection subscribed even without any local user.
+        await self.pubsub.subscribe(f"ws:node:{self.node_id}", "ws:broadcast")
+        await self._heartbeat_once()
+        self._tasks = [asyncio.create_task(self._listen()), asyncio.create_task(self._heartbeat())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await self.redis.delete(f"ws:node:{self.node_id}")
+        await self.pubsub.aclose()
+        await self.redis.aclose()
+
+    async def _listen(self):
+        while True:
+            try:
+                async for message in self.pubsub.listen():
+                    await self._dispatch(message)
+            except Exception as e:
+                print(f"Broker connection lost, reconnecting in {self.reconnect_delay}s: {e}")
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def _dispatch(self, message: dict):
+        channel = message["channel"].decode()
+        if channel == "ws:broadcast":
+            broadcast = json.loads(message["data"])
+            await self._handle_broadcast(broadcast["topic"], broadcast["data"])
+            return
+        if not channel.startswith("ws:user:"):
+            return
+        try:
+            await self.handler([channel[len("ws:user:") :]], json.loads(message["data"]))
+        except Exception as e:
+            print(f"Broker delivery error: {e}")
+
+    async def _heartbeat_once(self):
+        alive = await self.redis.set(f"ws:node:{self.node_id}", 1, ex=self.presence_ttl, get=True)
+        if alive is None and self.presence:
+            # the node key had expired or the server lost its data: our presence may be gone with it.
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for user_id, connections in self.presence.items():
+                    pipe.hset(f"ws:presence:{user_id}", self.node_id, connections)
+                await pipe.execute()
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.presence_ttl / 3)
+            try:
+                await self._heartbeat_once()
+            except Exception as e:
+                print(f"Broker heartbeat failed: {e}")
+
+    async def broadcast(self, topic: str, data: dict):
+        # handled here right away, the node may not be started (or may be disconnected) yet.
+        await self._handle_broadcast(topic, data)
+        await self.redis.publish("ws:broadcast", json.dumps({"topic": topic, "data": data}))
+
+    async def publish(self, user_id: str, envelope: dict):
+        await self.redis.publish(f"ws:user:{user_id}", json.dumps(envelope))
+
+    async def publish_many(self, user_ids: Iterable[str], envelope: dict):
+        # one round trip for the whole fan-out, the envelope is serialized once.
+        data = json.dumps(envelope)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.publish(f"ws:user:{user_id}", data)
+            await pipe.execute()
+
+    async def subscribe(self, user_id: str):
+        await self.pubsub.subscribe(f"ws:user:{user_id}")
+
+    async def unsubscribe(self, user_id: str):
+        await self.pubsub.unsubscribe(f"ws:user:{user_id}")
+
+    async def set_online(self, user_id: str, connections: int):
+        if connections > 0:
+            self.presence[user_id] = connections
+            await self.redis.hset(f"ws:presence:{user_id}", self.node_id, connections)
+        else:
+            self.presence.pop(user_id, None)
+            await self.redis.hdel(f"ws:presence:{user_id}", self.node_id)
+
+    async def online_users(self, user_ids: Iterable[str]) -> Set[str]:
+        online = set()
+        for user_id in user_ids:
+            node_ids = [node_id.decode() for node_id in await self.redis.hkeys(f"ws:presence:{user_id}")]
+            if node_ids and any(await self.redis.mget([f"ws:node:{node_id}" for node_id in node_ids])):
+                online.add(user_id)
+        return online
+
+
+def get_broker() -> Broker:
+    if settings.BROKER_BACKEND == "redis":
+        return RedisBroker(
+            settings.REDIS_URL,
+            presence_ttl=settings.BROKER_PRESENCE_TTL,
+            reconnect_delay=settings.BROKER_RECONNECT_DELAY,
+        )
+    return InMemoryBroker()
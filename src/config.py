@@ -10,6 +10,94 @@ class Settings(BaseSettings):
     PRIVATE_KEY_DIR: str
     LOCAL_DB_DIR: str
 
+    # main database connection pool
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: int = 30  # seconds
+    DB_POOL_RECYCLE: int = 1800  # seconds
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_WARMUP: int = 5  # connections opened on startup
+    DB_STATEMENT_CACHE_SIZE: int = 100
+
+    # password hashing (see auth.hashing), executor is "thread" or "process"
+    PASSWORD_BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_EXECUTOR: str = "thread"
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_PENDING: int = 64
+
+    # authenticated principals cache (see auth.principal_cache), "memory" or "redis"
+    PRINCIPAL_CACHE_BACKEND: str = "memory"
+    PRINCIPAL_CACHE_SIZE: int = 10000
+
+    # public keys on record (see auth.key_cache), dropped on every node when a key changes
+    USER_KEY_CACHE_SIZE: int = 10000
+    USER_KEY_CACHE_TTL: int = 3600  # seconds
+
+    # private keys storage (see auth.keystore), "pem_dir" or "indexed_file"
+    KEYSTORE_BACKEND: str = "pem_dir"
+    KEYSTORE_INDEX_FILE: str = "keystore.idx"
+    KEYSTORE_CACHE_SIZE: int = 1024
+
+    # append-only local message log (see src.db_config.local_json_config)
+    LOCAL_LOG_SEGMENT_MAX_BYTES: int = 4 * 1024 * 1024
+    LOCAL_LOG_FSYNC_BATCH: int = 64  # entries
+    LOCAL_LOG_FSYNC_INTERVAL: float = 1.0  # seconds
+    LOCAL_LOG_COMPACT_SEGMENTS: int = 8
+
+    # local-first writes (see src.db_config.local_store), messages land in SQLite and are synced
+    # to the main database in the background
+    LOCAL_STORE_ENABLED: bool = False
+    LOCAL_SYNC_INTERVAL: float = 0.5  # seconds between sync passes when idle
+    LOCAL_SYNC_BATCH_SIZE: int = 500  # records per main database transaction
+    LOCAL_SYNC_MAX_ATTEMPTS: int = 8  # a record is marked failed after that many attempts
+    LOCAL_SYNC_RETRY_BASE: float = 0.5  # seconds, doubled on every failed attempt
+    LOCAL_SYNC_MAX_PAUSE: float = 30.0  # seconds, the longest the sync waits while the main database is down
+    LOCAL_STORE_RETENTION: int = 3600  # seconds synced records stay readable locally
+
+    # websocket fan-out broker (see src.broker), "memory" (single process) or "redis"
+    BROKER_BACKEND: str = "memory"
+    BROKER_PRESENCE_TTL: int = 30  # seconds
+    BROKER_RECONNECT_DELAY: float = 1.0  # seconds between attempts once the connection is lost
+
+    # per-connection outbound queues, overflow policy is "drop_oldest" or "disconnect"
+    WS_OUTBOUND_QUEUE_SIZE: int = 256
+    WS_OVERFLOW_POLICY: str = "drop_oldest"
+    WS_BINARY_FRAMES: bool = False  # send the JSON frames as binary instead of text
+    WS_INBOUND_QUEUE_SIZE: int = 1000  # received frames waiting to be written, the reader pauses when full
+    WS_RECEIPT_COALESCE_WINDOW: float = 0.25  # seconds read receipts are buffered before being written
+
+    # offline delivery queue, missed messages are replayed on reconnect in batches of this size
+    DELIVERY_CATCH_UP_BATCH_SIZE: int = 200
+    DELIVERY_QUEUE_MAX_PENDING: int = 10000  # per user, older entries are dropped (they stay in the history)
+
+    # derived session keys cache (see encryption.session_cache)
+    SESSION_KEY_CACHE_SIZE: int = 1024
+    SESSION_KEY_CACHE_TTL: int = 3600  # seconds
+
+    # histories with at least this many encrypted messages are decrypted in a worker thread
+    HISTORY_DECRYPT_OFFLOAD_THRESHOLD: int = 200
+
+    # conversation history pagination
+    MESSAGE_PAGE_DEFAULT_LIMIT: int = 50
+    MESSAGE_PAGE_MAX_LIMIT: int = 500
+    MESSAGE_STREAM_BATCH_SIZE: int = 200
+    INBOX_PAGE_DEFAULT_LIMIT: int = 20
+    INBOX_PAGE_MAX_LIMIT: int = 100
+    MESSAGE_BATCH_MAX_SIZE: int = 1000
+
+    # local full-text search index (see message.search), one SQLite database per user
+    SEARCH_INDEX_CONNECTIONS: int = 64  # open databases kept around
+    SEARCH_PAGE_DEFAULT_LIMIT: int = 20
+    SEARCH_PAGE_MAX_LIMIT: int = 100
+
+    # uploaded media (see media.store), encrypted chunks under LOCAL_DB_DIR/media
+    MEDIA_CHUNK_SIZE: int = 1024 * 1024  # plaintext bytes per encrypted chunk
+    MEDIA_MAX_SIZE: int = 100 * 1024 * 1024
+
+    # cached conversation participants and private conversations (see conversation.membership)
+    MEMBERSHIP_INDEX_SIZE: int = 10000
+    PRIVATE_CONVERSATION_INDEX_SIZE: int = 100000  # (user pair -> private conversation) entries
+
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
 
@@ -19,4 +107,5 @@ INSTALLED_APPS = [
     "src.models.auth",
     "src.models.conversation",
     "src.models.message",
+    "src.models.media",
 ]
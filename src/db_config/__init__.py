@@ -1,2 +1,3 @@
 from .local_json_config import *
+from .local_store import *
 from .main import *
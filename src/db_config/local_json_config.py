@@ -1,39 +1,340 @@
+import asyncio
 import json
 import os
+import threading
+import time
+from collections import defaultdict
 from datetime import datetime
+from typing import IO, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+import aiofiles
 
 from src.config import Config as settings
 
 BASE_DIR = "./local_messages"
 os.makedirs(settings.LOCAL_DB_DIR, exist_ok=True)
 
+# the log structure for local storage, one append-only JSONL segment log per (sender, receiver) pair:
 
-def user_log_file(sender: str, receiver: str) -> str:
+#     local_messages /
+#     ├── chris/
+#     │   └── eddy/              ← messages chris sent to Eddy
+#     │       ├── 00000000-00000003.jsonl  ← merged segment, the sealed segments 0 to 3
+#     │       ├── 00000004.jsonl  ← sealed segment
+#     │       └── 00000005.jsonl  ← active segment, the only one appended to
+#     │
+#     ├── eddy/
+#     │   └── chris/             ← messages Eddy sent to Chris
 
-    # the log file structure for local storage:
+SEGMENT_SUFFIX = ".jsonl"
 
-    #     local_messages /
-    #     ├── chris/
-    #     │   └── eddy.json ← messages chris sent to Eddy
-    #
-    #     ├── eddy/
-    #     │   └── chris.json ← messages Chris sent to Eddy
-    #
-    user_dir = os.path.join(settings.LOCAL_DB_DIR, sender)
-    os.makedirs(user_dir, exist_ok=True)
-    return os.path.join(user_dir, f"{receiver}.json")
 
+def pair_log_dir(sender: str, receiver: str) -> str:
+    return os.path.join(settings.LOCAL_DB_DIR, sender, receiver)
 
-def register_sent_messages(sender: str, receiver: str, message: str):
-    path = user_log_file(sender, receiver)
-    message_info = {"from": sender, "to": receiver, "message": message, "timestamp": datetime.now().isoformat()}
-    if os.path.exists(path):
-        with open(path, "r") as f:
-            messages = json.load(f)
-    else:
-        messages = []
 
-    messages.append(message_info)
+def list_segments(sender: str, receiver: str) -> List[str]:
+    log_dir = pair_log_dir(sender, receiver)
+    if not os.path.isdir(log_dir):
+        return []
+    names = sorted(name for name in os.listdir(log_dir) if name.endswith(SEGMENT_SUFFIX))
+    paths = [os.path.join(log_dir, name) for name in names]
+    leftovers = merged_sources(paths)
+    return [path for path in paths if path not in leftovers]
+
+
+def merged_sources(paths: List[str]) -> Set[str]:
+    # a crash between writing a merged segment and removing its sources leaves both, the sources are ignored.
+    merged = [segment_range(path) for path in paths if is_merged(path)]
+    return {
+        path
+        for path in paths
+        if not is_merged(path) and any(first <= segment_index(path) <= last for first, last in merged)
+    }
+
+
+def segment_path(sender: str, receiver: str, index: int) -> str:
+    return os.path.join(pair_log_dir(sender, receiver), f"{index:08d}{SEGMENT_SUFFIX}")
+
+
+def merged_segment_path(sender: str, receiver: str, first: int, last: int) -> str:
+    return os.path.join(pair_log_dir(sender, receiver), f"{first:08d}-{last:08d}{SEGMENT_SUFFIX}")
+
+
+def segment_range(path: str) -> Tuple[int, int]:
+    # (first, last) index of the sealed segments a file holds, both the same for a plain segment.
+    bounds = os.path.basename(path)[: -len(SEGMENT_SUFFIX)].split("-")
+    return int(bounds[0]), int(bounds[-1])
+
+
+def segment_index(path: str) -> int:
+    return segment_range(path)[1]
+
+
+def is_merged(path: str) -> bool:
+    first, last = segment_range(path)
+    return first != last
+
+
+class MessageLog:
+    # writes are queued and persisted by a single background task, so callers never wait on disk.
+    # the task appends whole batches to the active segment from a worker thread, fsyncs every
+    # `fsync_batch` entries (or `fsync_interval` seconds), rotates segments once they reach
+    # `segment_max_bytes` and merges the segments sealed since the last merge once there are more than
+    # `compact_segments` of them, so an entry is copied once however long the log grows.
+    # readers list the segments of a pair under `_lock` and are counted until they are done: a merge only
+    # swaps its segments in when no reader of the pair could still open one of the sources.
+
+    def __init__(self, segment_max_bytes: int, fsync_batch: int, fsync_interval: float, compact_segments: int):
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.compact_segments = compact_segments
+
+        self._queue: asyncio.Queue | None = None
+        self._writer: asyncio.Task | None = None
+        self._files: Dict[Tuple[str, str], IO] = {}
+        self._unsynced = 0
+        self._last_fsync = time.monotonic()
+        self._legacy_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._readers: Dict[Tuple[str, str], int] = defaultdict(int)
+
+    def append(self, sender: str, receiver: str, entry: dict):
+        if self._writer is None:
+            self.start()
+        self._queue.put_nowait((sender, receiver, entry))
+
+    def start(self):
+        if self._writer is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._writer = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._writer is None:
+            return
+        await self._queue.put(None)
+        await self._writer
+        self._writer = None
+        await asyncio.to_thread(self._close_files)
+
+    async def _run(self):
+        while True:
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout=self.fsync_interval)
+            except asyncio.TimeoutError:
+                if self._unsynced:
+                    try:
+                        await asyncio.to_thread(self._fsync)
+                    except Exception as e:
+                        print(f"Local message log fsync failed: {e}")
+                continue
+
+            batch, stopping = [], item is None
+            if item is not None:
+                batch.append(item)
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                else:
+                    batch.append(item)
+
+            if batch:
+                # whatever goes wrong, the writer keeps running: the next batches must still be persisted.
+                try:
+                    await asyncio.to_thread(self._write_batch, batch)
+                except Exception as e:
+                    print(f"Local message log write failed: {e}")
 
-    with open(path, "w") as f:
-        json.dump(messages, f, indent=2)
+            if stopping:
+                await asyncio.to_thread(self._fsync)
+                return
+
+    def _write_batch(self, batch: List[Tuple[str, str, dict]]):
+        by_pair = defaultdict(list)
+        for sender, receiver, entry in batch:
+            try:
+                by_pair[(sender, receiver)].append(json.dumps(entry) + "\n")
+            except (TypeError, ValueError) as e:
+                print(f"Local message log dropped an entry of {sender}/{receiver}: {e}")
+
+        for pair, lines in by_pair.items():
+            f = self._active_file(*pair)
+            f.write("".join(lines))
+            f.flush()
+            if f.tell() >= self.segment_max_bytes:
+                self._rotate(*pair)
+
+        self._unsynced += len(batch)
+        if self._unsynced >= self.fsync_batch or time.monotonic() - self._last_fsync >= self.fsync_interval:
+            self._fsync()
+
+    def _active_file(self, sender: str, receiver: str) -> IO:
+        f = self._files.get((sender, receiver))
+        if f is None:
+            self.migrate_legacy_file(sender, receiver)
+            os.makedirs(pair_log_dir(sender, receiver), exist_ok=True)
+            self._remove_merged_sources(sender, receiver)
+            segments = list_segments(sender, receiver)
+            path = segments[-1] if segments else segment_path(sender, receiver, 0)
+            if is_merged(path):
+                # merged segments are sealed, appends go to a segment of their own.
+                path = segment_path(sender, receiver, segment_index(path) + 1)
+            self._truncate_torn_tail(path)
+            f = self._files[(sender, receiver)] = open(path, "a")
+        return f
+
+    def _remove_merged_sources(self, sender: str, receiver: str):
+        log_dir = pair_log_dir(sender, receiver)
+        with self._lock:
+            paths = [os.path.join(log_dir, name) for name in os.listdir(log_dir) if name.endswith(SEGMENT_SUFFIX)]
+            for path in merged_sources(paths):
+                os.remove(path)
+
+    @staticmethod
+    def _truncate_torn_tail(path: str):
+        # a crash mid-write leaves an incomplete last line, appending after it would glue it to the next entry.
+        if not os.path.exists(path):
+            return
+        with open(path, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if not size:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            f.seek(0)
+            data = f.read()
+            f.truncate(data.rfind(b"\n") + 1)
+
+    def _rotate(self, sender: str, receiver: str):
+        f = self._files.pop((sender, receiver))
+        os.fsync(f.fileno())
+        f.close()
+
+        segments = list_segments(sender, receiver)
+        next_index = segment_index(segments[-1]) + 1
+        open(segment_path(sender, receiver, next_index), "a").close()
+
+        # every segment but the new active one is sealed, those not merged yet are merged together.
+        unmerged = [path for path in segments if not is_merged(path)]
+        if len(unmerged) > self.compact_segments:
+            self._compact(sender, receiver, unmerged)
+
+    def _compact(self, sender: str, receiver: str, segments: List[str]):
+        # the entries order is preserved: the merged segment takes the place of its sources in the listing.
+        # while the pair is being read the merge is left to a later rotation, which also takes the segments
+        # sealed meanwhile.
+        if self._readers.get((sender, receiver)):
+            return
+        target = merged_segment_path(sender, receiver, segment_index(segments[0]), segment_index(segments[-1]))
+        tmp_path = target + ".compacting"
+        with open(tmp_path, "w") as out:
+            for path in segments:
+                with open(path, "r") as f:
+                    for line in f:
+                        out.write(line)
+            out.flush()
+            os.fsync(out.fileno())
+
+        with self._lock:
+            if self._readers.get((sender, receiver)):
+                os.remove(tmp_path)
+                return
+            os.replace(tmp_path, target)
+            for path in segments:
+                os.remove(path)
+
+    def _fsync(self):
+        for f in self._files.values():
+            f.flush()
+            os.fsync(f.fileno())
+        self._unsynced = 0
+        self._last_fsync = time.monotonic()
+
+    def _close_files(self):
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+    def migrate_legacy_file(self, sender: str, receiver: str):
+        # converts the former whole-file `{sender}/{receiver}.json` array into the first segment.
+        legacy_path = os.path.join(settings.LOCAL_DB_DIR, sender, f"{receiver}.json")
+        with self._legacy_lock:
+            if not os.path.exists(legacy_path):
+                return
+            with open(legacy_path, "r") as f:
+                entries = json.load(f)
+
+            os.makedirs(pair_log_dir(sender, receiver), exist_ok=True)
+            tmp_path = segment_path(sender, receiver, 0) + ".migrating"
+            with open(tmp_path, "w") as out:
+                out.writelines(json.dumps(entry) + "\n" for entry in entries)
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp_path, segment_path(sender, receiver, 0))
+            os.remove(legacy_path)
+
+    async def read(
+        self,
+        sender: str,
+        receiver: str,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        tail: Optional[int] = None,
+    ) -> AsyncIterator[dict]:
+        # streams entries oldest first, `tail` keeps only the last N entries, `offset` skips the first N.
+        # a line without its newline is still being written (or was torn by a crash), it is not an entry yet.
+        await asyncio.to_thread(self.migrate_legacy_file, sender, receiver)
+        pair = (sender, receiver)
+        with self._lock:
+            segments = list_segments(sender, receiver)
+            self._readers[pair] += 1
+        try:
+            if tail is not None:
+                offset = max(await asyncio.to_thread(self._count_entries, segments) - tail, offset)
+
+            position, remaining = 0, limit
+            for path in segments:
+                async with aiofiles.open(path, "r") as f:
+                    async for line in f:
+                        if not line.endswith("\n") or not line.strip():
+                            continue
+                        if position < offset:
+                            position += 1
+                            continue
+                        if remaining is not None:
+                            if remaining <= 0:
+                                return
+                            remaining -= 1
+                        position += 1
+                        yield json.loads(line)
+        finally:
+            with self._lock:
+                self._readers[pair] -= 1
+                if not self._readers[pair]:
+                    del self._readers[pair]
+
+    @staticmethod
+    def _count_entries(segments: List[str]) -> int:
+        count = 0
+        for path in segments:
+            with open(path, "r") as f:
+                count += sum(1 for line in f if line.endswith("\n") and line.strip())
+        return count
+
+
+message_log = MessageLog(
+    segment_max_bytes=settings.LOCAL_LOG_SEGMENT_MAX_BYTES,
+    fsync_batch=settings.LOCAL_LOG_FSYNC_BATCH,
+    fsync_interval=settings.LOCAL_LOG_FSYNC_INTERVAL,
+    compact_segments=settings.LOCAL_LOG_COMPACT_SEGMENTS,
+)
+
+
+def register_sent_messages(sender: str, receiver: str, message: str):
+    message_info = {"from": sender, "to": receiver, "message": message, "timestamp": datetime.now().isoformat()}
+    message_log.append(sender, receiver, message_info)
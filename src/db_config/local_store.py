@@ -0,0 +1,355 @@
+import asyncio
+import base64
+import json
+import time
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import (AsyncIterator, Awaitable, Callable, Dict, List, Optional,
+                    Type)
+
+from sqlalchemy import (Column, Float, Integer, MetaData, String, Table, Text,
+                        delete, func, select, update)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from src.config import Config as settings
+
+from .main import async_session, get_db_url
+
+# the local store has a schema of its own: rows are kept as JSON payloads so any model
+# (postgres-only column types included) can be written locally and replayed on the main database.
+local_metadata = MetaData()
+
+local_records = Table(
+    "local_record",
+    local_metadata,
+    Column("seq", Integer, primary_key=True, autoincrement=True),
+    Column("model", String, nullable=False),
+    Column("record_key", String, nullable=False, unique=True),  # "<table>:<primary key>", the idempotency key
+    Column("payload", Text, nullable=False),
+    Column("state", String, nullable=False, index=True),  # "pending", "synced" or "failed"
+    Column("attempts", Integer, nullable=False, default=0),
+    Column("next_attempt_at", Float, nullable=False),
+    Column("last_error", Text),
+    Column("created_at", Float, nullable=False),
+    Column("synced_at", Float),
+)
+
+
+def _encode_value(value):
+    if isinstance(value, bytes):
+        return {"__bytes__": base64.b64encode(value).decode()}
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not serializable")
+
+
+def _decode_object(data: dict):
+    if data.keys() == {"__bytes__"}:
+        return base64.b64decode(data["__bytes__"])
+    return data
+
+
+def encode_record(obj: SQLModel) -> str:
+    return json.dumps(obj.model_dump(), default=_encode_value)
+
+
+def decode_record(model: Type[SQLModel], payload: str) -> SQLModel:
+    return model.model_validate(json.loads(payload, object_hook=_decode_object))
+
+
+def record_key(obj: SQLModel) -> str:
+    table = obj.__table__
+    return ":".join([table.name, *(str(getattr(obj, column.name)) for column in table.primary_key.columns)])
+
+
+# errors caused by the rows themselves (a constraint, a value the column refuses, a payload that no longer
+# decodes), anything else (a connection refused or lost, a timeout) is an outage of the main database.
+ROW_ERRORS = (IntegrityError, DataError, ValueError, TypeError)
+
+# called in the main database transaction that inserted the rows, with only the rows that were
+# actually new (a retried batch never runs it twice for the same row).
+AfterSync = Callable[[AsyncSession, List[SQLModel]], Awaitable[None]]
+
+
+@dataclass
+class SyncTarget:
+    model: Type[SQLModel]
+    after_sync: Optional[AfterSync] = None
+
+
+@dataclass
+class WriteBatch:
+    rows: List[dict] = field(default_factory=list)
+    written: bool = False
+
+
+class LocalStore:
+    # local-first writes: rows land in the local SQLite store and the caller returns right away,
+    # a background worker then replays them on the main database in batches.
+    # - idempotency: the record key is the row primary key, generated by the writer. the main database
+    #   insert ignores rows that already exist, so replaying a batch after a crash duplicates nothing.
+    # - conflicts: the first write of a key wins, a later conflicting one is dropped as already synced.
+    # - retries: a batch failing on a row error is split to isolate the failing rows, which are retried
+    #   with an exponential backoff and marked "failed" (kept for inspection, see requeue_failed) after
+    #   `max_attempts`. an outage counts against no row: the whole sync pauses, backing off up to `max_pause`.
+
+    def __init__(
+        self,
+        url: str,
+        enabled: bool,
+        batch_size: int,
+        interval: float,
+        max_attempts: int,
+        retry_base: float,
+        retention: float,
+        max_pause: float,
+    ):
+        self.engine = create_async_engine(url)
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retention = retention
+        self.max_pause = max_pause
+
+        self.targets: Dict[str, SyncTarget] = {}
+        self.synced = 0
+        self.retried = 0
+        self.failed = 0
+        self.outages = 0
+        self.paused_until = 0.0
+        self._consecutive_outages = 0
+        self._wakeup = asyncio.Event()
+        self._write_lock = asyncio.Lock()
+        self._write_batch = WriteBatch()
+        self._worker: asyncio.Task | None = None
+
+    def register(self, model: Type[SQLModel], after_sync: Optional[AfterSync] = None):
+        # models are synced in registration order, so register parents before the rows referencing them.
+        self.targets[model.__table__.name] = SyncTarget(model=model, after_sync=after_sync)
+
+    async def start(self):
+        if not self.enabled or self._worker is not None:
+            return
+        async with self.engine.begin() as connection:
+            await connection.exec_driver_sql("PRAGMA journal_mode=WAL")
+            await connection.run_sync(local_metadata.create_all)
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        # one last pass, whatever is left is picked up on the next start.
+        try:
+            await self._sync_pending()
+        except Exception as e:
+            print(f"Local store sync failed: {e}")
+        await self.engine.dispose()
+
+    async def write(self, objs: List[SQLModel]):
+        now = time.time()
+        rows = [
+            {
+                "model": obj.__table__.name,
+                "record_key": record_key(obj),
+                "payload": encode_record(obj),
+                "state": "pending",
+                "attempts": 0,
+                "next_attempt_at": now,
+                "created_at": now,
+            }
+            for obj in objs
+        ]
+        # group commit: the writers arriving while a transaction is open join the next batch, the first of
+        # them to get the lock commits it for all (the others find their rows written). a failed batch is
+        # written again by its next writer, the insert is idempotent.
+        batch = self._write_batch
+        batch.rows.extend(rows)
+        async with self._write_lock:
+            if not batch.written:
+                if self._write_batch is batch:
+                    self._write_batch = WriteBatch()
+                async with self.engine.begin() as connection:
+                    await connection.execute(sqlite_insert(local_records).on_conflict_do_nothing(), batch.rows)
+                batch.written = True
+        self._wakeup.set()
+
+    async def requeue_failed(self) -> int:
+        # gives the rows marked "failed" a new round of attempts, once whatever failed them is fixed.
+        statement = (
+            update(local_records)
+            .where(local_records.c.state == "failed")
+            .values(state="pending", attempts=0, next_attempt_at=time.time(), last_error=None)
+        )
+        async with self._writing() as connection:
+            requeued = (await connection.execute(statement)).rowcount
+        self._wakeup.set()
+        return requeued
+
+    async def get(self, model: Type[SQLModel], id) -> Optional[SQLModel]:
+        statement = select(local_records.c.payload).where(
+            local_records.c.record_key == f"{model.__table__.name}:{id}", local_records.c.state != "failed"
+        )
+        async with self.engine.connect() as connection:
+            payload = (await connection.execute(statement)).scalar()
+        return decode_record(model, payload) if payload is not None else None
+
+    @asynccontextmanager
+    async def _writing(self) -> AsyncIterator[AsyncConnection]:
+        # one write transaction at a time: SQLite takes a single writer anyway, and queueing here in order
+        # keeps the senders out of its busy handler, whose growing sleeps made the tail latency.
+        async with self._write_lock, self.engine.begin() as connection:
+            yield connection
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if time.time() >= self.paused_until:
+                await self._sync_pass()
+
+    async def _sync_pass(self):
+        try:
+            await self._sync_pending()
+            await self._purge()
+        except Exception as e:
+            self.outages += 1
+            self._consecutive_outages += 1
+            pause = min(self.retry_base * 2**self._consecutive_outages, self.max_pause)
+            self.paused_until = time.time() + pause
+            print(f"Local store sync paused for {pause:.1f}s: {e}")
+            return
+        self._consecutive_outages = 0
+        self.paused_until = 0.0
+
+    async def _sync_pending(self):
+        while await self._sync_batch() == self.batch_size:
+            pass
+
+    async def _sync_batch(self) -> int:
+        statement = (
+            select(local_records)
+            .where(local_records.c.state == "pending", local_records.c.next_attempt_at <= time.time())
+            .order_by(local_records.c.seq)
+            .limit(self.batch_size)
+        )
+        async with self.engine.connect() as connection:
+            rows = (await connection.execute(statement)).all()
+
+        by_model = defaultdict(list)
+        for row in rows:
+            by_model[row.model].append(row)
+
+        for model_name, target in self.targets.items():
+            if by_model.get(model_name):
+                await self._sync_rows(target, by_model[model_name])
+        return len(rows)
+
+    async def _sync_rows(self, target: SyncTarget, rows: list):
+        try:
+            objs = [decode_record(target.model, row.payload) for row in rows]
+            async with async_session() as session:
+                inserted = await self._insert(session, target.model, objs)
+                if inserted and target.after_sync is not None:
+                    await target.after_sync(session, inserted)
+                await session.commit()
+        except ROW_ERRORS as e:
+            if len(rows) > 1:
+                # one bad row must not hold back the whole batch.
+                for row in rows:
+                    await self._sync_rows(target, [row])
+                return
+            await self._retry_later(rows[0], e)
+            return
+
+        await self._set_state(rows, state="synced", synced_at=time.time())
+        self.synced += len(rows)
+
+    @staticmethod
+    async def _insert(session: AsyncSession, model: Type[SQLModel], objs: List[SQLModel]) -> List[SQLModel]:
+        primary_key = list(model.__table__.primary_key.columns)
+        statement = (
+            pg_insert(model.__table__)
+            .values([obj.model_dump() for obj in objs])
+            .on_conflict_do_nothing()
+            .returning(*primary_key)
+        )
+        inserted_keys = {tuple(row) for row in (await session.exec(statement)).all()}
+        return [obj for obj in objs if tuple(getattr(obj, column.name) for column in primary_key) in inserted_keys]
+
+    async def _retry_later(self, row, error: Exception):
+        attempts = row.attempts + 1
+        if attempts >= self.max_attempts:
+            self.failed += 1
+            print(f"Local store gave up on {row.record_key}: {error}")
+            await self._set_state([row], state="failed", attempts=attempts, last_error=str(error))
+            return
+        self.retried += 1
+        await self._set_state(
+            [row],
+            attempts=attempts,
+            next_attempt_at=time.time() + self.retry_base * 2**attempts,
+            last_error=str(error),
+        )
+
+    async def _set_state(self, rows: list, **values):
+        statement = update(local_records).where(local_records.c.seq.in_([row.seq for row in rows])).values(**values)
+        async with self._writing() as connection:
+            await connection.execute(statement)
+
+    async def _purge(self):
+        # synced rows stay readable locally for `retention` seconds.
+        statement = delete(local_records).where(
+            local_records.c.state == "synced", local_records.c.synced_at < time.time() - self.retention
+        )
+        async with self._writing() as connection:
+            await connection.execute(statement)
+
+    async def stats(self) -> dict:
+        counts = {}
+        if self._worker is not None:
+            statement = select(local_records.c.state, func.count()).group_by(local_records.c.state)
+            async with self.engine.connect() as connection:
+                counts = {state: count for state, count in (await connection.execute(statement)).all()}
+        return {
+            "enabled": self.enabled,
+            "pending": counts.get("pending", 0),
+            "failed": counts.get("failed", 0),
+            "synced_total": self.synced,
+            "retried_total": self.retried,
+            "failed_total": self.failed,
+            "outages_total": self.outages,
+            "paused_for": max(self.paused_until - time.time(), 0.0),
+        }
+
+
+local_store = LocalStore(
+    url=get_db_url(),
+    enabled=settings.LOCAL_STORE_ENABLED,
+    batch_size=settings.LOCAL_SYNC_BATCH_SIZE,
+    interval=settings.LOCAL_SYNC_INTERVAL,
+    max_attempts=settings.LOCAL_SYNC_MAX_ATTEMPTS,
+    retry_base=settings.LOCAL_SYNC_RETRY_BASE,
+    retention=settings.LOCAL_STORE_RETENTION,
+    max_pause=settings.LOCAL_SYNC_MAX_PAUSE,
+)
@@ -1,38 +1,108 @@
+import asyncio
 import os
+import time
+from dataclasses import dataclass
 from typing import Annotated
 
 from fastapi import Depends
-from sqlalchemy.ext.asyncio.engine import AsyncEngine
-from sqlalchemy.orm import sessionmaker
-from sqlmodel import Session, SQLModel, create_engine
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlmodel import Session, SQLModel
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from src.config import Config as settings
 
-# ToDo: logic about two sessions to be configured soon...
-
 
 def get_db_path() -> str:
     os.makedirs(settings.LOCAL_DB_DIR, exist_ok=True)
     return os.path.join(settings.LOCAL_DB_DIR, "msg_store.db")
 
 
-# def get_db_url() -> str:
-#     return f"sqlite+aiosqlite:///{get_db_path()}"
+def get_db_url() -> str:
+    return f"sqlite+aiosqlite:///{get_db_path()}"
 
-main_engine = AsyncEngine(create_engine(settings.DATABASE_URL, echo=False))
-# local_async_engine = AsyncEngine(create_engine(get_db_url(), echo=True))
 
+@dataclass
+class PoolMetrics:
+    checkouts: int = 0
+    wait_time_total: float = 0.0
+    wait_time_max: float = 0.0
 
-async def get_session():
-    session = sessionmaker(bind=main_engine, class_=AsyncSession, expire_on_commit=False)
+    def record_wait(self, wait_time: float):
+        self.checkouts += 1
+        self.wait_time_total += wait_time
+        self.wait_time_max = max(self.wait_time_max, wait_time)
+
+
+pool_metrics = PoolMetrics()
+
+
+class MonitoredPool(AsyncAdaptedQueuePool):
+    # times every checkout where it happens, whoever asks for a connection and only when one is needed.
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_metrics.record_wait(time.perf_counter() - started_at)
+
+
+def get_engine_options() -> dict:
+    options = {
+        "echo": False,
+        "poolclass": MonitoredPool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+    if make_url(settings.DATABASE_URL).get_driver_name() == "asyncpg":
+        # prepared statements caches, sqlalchemy's one and asyncpg's own (set both to 0 behind pgbouncer).
+        options["connect_args"] = {
+            "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        }
+    return options
+
+
+main_engine = create_async_engine(settings.DATABASE_URL, **get_engine_options())
 
-    # sqlite_session = sessionmaker(bind=local_async_engine, class_=AsyncSession, expire_on_commit=False)
+# one factory for the whole process, sessions borrow their connection from main_engine's pool.
+async_session = async_sessionmaker(bind=main_engine, class_=AsyncSession, expire_on_commit=False)
 
-    async with (
-        session() as session,
-        # sqlite_session() as sqlite_session
-    ):
+
+def get_pool_status() -> dict:
+    pool = main_engine.pool
+    return {
+        "size": pool.size() if hasattr(pool, "size") else None,
+        "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+        "checked_in": pool.checkedin() if hasattr(pool, "checkedin") else None,
+        "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+        "checkouts": pool_metrics.checkouts,
+        "wait_time_avg": pool_metrics.wait_time_total / pool_metrics.checkouts if pool_metrics.checkouts else 0.0,
+        "wait_time_max": pool_metrics.wait_time_max,
+    }
+
+
+async def warm_up_pool():
+    # opens the configured number of connections up front so the first requests do not pay for them.
+    async def ping():
+        async with main_engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+    await asyncio.gather(*(ping() for _ in range(min(settings.DB_POOL_WARMUP, settings.DB_POOL_SIZE))))
+
+
+async def dispose_pool():
+    await main_engine.dispose()
+
+
+async def get_session():
+    # the connection is checked out on the first statement, a request served from the caches never takes one.
+    async with async_session() as session:
         yield session
 
 
@@ -1,3 +1,4 @@
 from .auth import *
 from .conversation import *
+from .media import *
 from .message import *
@@ -19,15 +19,16 @@ class User(SQLModel, table=True):
     created_at: datetime = Field(default_factory=datetime.now)
 
     # Relationships
+    # never loaded implicitly: managers opt in with loader options (e.g. selectinload) per query.
     sent_messages: List["Message"] = Relationship(
-        back_populates="sender", sa_relationship_kwargs={"foreign_keys": "Message.sender_id", "lazy": "selectin"}
+        back_populates="sender", sa_relationship_kwargs={"foreign_keys": "Message.sender_id", "lazy": "noload"}
     )
     received_messages: List["Message"] = Relationship(
-        back_populates="recipient", sa_relationship_kwargs={"foreign_keys": "Message.recipient_id", "lazy": "selectin"}
+        back_populates="recipient", sa_relationship_kwargs={"foreign_keys": "Message.recipient_id", "lazy": "noload"}
     )
 
     conversations: List["Conversation"] = Relationship(
-        back_populates="participants", link_model=ConversationParticipant, sa_relationship_kwargs={"lazy": "selectin"}
+        back_populates="participants", link_model=ConversationParticipant, sa_relationship_kwargs={"lazy": "noload"}
     )
 
 
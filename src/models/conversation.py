@@ -1,6 +1,6 @@
 import uuid
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Optional, Union
 
 import sqlalchemy.dialects.postgresql as pg
 from fastapi import HTTPException
@@ -13,18 +13,35 @@ class ConversationParticipant(SQLModel, table=True):
     user_id: uuid.UUID = Field(foreign_key="user.id", primary_key=True)
 
 
+def pair_key(user1_id: Union[str, uuid.UUID], user2_id: Union[str, uuid.UUID]) -> str:
+    # the same for both directions of a pair and any spelling of the ids, identifies its private conversation.
+    return ":".join(sorted(str(uuid.UUID(str(user_id))) for user_id in (user1_id, user2_id)))
+
+
+PRIVATE_CONVERSATION_NAMESPACE = uuid.UUID("5b7cb3e2-8f0c-4d8e-9a55-0c6b1f6f2a41")
+
+
+def private_conversation_id(key: str) -> uuid.UUID:
+    # derived from the pair key: every node (and the local store) creating the conversation of a pair picks
+    # the same id. conversations created before have random ids, they are found by their pair key.
+    return uuid.uuid5(PRIVATE_CONVERSATION_NAMESPACE, key)
+
+
 class Conversation(SQLModel, table=True):
     id: uuid.UUID = Field(sa_column=Column(pg.UUID, nullable=False, primary_key=True, default=uuid.uuid4))
     conversation_name: Optional[str] = Field(default=None)
     is_group: bool = Field(default=False)
+    # set for private conversations only, the unique index makes a second conversation for a pair impossible
+    pair_key: Optional[str] = Field(default=None, unique=True)
     created_at: datetime = Field(default_factory=datetime.now)
     last_activity: datetime = Field(default_factory=datetime.now)
 
     # Relationships
-    messages: List["Message"] = Relationship(
-        back_populates="conversation", sa_relationship_kwargs={"lazy": "selectin"}
+    # never loaded implicitly: managers opt in with loader options (e.g. selectinload) per query.
+    messages: List["Message"] = Relationship(back_populates="conversation", sa_relationship_kwargs={"lazy": "noload"})
+    participants: List["User"] = Relationship(
+        back_populates="conversations", link_model=ConversationParticipant, sa_relationship_kwargs={"lazy": "noload"}
     )
-    participants: List["User"] = Relationship(back_populates="conversations", link_model=ConversationParticipant)
 
     def validate_conversation(self):
         if not self.is_group and len(self.participants) > 2:
@@ -32,3 +49,16 @@ class Conversation(SQLModel, table=True):
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Private conversation cannot have more than 2 participants",
             )
+
+
+# FOR GROUP ENCRYPTION
+# every member sending to a group uses one symmetric "sender key" for all of its messages,
+# stored wrapped (AES-GCM) under a key derived from the sender's own key pair.
+class GroupSenderKey(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    conversation_id: uuid.UUID = Field(foreign_key="conversation.id", index=True)
+    sender_id: uuid.UUID = Field(foreign_key="user.id")
+    wrapped_key: bytes = Field(sa_column=Column(pg.BYTEA, nullable=False))
+    nonce: bytes = Field(sa_column=Column(pg.BYTEA, nullable=False))
+    created_at: datetime = Field(default_factory=datetime.now)
+    revoked: bool = Field(default=False)  # rotated whenever the group membership changes
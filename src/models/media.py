@@ -0,0 +1,37 @@
+import uuid
+from datetime import datetime
+from enum import Enum
+from typing import Optional
+
+import sqlalchemy.dialects.postgresql as pg
+from sqlmodel import Column, Field, SQLModel
+
+
+class MediaStatus(str, Enum):
+    UPLOADING = "uploading"
+    READY = "ready"
+
+
+# one stored object per distinct content, shared by every upload of it. the address is a MAC of the
+# plaintext under a key derived from the pair's session key, so identical files only deduplicate
+# within the pair that can decrypt them and the address tells nothing about the content.
+class MediaBlob(SQLModel, table=True):
+    address: str = Field(primary_key=True)
+    size: int  # plaintext bytes
+    chunk_size: int  # plaintext bytes per encrypted chunk
+    created_at: datetime = Field(default_factory=datetime.now)
+
+
+# an upload, from its first chunk to the message referencing it. media is encrypted for one
+# (owner, recipient) pair and only those two can download it.
+class Media(SQLModel, table=True):
+    id: uuid.UUID = Field(sa_column=Column(pg.UUID, nullable=False, primary_key=True, default=uuid.uuid4))
+    owner_id: uuid.UUID = Field(foreign_key="user.id", index=True)
+    recipient_id: uuid.UUID = Field(foreign_key="user.id")
+    filename: Optional[str] = Field(default=None)
+    mime_type: Optional[str] = Field(default=None)
+    size: int  # declared plaintext size, in bytes
+    chunk_size: int
+    status: MediaStatus = Field(default=MediaStatus.UPLOADING)
+    blob_address: Optional[str] = Field(default=None, foreign_key="mediablob.address")
+    created_at: datetime = Field(default_factory=datetime.now)
@@ -4,6 +4,7 @@ from enum import Enum
 from typing import Optional
 
 import sqlalchemy.dialects.postgresql as pg
+from sqlalchemy import ForeignKey, Index
 from sqlmodel import Column, Field, Relationship, SQLModel
 
 
@@ -16,6 +17,11 @@ class MessageType(str, Enum):
 
 
 class Message(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_message_conversation_timestamp_id", "conversation_id", "timestamp", "id"),
+        Index("ix_message_recipient_is_read", "recipient_id", "is_read"),
+    )
+
     id: uuid.UUID = Field(sa_column=Column(pg.UUID, nullable=False, primary_key=True, default=uuid.uuid4))
     timestamp: datetime = Field(default_factory=datetime.now)
     message_type: MessageType = Field(default=MessageType.TEXT)
@@ -24,48 +30,72 @@ class Message(SQLModel, table=True):
     recipient_id: Optional[uuid.UUID] = Field(foreign_key="user.id")
     conversation_id: Optional[uuid.UUID] = Field(foreign_key="conversation.id")
 
-    #################
-    # MEDIA METADATA
-    ################
-
     # Content field populated only for text message types.
-    # For TEXT messages
     content: Optional[str] = Field(default=None)
 
-    # For IMAGE messages
-    image_url: Optional[str] = Field(default=None)
-    image_filename: Optional[str] = Field(default=None)
-    image_size: Optional[int] = Field(default=None)  # Size in bytes
-
-    # For FILE messages
-    file_url: Optional[str] = Field(default=None)
-    file_filename: Optional[str] = Field(default=None)
-    file_size: Optional[int] = Field(default=None)  # Size in bytes
-    file_mime_type: Optional[str] = Field(default=None)
-
-    # For VOICE messages
-    voice_url: Optional[str] = Field(default=None)
-    voice_filename: Optional[str] = Field(default=None)
-    voice_duration: Optional[int] = Field(default=None)  # Duration in seconds
-
-    # For VIDEO messages
-    video_url: Optional[str] = Field(default=None)
-    video_filename: Optional[str] = Field(default=None)
-    video_size: Optional[int] = Field(default=None)  # Size in bytes
-    video_duration: Optional[int] = Field(default=None)  # Duration in seconds
-    video_thumbnail_url: Optional[str] = Field(default=None)
-
     # Optional caption for media messages
     caption: Optional[str] = Field(default=None)
 
     # Relationships
+    # accessing them without an explicit loader option raises instead of emitting a hidden query.
     sender: Optional["User"] = Relationship(
-        back_populates="sent_messages", sa_relationship_kwargs={"foreign_keys": "Message.sender_id"}
+        back_populates="sent_messages", sa_relationship_kwargs={"foreign_keys": "Message.sender_id", "lazy": "raise"}
     )
     recipient: Optional["User"] = Relationship(
-        back_populates="received_messages", sa_relationship_kwargs={"foreign_keys": "Message.recipient_id"}
+        back_populates="received_messages",
+        sa_relationship_kwargs={"foreign_keys": "Message.recipient_id", "lazy": "raise"},
+    )
+    conversation: Optional["Conversation"] = Relationship(
+        back_populates="messages", sa_relationship_kwargs={"lazy": "raise"}
+    )
+    # non-text messages only, loaded explicitly (see MessageManager.load_attachments)
+    attachment: Optional["MessageAttachment"] = Relationship(
+        sa_relationship_kwargs={
+            "lazy": "raise",
+            "uselist": False,
+            "cascade": "all, delete-orphan",
+            "passive_deletes": True,
+        }
     )
-    conversation: Optional["Conversation"] = Relationship(back_populates="messages")
 
     # FOR CRYPTOGRAPHIC PURPOSE
     nonce: bytes = Field(sa_column=Column(pg.BYTEA, nullable=True))  # number used once
+    # set for group messages only, which are encrypted with the sender key instead of a pairwise key
+    sender_key_id: Optional[int] = Field(default=None, foreign_key="groupsenderkey.id")
+
+
+# MEDIA METADATA
+# kept out of the message table so text messages, by far the most common, carry none of it.
+# the columns are shared by all the media types, each one filling only those it needs.
+class MessageAttachment(SQLModel, table=True):
+    message_id: uuid.UUID = Field(
+        sa_column=Column(pg.UUID, ForeignKey("message.id", ondelete="CASCADE"), primary_key=True)
+    )
+    media_id: Optional[uuid.UUID] = Field(default=None, foreign_key="media.id")  # uploaded media (see media app)
+    url: Optional[str] = Field(default=None)  # client-provided, for attachments sent before media uploads
+    filename: Optional[str] = Field(default=None)
+    size: Optional[int] = Field(default=None)  # Size in bytes (image, file, video)
+    mime_type: Optional[str] = Field(default=None)
+    duration: Optional[int] = Field(default=None)  # Duration in seconds (voice, video)
+    thumbnail_url: Optional[str] = Field(default=None)  # video
+
+
+# PER-USER DELIVERY QUEUE
+# every message gets a sequence number per recipient, handed out from the recipient's own counter,
+# and waits in the recipient's queue until one of their clients acknowledges it.
+MAX_SEQ = 2**31 - 1  # the sequence columns are int4
+
+
+class UserSequence(SQLModel, table=True):
+    user_id: uuid.UUID = Field(foreign_key="user.id", primary_key=True)
+    last_seq: int = Field(default=0)  # last sequence number handed out
+    acked_seq: int = Field(default=0)  # everything up to it was acknowledged (and trimmed from the queue)
+
+
+class MessageDelivery(SQLModel, table=True):
+    user_id: uuid.UUID = Field(foreign_key="user.id", primary_key=True)
+    seq: int = Field(primary_key=True)
+    # deleting a message takes it out of every queue
+    message_id: uuid.UUID = Field(
+        sa_column=Column(pg.UUID, ForeignKey("message.id", ondelete="CASCADE"), nullable=False, index=True)
+    )
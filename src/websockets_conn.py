@@ -1,8 +1,14 @@
+import asyncio
+import time
 import uuid
-from dataclasses import dataclass
-from typing import Dict, Union
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Set, Union
 
-from fastapi import WebSocket
+from fastapi import WebSocket, status
+
+from src.broker import Broker, get_broker
+from src.config import Config as settings
+from src.ws_frames import EncodedFrame, Frame, encode_payload
 
 
 @dataclass
@@ -10,16 +16,57 @@ class ConnectionInfo:
     websocket: WebSocket
     active_conversation_with: str | None = None
 
+    # outbound messages are queued per connection and written by the connection's own writer task,
+    # so a slow socket only ever delays itself.
+    queue: asyncio.Queue = field(default_factory=lambda: asyncio.Queue(maxsize=settings.WS_OUTBOUND_QUEUE_SIZE))
+    writer: asyncio.Task | None = None
+    sent: int = 0
+    dropped: int = 0
+    send_time_total: float = 0.0
+    send_time_max: float = 0.0
+    disconnecting: bool = False
+
+    # while the socket catches up, live deliveries and the replayed queue can carry the same message: the seqs
+    # sent either way are recorded here and the second copy is skipped (see claim_seqs).
+    catching_up: bool = False
+    delivered_seqs: Set[int] = field(default_factory=set)
+
 
 class ConnectionManager:
-    def __init__(self):
+    # `active_connections` only holds the sockets of this node, messages go through the broker
+    # which hands them back to whichever node(s) the recipient is connected to.
+
+    def __init__(self, broker: Broker, overflow_policy: str = "drop_oldest", binary_frames: bool = False):
         self.active_connections: Dict[str, Dict[WebSocket, ConnectionInfo]] = {}
+        self.broker = broker
+        self.overflow_policy = overflow_policy
+        self.binary_frames = binary_frames
+        self.slow_consumers_disconnected = 0
+        self._started = False
+        # fire-and-forget tasks are referenced until they finish, the event loop only keeps weak references.
+        self._background_tasks: Set[asyncio.Task] = set()
+
+    async def start(self):
+        if not self._started:
+            await self.broker.start(self.deliver_local)
+            self._started = True
 
-    async def connect(self, websocket: WebSocket, user_id: str):
+    async def stop(self):
+        if self._started:
+            await self.broker.stop()
+            self._started = False
+
+    async def connect(self, websocket: WebSocket, user_id: str, catching_up: bool = False):
+        # `catching_up` when the delivery queue is replayed to the socket next, until end_catch_up.
+        await self.start()
         await websocket.accept()
         if user_id not in self.active_connections:
             self.active_connections[user_id] = {}
-        self.active_connections[user_id][websocket] = ConnectionInfo(websocket=websocket)
+            await self.broker.subscribe(user_id)
+        connection_info = ConnectionInfo(websocket=websocket, catching_up=catching_up)
+        connection_info.writer = asyncio.create_task(self._write_loop(user_id, connection_info))
+        self.active_connections[user_id][websocket] = connection_info
+        await self.broker.set_online(user_id, len(self.active_connections[user_id]))
 
     async def set_active_conversation(self, websocket: WebSocket, user_id: str, conversation_with: str):
         if user_id in self.active_connections and websocket in self.active_connections[user_id]:
@@ -27,19 +74,157 @@ class ConnectionManager:
             self.active_connections[user_id][websocket].active_conversation_with = conversation_with
 
     async def disconnect(self, websocket: WebSocket, user_id: Union[str, uuid.UUID]):
+        user_id = str(user_id)
         if user_id in self.active_connections:
-            self.active_connections[user_id].pop(websocket, None)
+            connection_info = self.active_connections[user_id].pop(websocket, None)
+            if connection_info and connection_info.writer and connection_info.writer is not asyncio.current_task():
+                connection_info.writer.cancel()
+            await self.broker.set_online(user_id, len(self.active_connections[user_id]))
             if not self.active_connections[user_id]:
                 del self.active_connections[user_id]
+                await self.broker.unsubscribe(user_id)
+
+    async def is_online(self, user_id: str) -> bool:
+        return await self.broker.is_online(str(user_id))
+
+    async def online_users(self, user_ids: Iterable[str]) -> Set[str]:
+        return await self.broker.online_users(str(user_id) for user_id in user_ids)
 
     async def send_personal_message(self, message: dict, user_id: str, sender_id: str):
-        if user_id in self.active_connections:
-            for connection_info in self.active_connections[user_id].values():
+        await self.start()
+        await self.broker.publish(str(user_id), {"message": message, "sender_id": str(sender_id)})
+
+    async def send_to_many(self, message: dict, user_ids: Iterable[str], sender_id: str):
+        # group fan-out: one publish for all the recipients, one encoded frame per node.
+        await self.start()
+        await self.broker.publish_many(
+            [str(user_id) for user_id in user_ids], {"message": message, "sender_id": str(sender_id)}
+        )
+
+    async def deliver_local(self, user_ids: List[str], envelope: dict):
+        message, sender_id = envelope["message"], envelope["sender_id"]
+        frame = EncodedFrame(message, binary=self.binary_frames)
+        data = message.get("data") if isinstance(message, dict) else None
+        for user_id in user_ids:
+            seq = self._delivery_seq(data, user_id)
+            for connection_info in list(self.active_connections.get(user_id, {}).values()):
+                if seq is not None and not self._claim(connection_info, seq):
+                    continue
                 is_active_conversation = connection_info.active_conversation_with == sender_id
 
-                message_with_status = {**message, "is_active_conversation": is_active_conversation}
+                self._enqueue(user_id, connection_info, frame.for_connection(is_active_conversation))
+
+    def claim_seqs(self, websocket: WebSocket, user_id: str, seqs: Iterable[int]) -> Set[int]:
+        # the catch-up side of the dedupe: returns the seqs not delivered live to the socket yet.
+        connection_info = self.active_connections.get(str(user_id), {}).get(websocket)
+        if connection_info is None:
+            return set(seqs)
+        return {seq for seq in seqs if self._claim(connection_info, seq)}
+
+    def end_catch_up(self, websocket: WebSocket, user_id: str, last_seq: int):
+        # later live deliveries are past the replayed range, only the replayed seqs are still worth skipping.
+        connection_info = self.active_connections.get(str(user_id), {}).get(websocket)
+        if connection_info is not None:
+            connection_info.catching_up = False
+            connection_info.delivered_seqs = {seq for seq in connection_info.delivered_seqs if seq <= last_seq}
+
+    @staticmethod
+    def _delivery_seq(data, user_id: str) -> int | None:
+        if not isinstance(data, dict):
+            return None
+        if "seqs" in data:
+            return data["seqs"].get(user_id)
+        return data.get("seq")
+
+    @staticmethod
+    def _claim(connection_info: ConnectionInfo, seq: int) -> bool:
+        if seq in connection_info.delivered_seqs:
+            return False
+        if connection_info.catching_up:
+            connection_info.delivered_seqs.add(seq)
+        return True
+
+    def send_to_connection(self, websocket: WebSocket, user_id: str, message: dict):
+        # replies to one socket (acks, errors) go through its queue too, so its writer stays the only sender.
+        connection_info = self.active_connections.get(str(user_id), {}).get(websocket)
+        if connection_info is not None:
+            frame = encode_payload(message)
+            self._enqueue(str(user_id), connection_info, frame if self.binary_frames else frame.decode())
+
+    async def flush(self, websocket: WebSocket, user_id: str):
+        # waits until everything queued for the socket was written, bulk senders use it as backpressure.
+        connection_info = self.active_connections.get(str(user_id), {}).get(websocket)
+        if connection_info is not None:
+            drained = asyncio.ensure_future(connection_info.queue.join())
+            # a dead writer never drains the queue, stop waiting when it exits.
+            await asyncio.wait({drained, connection_info.writer}, return_when=asyncio.FIRST_COMPLETED)
+            drained.cancel()
+
+    def _enqueue(self, user_id: str, connection_info: ConnectionInfo, message: Frame):
+        # never waits: a full queue either loses its oldest message or gets its consumer disconnected.
+        if connection_info.queue.full():
+            if self.overflow_policy == "disconnect":
+                connection_info.dropped += 1
+                if not connection_info.disconnecting:
+                    connection_info.disconnecting = True
+                    task = asyncio.create_task(self._disconnect_slow_consumer(user_id, connection_info))
+                    self._background_tasks.add(task)
+                    task.add_done_callback(self._background_tasks.discard)
+                return
+            connection_info.queue.get_nowait()
+            connection_info.queue.task_done()
+            connection_info.dropped += 1
+        connection_info.queue.put_nowait(message)
+
+    async def _write_loop(self, user_id: str, connection_info: ConnectionInfo):
+        while True:
+            message = await connection_info.queue.get()
+            started_at = time.perf_counter()
+            try:
+                if isinstance(message, bytes):
+                    await connection_info.websocket.send_bytes(message)
+                else:
+                    await connection_info.websocket.send_text(message)
+            except Exception as e:
+                print(f"WebSocket send error: {e}")
+                await self.disconnect(connection_info.websocket, user_id)
+                return
+            finally:
+                connection_info.queue.task_done()
+            elapsed = time.perf_counter() - started_at
+            connection_info.sent += 1
+            connection_info.send_time_total += elapsed
+            connection_info.send_time_max = max(connection_info.send_time_max, elapsed)
+
+    async def _disconnect_slow_consumer(self, user_id: str, connection_info: ConnectionInfo):
+        if connection_info.websocket not in self.active_connections.get(user_id, {}):
+            return
+        self.slow_consumers_disconnected += 1
+        await self.disconnect(connection_info.websocket, user_id)
+        try:
+            await connection_info.websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        except Exception:
+            pass
 
-                await connection_info.websocket.send_json(message_with_status)
+    def stats(self) -> dict:
+        # aggregates only, no user id leaves the process.
+        connections = [
+            info for user_connections in self.active_connections.values() for info in user_connections.values()
+        ]
+        sent = sum(info.sent for info in connections)
+        return {
+            "users": len(self.active_connections),
+            "connections": len(connections),
+            "slow_consumers_disconnected": self.slow_consumers_disconnected,
+            "queue_depth_total": sum(info.queue.qsize() for info in connections),
+            "queue_depth_max": max((info.queue.qsize() for info in connections), default=0),
+            "sent": sent,
+            "dropped": sum(info.dropped for info in connections),
+            "send_latency_avg": sum(info.send_time_total for info in connections) / sent if sent else 0.0,
+            "send_latency_max": max((info.send_time_max for info in connections), default=0.0),
+        }
 
 
-manager = ConnectionManager()
+manager = ConnectionManager(
+    get_broker(), overflow_policy=settings.WS_OVERFLOW_POLICY, binary_frames=settings.WS_BINARY_FRAMES
+)
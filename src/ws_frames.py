@@ -0,0 +1,37 @@
+import json
+from typing import Dict, Union
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard encoder is only slower
+    orjson = None
+
+Frame = Union[str, bytes]
+
+
+def encode_payload(payload: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, default=str)
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False, default=str).encode()
+
+
+class EncodedFrame:
+    # the payload shared by every recipient connection is serialized once; the only per-connection
+    # field (`is_active_conversation`) is spliced in front of the closing brace, and the two
+    # possible frames are built at most once each.
+
+    def __init__(self, payload: dict, binary: bool = False):
+        body = encode_payload(payload)
+        self.binary = binary
+        self._prefix = body[:-1] + (b"," if len(body) > 2 else b"")
+        self._frames: Dict[bool, Frame] = {}
+
+    def for_connection(self, is_active_conversation: bool) -> Frame:
+        frame = self._frames.get(is_active_conversation)
+        if frame is None:
+            flag = b"true" if is_active_conversation else b"false"
+            frame = self._prefix + b'"is_active_conversation":' + flag + b"}"
+            if not self.binary:
+                frame = frame.decode()
+            self._frames[is_active_conversation] = frame
+        return frame
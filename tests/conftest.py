@@ -0,0 +1,89 @@
+import asyncio
+import os
+import tempfile
+import uuid
+
+import pytest
+
+# the settings are read once, when the app is first imported, so they are final before any test module loads.
+# the database tests only ever run against TEST_DATABASE_URL (a dedicated, disposable database), never
+# against DATABASE_URL, and are skipped without it.
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+_local_dir = tempfile.mkdtemp(prefix="chat-tests-")
+os.environ.update(
+    {
+        "DATABASE_URL": TEST_DATABASE_URL or "postgresql+asyncpg://localhost/unused",
+        "PRIVATE_KEY_DIR": os.path.join(_local_dir, "keys"),
+        "LOCAL_DB_DIR": os.path.join(_local_dir, "local"),
+        "BROKER_BACKEND": "memory",
+        "PRINCIPAL_CACHE_BACKEND": "memory",
+        "LOCAL_STORE_ENABLED": "false",
+    }
+)
+os.environ.setdefault("JWT_SECRET", "test-secret")
+os.environ.setdefault("JWT_ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+
+import src  # noqa: E402, F401  the app package first, as in production: the apps import each other through it
+
+
+@pytest.fixture
+def run():
+    # every test runs its coroutines in a loop of its own, the pool must not hand over a connection
+    # opened in a previous (closed) loop.
+    from src.db_config import main_engine
+
+    def run(coroutine):
+        async def scoped():
+            try:
+                return await coroutine
+            finally:
+                await main_engine.dispose()
+
+        return asyncio.run(scoped())
+
+    return run
+
+
+@pytest.fixture(scope="session")
+def database():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+
+    from sqlmodel import SQLModel
+
+    from src.db_config import main_engine
+
+    async def create_all():
+        async with main_engine.begin() as connection:
+            await connection.run_sync(SQLModel.metadata.drop_all)
+            await connection.run_sync(SQLModel.metadata.create_all)
+        await main_engine.dispose()
+
+    asyncio.run(create_all())
+    yield
+
+
+@pytest.fixture
+def make_user():
+    # a registered user, with an encryption key unless `with_key` is False. no password hashing involved.
+    from src.models import User, UserKey
+
+    async def make_user(session, with_key: bool = True):
+        name = f"user_{uuid.uuid4().hex[:12]}"
+        user = User(
+            id=uuid.uuid4(),
+            username=name,
+            email=f"{name}@example.com",
+            phone_number=f"+1{uuid.uuid4().int % 10**10:010d}",
+            password_hash="-",
+        )
+        session.add(user)
+        if with_key:
+            await session.flush()
+            session.add(UserKey(user_id=user.id, public_key=b"-", algorithm="ECDH_SECP384R1"))
+        await session.commit()
+        return user
+
+    return make_user
@@ -0,0 +1,165 @@
+import asyncio
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+# a stand-in for the Redis commands the broker uses (strings with expiry, hashes and pub/sub), speaking
+# RESP2 and RESP3 (the pub/sub frames are pushes once a client sent HELLO 3) on a local port, so RedisBroker
+# nodes can run in several processes without a Redis server.
+
+
+def push(items: list, resp3: bool) -> bytes:
+    return (b">%d\r\n" % len(items) + b"".join(encode(item, resp3) for item in items)) if resp3 else encode(items)
+
+
+def encode(value, resp3: bool = False) -> bytes:
+    if value is None:
+        return b"_\r\n" if resp3 else b"$-1\r\n"
+    if isinstance(value, bool):
+        return b":%d\r\n" % int(value)
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    if isinstance(value, str):
+        return b"+%s\r\n" % value.encode()
+    if isinstance(value, Exception):
+        return b"-ERR %s\r\n" % str(value).encode()
+    return b"*%d\r\n" % len(value) + b"".join(encode(item, resp3) for item in value)
+
+
+class RespServer:
+    def __init__(self):
+        self.values: Dict[bytes, Tuple[bytes, Optional[float]]] = {}  # key -> (value, expires at)
+        self.hashes: Dict[bytes, Dict[bytes, bytes]] = defaultdict(dict)
+        self.subscribers: Dict[bytes, Set[asyncio.StreamWriter]] = defaultdict(set)
+        self.writers: Set[asyncio.StreamWriter] = set()
+        self.resp3: Set[asyncio.StreamWriter] = set()
+        self.port: Optional[int] = None
+        self._loop = asyncio.new_event_loop()
+        self._server: Optional[asyncio.Server] = None
+
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.port}/0"
+
+    def start(self) -> "RespServer":
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        self._call(self._listen())
+        return self
+
+    def stop(self):
+        self._call(self._close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def restart(self, outage: float, lose_data: bool):
+        # every client loses its connection and the port refuses new ones for `outage` seconds.
+        self._call(self._close())
+        if lose_data:
+            self.values.clear()
+            self.hashes.clear()
+        time.sleep(outage)
+        self._call(self._listen())
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _listen(self):
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", self.port or 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def _close(self):
+        self._server.close()
+        for writer in list(self.writers):
+            writer.transport.abort()
+        self.writers.clear()
+        self.resp3.clear()
+        self.subscribers.clear()
+        await self._server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.writers.add(writer)
+        try:
+            while True:
+                command = await self._read_command(reader)
+                if command is None:
+                    break
+                writer.write(self._execute(writer, command))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            self.resp3.discard(writer)
+            for writers in self.subscribers.values():
+                writers.discard(writer)
+            writer.close()
+
+    @staticmethod
+    async def _read_command(reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+        line = await reader.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    def _get(self, key: bytes) -> Optional[bytes]:
+        value, expires_at = self.values.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.time():
+            del self.values[key]
+            return None
+        return value
+
+    def _execute(self, writer: asyncio.StreamWriter, command: List[bytes]) -> bytes:
+        name, args = command[0].upper(), command[1:]
+        resp3 = writer in self.resp3
+        if name in (b"CLIENT", b"SELECT"):
+            return encode("OK")
+        if name == b"HELLO":
+            if args and args[0] == b"3":
+                self.resp3.add(writer)
+            return b"%%1\r\n%s%s" % (encode(b"proto"), encode(3 if writer in self.resp3 else 2))
+        if name == b"PING":
+            return encode("PONG")
+        if name == b"SET":
+            key, value, options = args[0], args[1], [option.upper() for option in args[2:]]
+            expires_at = time.time() + int(options[options.index(b"EX") + 1]) if b"EX" in options else None
+            previous = self._get(key)
+            self.values[key] = (value, expires_at)
+            return encode(previous, resp3) if b"GET" in options else encode("OK")
+        if name == b"GET":
+            return encode(self._get(args[0]), resp3)
+        if name == b"MGET":
+            return encode([self._get(key) for key in args], resp3)
+        if name == b"DEL":
+            return encode(sum(self.values.pop(key, None) is not None for key in args))
+        if name == b"HSET":
+            fields = self.hashes[args[0]]
+            new = sum(field not in fields for field in args[1::2])
+            fields.update(zip(args[1::2], args[2::2]))
+            return encode(new)
+        if name == b"HDEL":
+            fields = self.hashes[args[0]]
+            return encode(sum(fields.pop(field, None) is not None for field in args[1:]))
+        if name == b"HKEYS":
+            return encode(list(self.hashes.get(args[0], {})))
+        if name == b"PUBLISH":
+            receivers = self.subscribers.get(args[0], set())
+            for receiver in receivers:
+                receiver.write(push([b"message", args[0], args[1]], receiver in self.resp3))
+            return encode(len(receivers))
+        if name in (b"SUBSCRIBE", b"UNSUBSCRIBE"):
+            replies = []
+            for channel in args:
+                if name == b"SUBSCRIBE":
+                    self.subscribers[channel].add(writer)
+                else:
+                    self.subscribers[channel].discard(writer)
+                count = sum(writer in writers for writers in self.subscribers.values())
+                replies.append(push([name.lower(), channel, count], resp3))
+            return b"".join(replies)
+        return encode(Exception(f"unknown command '{name.decode()}'"))
@@ -0,0 +1,17 @@
+import jwt
+
+from auth.routes import get_current_user
+from src.db_config import async_session, settings
+
+
+def test_token_without_expiry_is_accepted(database, run, make_user):
+    async def scenario():
+        async with async_session() as session:
+            user = await make_user(session)
+        token = jwt.encode({"sub": user.username}, settings.JWT_SECRET, algorithm=settings.JWT_ALGORITHM)
+        # the second call is served by the principal cache.
+        return user, await get_current_user(token), await get_current_user(token)
+
+    user, principal, cached = run(scenario())
+
+    assert principal.id == cached.id == user.id
@@ -0,0 +1,113 @@
+import asyncio
+import multiprocessing
+import queue
+import time
+import uuid
+
+import pytest
+from resp_server import RespServer
+
+from src.broker import RedisBroker
+
+# RedisBroker nodes in separate processes, talking through a local stand-in for Redis (see resp_server).
+
+
+def run_node(url: str, user_id: str, ready, stop, deliveries):
+    # a node holding one socket of `user_id`, every envelope it is handed goes to `deliveries`.
+    async def main():
+        broker = RedisBroker(url, presence_ttl=3, reconnect_delay=0.2)
+
+        async def handler(user_ids, envelope):
+            deliveries.put((user_ids, envelope))
+
+        async def on_broadcast(data):
+            deliveries.put(("broadcast", data))
+
+        broker.on_broadcast("test", on_broadcast)
+        await broker.start(handler)
+        await broker.subscribe(user_id)
+        await broker.set_online(user_id, 1)
+        ready.set()
+        while not stop.is_set():
+            await asyncio.sleep(0.05)
+        await broker.stop()
+
+    asyncio.run(main())
+
+
+@pytest.fixture
+def server():
+    server = RespServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def remote_node(server):
+    context = multiprocessing.get_context("spawn")
+    user_id = str(uuid.uuid4())
+    ready, stop, deliveries = context.Event(), context.Event(), context.Queue()
+    process = context.Process(target=run_node, args=(server.url, user_id, ready, stop, deliveries))
+    process.start()
+    assert ready.wait(timeout=30), "the remote node did not start"
+    yield user_id, deliveries
+    stop.set()
+    process.join(timeout=10)
+    if process.is_alive():
+        process.kill()
+
+
+def test_delivery_presence_and_broadcast_across_processes(server, remote_node):
+    user_id, deliveries = remote_node
+    offline_user_id = str(uuid.uuid4())
+
+    async def scenario():
+        broker = RedisBroker(server.url, presence_ttl=3)
+        try:
+            online = await broker.online_users([user_id, offline_user_id])
+            await broker.publish(user_id, {"n": 1})
+            await broker.publish_many([user_id, offline_user_id], {"n": 2})
+            await broker.broadcast("test", {"n": 3})
+        finally:
+            await broker.stop()
+        return online
+
+    online = asyncio.run(scenario())
+
+    assert online == {user_id}
+    assert deliveries.get(timeout=5) == ([user_id], {"n": 1})
+    assert deliveries.get(timeout=5) == ([user_id], {"n": 2})
+    assert deliveries.get(timeout=5) == ("broadcast", {"n": 3})
+    with pytest.raises(queue.Empty):
+        deliveries.get(timeout=0.5)
+
+
+def test_node_recovers_from_a_broker_restart(server, remote_node):
+    user_id, deliveries = remote_node
+    # longer than the client's own retries, the listener has to reconnect by itself.
+    server.restart(outage=8, lose_data=True)
+
+    async def scenario():
+        broker = RedisBroker(server.url, presence_ttl=3)
+        delivered = online = False
+        deadline = time.monotonic() + 20
+        try:
+            while not (delivered and online) and time.monotonic() < deadline:
+                try:
+                    online = online or user_id in await broker.online_users([user_id])
+                    await broker.publish(user_id, {"after": "restart"})
+                except Exception:
+                    pass
+                try:
+                    delivered = delivered or deliveries.get(timeout=0.5) == ([user_id], {"after": "restart"})
+                except queue.Empty:
+                    pass
+        finally:
+            await broker.stop()
+        return delivered, online
+
+    delivered, online = asyncio.run(scenario())
+
+    # the node resubscribed its user and wrote its presence again.
+    assert delivered
+    assert online
@@ -0,0 +1,27 @@
+import uuid
+
+from conversation.manager import ConversationManager
+from src.db_config import async_session
+from src.models import pair_key
+
+
+def test_pair_key_is_canonical():
+    a, b = uuid.uuid4(), uuid.uuid4()
+
+    assert pair_key(a, b) == pair_key(str(a), b.hex) == pair_key(b.hex.upper(), str(a).upper())
+
+
+def test_any_spelling_of_a_pair_finds_its_conversation(database, run, make_user):
+    async def scenario():
+        async with async_session() as session:
+            a, b = await make_user(session), await make_user(session)
+            conversation_manager = ConversationManager(session)
+            created = await conversation_manager.get_or_create_private_conversation_id(str(a.id), str(b.id))
+            found = await conversation_manager.get_or_create_private_conversation_id(b.id.hex, a.id.hex.upper())
+            participants = await conversation_manager.get_participant_ids(created)
+        return a, b, created, found, participants
+
+    a, b, created, found, participants = run(scenario())
+
+    assert found == created
+    assert sorted(participants) == sorted([str(a.id), str(b.id)])
@@ -0,0 +1,75 @@
+import uuid
+
+from message.manager import DeliveryManager, MessageManager
+from src.config import Config as settings
+from src.db_config import async_session
+from src.models import Message
+
+
+def test_queue_of_a_user_who_never_acknowledges_is_bounded(database, run, make_user, monkeypatch):
+    monkeypatch.setattr(settings, "DELIVERY_QUEUE_MAX_PENDING", 3)
+
+    async def scenario():
+        async with async_session() as session:
+            sender, recipient = await make_user(session), await make_user(session)
+            messages = [
+                Message(id=uuid.uuid4(), sender_id=sender.id, recipient_id=recipient.id, content="-") for _ in range(5)
+            ]
+            session.add_all(messages)
+            await session.commit()
+
+            delivery_manager = DeliveryManager(session)
+            for message in messages:
+                await delivery_manager.enqueue([(recipient.id, message.id)])
+            pending = await delivery_manager.get_pending(str(recipient.id), 0, 10)
+            acked_seq = await delivery_manager.get_acked_seq(str(recipient.id))
+        return pending, acked_seq
+
+    pending, acked_seq = run(scenario())
+
+    assert [seq for seq, _ in pending] == [3, 4, 5]
+    assert acked_seq == 2
+
+
+def test_deleting_a_queued_message_takes_it_out_of_the_queue(database, run, make_user):
+    async def scenario():
+        async with async_session() as session:
+            sender, recipient = await make_user(session), await make_user(session)
+            message = Message(id=uuid.uuid4(), sender_id=sender.id, recipient_id=recipient.id, content="-")
+            session.add(message)
+            await session.commit()
+            await DeliveryManager(session).enqueue([(recipient.id, message.id)])
+
+            deleted = await MessageManager(session).delete(str(message.id))
+            pending = await DeliveryManager(session).get_pending(str(recipient.id), 0, 10)
+        return deleted, pending
+
+    deleted, pending = run(scenario())
+
+    assert deleted
+    assert pending == []
+
+
+def test_acknowledging_past_the_last_seq_keeps_later_messages(database, run, make_user):
+    async def scenario():
+        async with async_session() as session:
+            sender, recipient = await make_user(session), await make_user(session)
+            delivery_manager = DeliveryManager(session)
+
+            async def send():
+                message = Message(id=uuid.uuid4(), sender_id=sender.id, recipient_id=recipient.id, content="-")
+                session.add(message)
+                await session.commit()
+                await delivery_manager.enqueue([(recipient.id, message.id)])
+
+            await send()
+            # a client seq cached from before a reset, say.
+            acked_seq = await delivery_manager.acknowledge(str(recipient.id), 999999)
+            await send()
+            pending = await delivery_manager.get_pending(str(recipient.id), acked_seq, 10)
+        return acked_seq, pending
+
+    acked_seq, pending = run(scenario())
+
+    assert acked_seq == 1
+    assert [seq for seq, _ in pending] == [2]
@@ -0,0 +1,76 @@
+import uuid
+
+import httpx
+
+from auth.routes import create_access_token
+from conversation.membership import invalidate_membership, membership_index
+from message.schemas import new_message_payload
+from src import app
+from src.broker import InMemoryBroker
+from src.db_config import async_session
+from src.models import Message
+from src.websockets_conn import manager
+
+
+async def post_group(token: str, participant_ids):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        return await client.post(
+            "/conversations/groups",
+            json={"conversation_name": "group", "participant_ids": [str(user_id) for user_id in participant_ids]},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+
+def test_group_with_unknown_members_is_rejected(database, run, make_user):
+    unknown_id = uuid.uuid4()
+
+    async def scenario():
+        async with async_session() as session:
+            creator, member = await make_user(session), await make_user(session)
+        token = create_access_token({"sub": creator.username})
+        return await post_group(token, [member.id, unknown_id]), await post_group(token, [member.id])
+
+    rejected, created = run(scenario())
+
+    assert rejected.status_code == 400
+    assert str(unknown_id) in rejected.json()["detail"]
+    assert created.status_code == 201
+
+
+def test_membership_is_invalidated_on_every_node(run):
+    conversation_id = str(uuid.uuid4())
+
+    async def scenario():
+        # another node of the same deployment, caching the same conversation.
+        other_node, other_index = InMemoryBroker(bus=manager.broker.bus), {}
+
+        async def on_membership_changed(data):
+            other_index.pop(data["conversation_id"], None)
+
+        other_node.on_broadcast("membership", on_membership_changed)
+        await other_node.start(lambda user_ids, envelope: None)
+        await manager.start()
+        try:
+            membership_index.set(conversation_id, frozenset({"a"}))
+            other_index[conversation_id] = frozenset({"a"})
+            stale_generation = membership_index.generation
+            await invalidate_membership(conversation_id)
+            # members read before the invalidation are not cached after it.
+            membership_index.set(conversation_id, frozenset({"a"}), stale_generation)
+            return membership_index.get(conversation_id), other_index
+        finally:
+            await other_node.stop()
+            await manager.stop()
+
+    local, other_index = run(scenario())
+
+    assert local is None
+    assert conversation_id not in other_index
+
+
+def test_group_message_payload_has_no_recipient():
+    message = Message(id=uuid.uuid4(), sender_id=uuid.uuid4(), conversation_id=uuid.uuid4(), content="-", nonce=b"-")
+
+    payload = new_message_payload(message, "hi", seqs={"member": 1})
+
+    assert payload["data"]["recipient_id"] is None
@@ -0,0 +1,104 @@
+import uuid
+from collections import Counter
+
+import httpx
+from sqlalchemy import event
+from sqlalchemy.orm import Mapper
+
+from auth.routes import create_access_token, get_current_user
+from src import app
+from src.db_config import async_session, main_engine
+from src.models import Conversation, ConversationParticipant, Message, pair_key
+
+# relationships are never loaded implicitly: the statements and rows behind the auth
+# dependency and the conversation list must not grow with the users' history.
+
+MESSAGES_PER_CONVERSATION = 25
+
+
+class LoadCounter:
+    # the statements sent to the database and the ORM rows loaded (per model) while the block runs.
+
+    def __init__(self):
+        self.statements = 0
+        self.rows = Counter()
+
+    def _on_execute(self, *args):
+        self.statements += 1
+
+    def _on_load(self, target, context):
+        self.rows[type(target).__name__] += 1
+
+    def __enter__(self):
+        event.listen(main_engine.sync_engine, "before_cursor_execute", self._on_execute)
+        event.listen(Mapper, "load", self._on_load)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(main_engine.sync_engine, "before_cursor_execute", self._on_execute)
+        event.remove(Mapper, "load", self._on_load)
+
+
+async def seed_history(make_user, conversations: int):
+    # a user with `conversations` private conversations, each holding MESSAGES_PER_CONVERSATION messages.
+    async with async_session() as session:
+        owner = await make_user(session)
+        for _ in range(conversations):
+            peer = await make_user(session)
+            conversation = Conversation(id=uuid.uuid4(), is_group=False, pair_key=pair_key(owner.id, peer.id))
+            session.add(conversation)
+            await session.flush()
+            session.add_all(
+                ConversationParticipant(conversation_id=conversation.id, user_id=user.id) for user in (owner, peer)
+            )
+            session.add_all(
+                Message(sender_id=peer.id, recipient_id=owner.id, conversation_id=conversation.id, content="-")
+                for _ in range(MESSAGES_PER_CONVERSATION)
+            )
+        await session.commit()
+    return owner
+
+
+def test_auth_dependency_loads_only_the_user_and_key(database, run, make_user):
+    async def scenario():
+        owner = await seed_history(make_user, conversations=3)
+        token = create_access_token({"sub": owner.username})
+
+        with LoadCounter() as cold:
+            principal = await get_current_user(token)
+        with LoadCounter() as warm:
+            await get_current_user(token)
+        return owner, principal, cold, warm
+
+    owner, principal, cold, warm = run(scenario())
+
+    assert principal.id == owner.id and principal.has_key
+    # the user by username, then their key: no message, conversation or participant row.
+    assert cold.statements == 2
+    assert cold.rows == Counter({"User": 1, "UserKey": 1})
+    # the principal of a token already seen comes from the cache.
+    assert warm.statements == 0
+    assert not warm.rows
+
+
+def test_conversation_list_does_not_load_messages(database, run, make_user):
+    async def scenario():
+        owner = await seed_history(make_user, conversations=3)
+        token = create_access_token({"sub": owner.username})
+        await get_current_user(token)  # the principal is cached, only the route itself is counted
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            with LoadCounter() as counter:
+                response = await client.get("/conversations/", headers={"Authorization": f"Bearer {token}"})
+        return response, counter
+
+    response, counter = run(scenario())
+
+    assert response.status_code == 200
+    conversations = response.json()
+    assert len(conversations) == 3
+    assert all(conversation["messages"] == [] for conversation in conversations)
+    # one statement whatever the number of conversations and messages.
+    assert counter.statements == 1
+    assert counter.rows == Counter({"Conversation": 3})
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import os
+
+from sqlalchemy import event, func
+from sqlmodel import select
+
+from auth.manager import UserManager
+from encryption import session_key_cache
+from message.manager import DeliveryManager
+from message.schemas import MessageCreate, new_message_payload
+from message.service import MessageService
+from message.ws_session import WebSocketSession
+from src.db_config import async_session, local_store, main_engine
+from src.db_config.local_store import local_metadata
+from src.models import Conversation, Message, pair_key, private_conversation_id
+from src.websockets_conn import manager
+
+
+def test_warm_local_first_send_does_not_touch_postgres(database, run, make_user, monkeypatch):
+    monkeypatch.setattr(local_store, "enabled", True)
+    statements = []
+
+    def on_execute(*args):
+        statements.append(args[2])
+
+    async def scenario():
+        async with local_store.engine.begin() as connection:
+            await connection.run_sync(local_metadata.create_all)
+        async with async_session() as session:
+            sender, recipient = await make_user(session), await make_user(session)
+            # the session key as if derived before, the test users have no private key on disk.
+            recipient_key = await UserManager(session).get_user_key(recipient.id)
+            session_key_cache.set(str(sender.id), recipient_key.id, str(recipient.id), os.urandom(32))
+
+        async with async_session() as session:
+            await MessageService(session).send_message(
+                str(sender.id), MessageCreate(recipient_id=str(recipient.id), content="hi")
+            )
+        event.listen(main_engine.sync_engine, "before_cursor_execute", on_execute)
+        try:
+            async with async_session() as session:
+                message = await MessageService(session).send_message(
+                    str(sender.id), MessageCreate(recipient_id=str(recipient.id), content="hello")
+                )
+        finally:
+            event.remove(main_engine.sync_engine, "before_cursor_execute", on_execute)
+
+        # read back before the sync, then synced.
+        async with async_session() as session:
+            unsynced = await MessageService(session).get_message(str(recipient.id), str(message.id))
+        await local_store._sync_pass()
+        async with async_session() as session:
+            conversation = await session.get(Conversation, message.conversation_id)
+            synced = (await session.exec(select(func.count()).where(Message.conversation_id == conversation.id))).one()
+        await local_store.engine.dispose()
+        return sender, recipient, unsynced, conversation, synced
+
+    sender, recipient, unsynced, conversation, synced = run(scenario())
+
+    assert statements == []
+    assert unsynced.content == "hello"
+    assert conversation.id == private_conversation_id(pair_key(sender.id, recipient.id))
+    assert synced == 2
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        self.sent.append(json.loads(data))
+
+
+def test_live_local_first_message_is_acked_and_not_replayed(database, run, make_user, monkeypatch):
+    monkeypatch.setattr(local_store, "enabled", True)
+
+    async def scenario():
+        async with local_store.engine.begin() as connection:
+            await connection.run_sync(local_metadata.create_all)
+        async with async_session() as session:
+            sender, recipient = await make_user(session), await make_user(session)
+            recipient_key = await UserManager(session).get_user_key(recipient.id)
+            session_key_cache.set(str(sender.id), recipient_key.id, str(recipient.id), os.urandom(32))
+        recipient_id = str(recipient.id)
+
+        live = RecordingWebSocket()
+        await manager.connect(live, recipient_id)
+        try:
+            # as the send endpoint does it: not synced yet, so published without a seq.
+            async with async_session() as session:
+                message_service = MessageService(session)
+                message = await message_service.send_message(
+                    str(sender.id), MessageCreate(recipient_id=recipient_id, content="hello")
+                )
+                seq = message_service.delivery_seq(recipient_id, message.id)
+                await manager.send_personal_message(
+                    new_message_payload(message, "hello", seq=seq), user_id=recipient_id, sender_id=str(sender.id)
+                )
+            await local_store._sync_pass()
+            await asyncio.sleep(0.05)
+            await manager.flush(live, recipient_id)
+            await manager.disconnect(live, recipient_id)
+
+            # the client acknowledges the seq it was given, then reconnects.
+            [assigned] = [frame for frame in live.sent if frame["type"] == "delivery_seq"]
+            async with async_session() as session:
+                await DeliveryManager(session).acknowledge(recipient_id, assigned["seq"])
+            reconnected = RecordingWebSocket()
+            await manager.connect(reconnected, recipient_id, catching_up=True)
+            await WebSocketSession(reconnected, recipient_id, str(sender.id)).catch_up(None)
+            await manager.flush(reconnected, recipient_id)
+            await manager.disconnect(reconnected, recipient_id)
+        finally:
+            await manager.stop()
+            await local_store.engine.dispose()
+        return message, live.sent, assigned, reconnected.sent
+
+    message, live, assigned, reconnected = run(scenario())
+
+    assert live[0]["type"] == "new_message"
+    assert live[0]["data"]["id"] == str(message.id) and "seq" not in live[0]["data"]
+    assert (assigned["message_id"], assigned["seq"]) == (str(message.id), 1)
+    assert [frame["type"] for frame in reconnected] == ["catch_up_done"]
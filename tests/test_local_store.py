@@ -0,0 +1,97 @@
+import sys
+import uuid
+from functools import partial
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from src.db_config import async_session
+from src.db_config.local_store import LocalStore, local_metadata, local_records
+from src.models import Message
+
+store_module = sys.modules["src.db_config.local_store"]
+# a text message without a conversation, every field set as the send path does.
+message = partial(Message, conversation_id=None, nonce=b"-", content="-")
+
+
+def make_store(tmp_path) -> LocalStore:
+    store = LocalStore(
+        url=f"sqlite+aiosqlite:///{tmp_path}/local.db",
+        enabled=True,
+        batch_size=10,
+        interval=60,
+        max_attempts=1,
+        retry_base=0.5,
+        retention=3600,
+        max_pause=30,
+    )
+    store.register(Message)
+    return store
+
+
+async def prepare(store: LocalStore, make_user):
+    async with store.engine.begin() as connection:
+        await connection.run_sync(local_metadata.create_all)
+    async with async_session() as session:
+        return await make_user(session), await make_user(session)
+
+
+async def records(store: LocalStore):
+    async with store.engine.connect() as connection:
+        result = await connection.execute(select(local_records.c.state, local_records.c.attempts))
+        return [tuple(row) for row in result.all()]
+
+
+def test_an_outage_pauses_the_sync_without_counting_attempts(database, run, make_user, tmp_path, monkeypatch):
+    store = make_store(tmp_path)
+    unreachable = create_async_engine("postgresql+asyncpg://postgres@127.0.0.1:1/unreachable")
+
+    async def scenario():
+        sender, recipient = await prepare(store, make_user)
+        await store.write([message(id=uuid.uuid4(), sender_id=sender.id, recipient_id=recipient.id)])
+        with monkeypatch.context() as patch:
+            patch.setattr(store_module, "async_session", async_sessionmaker(unreachable, class_=AsyncSession))
+            for _ in range(3):
+                await store._sync_pass()
+        during, paused_until = await records(store), store.paused_until
+        await store._sync_pass()
+        after = await records(store)
+        await store.engine.dispose()
+        await unreachable.dispose()
+        return during, paused_until, after
+
+    during, paused_until, after = run(scenario())
+
+    # more outages than max_attempts, and the row is still pending with no attempt counted.
+    assert during == [("pending", 0)]
+    assert paused_until > 0 and store.outages == 3
+    assert after == [("synced", 0)]
+    assert store.paused_until == 0.0
+
+
+def test_row_errors_fail_their_rows_only_and_can_be_requeued(database, run, make_user, tmp_path):
+    store = make_store(tmp_path)
+
+    async def scenario():
+        sender, recipient = await prepare(store, make_user)
+        # the second one references a user that does not exist.
+        await store.write(
+            [
+                message(id=uuid.uuid4(), sender_id=sender.id, recipient_id=recipient.id),
+                message(id=uuid.uuid4(), sender_id=uuid.uuid4(), recipient_id=recipient.id),
+            ]
+        )
+        await store._sync_pass()
+        synced = await records(store)
+        requeued = await store.requeue_failed()
+        after = await records(store)
+        await store.engine.dispose()
+        return synced, requeued, after
+
+    synced, requeued, after = run(scenario())
+
+    assert synced == [("synced", 0), ("failed", 1)]
+    assert requeued == 1
+    assert after == [("synced", 0), ("pending", 0)]
+    assert store.outages == 0
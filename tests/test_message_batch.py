@@ -0,0 +1,31 @@
+import httpx
+
+from auth.routes import create_access_token
+from src import app
+from src.db_config import async_session
+
+
+def test_batch_reports_errors_per_item(database, run, make_user):
+    async def scenario():
+        async with async_session() as session:
+            # the sender has a public key on record but no private key in the keystore.
+            sender, recipient = await make_user(session), await make_user(session)
+        token = create_access_token({"sub": sender.username})
+        payload = [
+            {"recipient_id": str(recipient.id), "content": "hello"},
+            {"recipient_id": "not-a-user-id", "content": "hello"},
+            {"recipient_id": recipient.id.hex.upper(), "content": "hello again"},
+        ]
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.post("/messages/batch", json=payload, headers={"Authorization": f"Bearer {token}"})
+
+    response = run(scenario())
+
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["created"], body["failed"]) == (0, 3)
+    results = body["results"]
+    assert [result["index"] for result in results] == [0, 1, 2]
+    assert "recipient_id must be a user id" in results[1]["error"]
+    # both spellings of the recipient id are the same pair, and fail on the sender's missing key.
+    assert results[0]["error"] == results[2]["error"] == "Private key not found"
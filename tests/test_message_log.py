@@ -0,0 +1,119 @@
+import asyncio
+import os
+import uuid
+
+from src.db_config.local_json_config import (MessageLog, is_merged,
+                                             list_segments, segment_path)
+
+
+def new_log() -> MessageLog:
+    return MessageLog(segment_max_bytes=1 << 20, fsync_batch=100, fsync_interval=0.05, compact_segments=4)
+
+
+def new_pair():
+    return f"sender_{uuid.uuid4().hex[:8]}", f"receiver_{uuid.uuid4().hex[:8]}"
+
+
+async def read_all(log: MessageLog, sender: str, receiver: str):
+    return [entry async for entry in log.read(sender, receiver)]
+
+
+def test_read_skips_an_incomplete_last_line():
+    sender, receiver = new_pair()
+
+    async def scenario():
+        log = new_log()
+        log.append(sender, receiver, {"message": "first"})
+        await log.stop()
+        # an entry half written when the process died.
+        with open(segment_path(sender, receiver, 0), "a") as f:
+            f.write('{"message": "sec')
+
+        before_restart = await read_all(log, sender, receiver)
+        log.append(sender, receiver, {"message": "third"})
+        await log.stop()
+        return before_restart, await read_all(log, sender, receiver)
+
+    before_restart, after_restart = asyncio.run(scenario())
+
+    assert before_restart == [{"message": "first"}]
+    # the torn tail is dropped before appending, the next entry is not glued to it.
+    assert after_restart == [{"message": "first"}, {"message": "third"}]
+
+
+def test_writer_survives_a_bad_entry():
+    sender, receiver = new_pair()
+
+    async def scenario():
+        log = new_log()
+        log.append(sender, receiver, {"message": object()})
+        await asyncio.sleep(0.1)
+        writer_alive = not log._writer.done()
+        log.append(sender, receiver, {"message": "after"})
+        await log.stop()
+        return writer_alive, await read_all(log, sender, receiver)
+
+    writer_alive, entries = asyncio.run(scenario())
+
+    assert writer_alive
+    assert entries == [{"message": "after"}]
+    assert os.path.exists(segment_path(sender, receiver, 0))
+
+
+def small_segment_log() -> MessageLog:
+    # 4 entries per segment, merged once more than 4 are sealed.
+    return MessageLog(segment_max_bytes=40, fsync_batch=100, fsync_interval=0.05, compact_segments=4)
+
+
+async def append_all(log: MessageLog, sender: str, receiver: str, numbers):
+    # one batch per entry, so the writer rotates as it goes.
+    for n in numbers:
+        log.append(sender, receiver, {"n": n})
+        await asyncio.sleep(0.001)
+    await log.stop()
+
+
+def test_a_read_spanning_a_merge_sees_every_entry_once():
+    sender, receiver = new_pair()
+
+    async def scenario():
+        log = small_segment_log()
+        await append_all(log, sender, receiver, range(12))
+        reader = log.read(sender, receiver)
+        entries = [await reader.__anext__()]
+        # enough rotations to merge every segment the reader listed.
+        await append_all(log, sender, receiver, range(12, 40))
+        entries += [entry async for entry in reader]
+        merged_while_reading = [path for path in list_segments(sender, receiver) if is_merged(path)]
+        await append_all(log, sender, receiver, range(40, 60))
+        merged_after = [path for path in list_segments(sender, receiver) if is_merged(path)]
+        return entries, merged_while_reading, merged_after, await read_all(log, sender, receiver)
+
+    entries, merged_while_reading, merged_after, after = asyncio.run(scenario())
+
+    # the listed segments only, the active one may have grown meanwhile.
+    assert [entry["n"] for entry in entries] == list(range(len(entries)))
+    assert 12 <= len(entries) < 40
+    assert merged_while_reading == []
+    assert merged_after
+    assert [entry["n"] for entry in after] == list(range(60))
+
+
+def test_a_merge_only_copies_the_segments_sealed_since_the_last_one():
+    sender, receiver = new_pair()
+
+    async def scenario():
+        log = small_segment_log()
+        await append_all(log, sender, receiver, range(24))
+        [first] = [path for path in list_segments(sender, receiver) if is_merged(path)]
+        first_inode = os.stat(first).st_ino
+        await append_all(log, sender, receiver, range(24, 48))
+        segments = list_segments(sender, receiver)
+        return first, first_inode, segments, await read_all(log, sender, receiver)
+
+    first, first_inode, segments, entries = asyncio.run(scenario())
+
+    merged = [path for path in segments if is_merged(path)]
+    assert len(merged) == 2 and merged[0] == first
+    assert os.stat(first).st_ino == first_inode
+    assert [entry["n"] for entry in entries] == list(range(48))
@@ -0,0 +1,32 @@
+import httpx
+from sqlalchemy import text
+
+from src import app
+from src.db_config import async_session, get_pool_status
+
+
+async def get(path: str, token: str | None = None) -> httpx.Response:
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        return await client.get(path, headers=headers)
+
+
+def test_metrics_require_authentication(run):
+    for path in ("/metrics/db-pool", "/metrics/password-hashing", "/metrics/websockets", "/metrics/local-sync"):
+        assert run(get(path)).status_code == 401
+
+
+def test_pool_checkouts_are_timed_on_use(database, run):
+    async def scenario():
+        before = get_pool_status()["checkouts"]
+        async with async_session() as session:
+            opened = get_pool_status()["checkouts"]
+            await session.exec(text("SELECT 1"))
+            used = get_pool_status()["checkouts"]
+        return before, opened, used
+
+    before, opened, used = run(scenario())
+
+    # a session does not hold a connection until its first statement.
+    assert opened == before
+    assert used == before + 1
@@ -0,0 +1,47 @@
+import asyncio
+import sqlite3
+import uuid
+from datetime import datetime
+
+from message.search import SCHEMA, SearchIndex
+
+
+def entry(message_id: uuid.UUID, content: str):
+    return (str(message_id), str(uuid.uuid4()), str(uuid.uuid4()), datetime.now().isoformat(), content)
+
+
+def test_a_message_is_indexed_once_per_user(tmp_path):
+    user_id, message_id = uuid.uuid4(), uuid.uuid4()
+    index = SearchIndex(str(tmp_path), max_connections=4)
+
+    async def scenario():
+        # a message to oneself, with the id spelled two ways, then indexed again.
+        index.add([str(user_id), user_id.hex], [entry(message_id, "hello world")])
+        await index.write(user_id.hex.upper(), [entry(message_id, "hello again")])
+        return await index.search(str(user_id), "hello", None, limit=10, offset=0)
+
+    rows = asyncio.run(scenario())
+    index.stop()
+
+    assert [row["message_id"] for row in rows] == [str(message_id)]
+    assert [path.name for path in tmp_path.iterdir() if path.suffix == ".db"] == [f"{user_id}.db"]
+
+
+def test_an_index_with_duplicates_is_upgraded(tmp_path):
+    user_id, message_id = uuid.uuid4(), uuid.uuid4()
+    connection = sqlite3.connect(tmp_path / f"{user_id}.db")
+    connection.execute(SCHEMA)
+    with connection:
+        connection.executemany(
+            "INSERT INTO message_fts (message_id, conversation_id, sender_id, timestamp, content) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [entry(message_id, "hello"), entry(message_id, "hello"), entry(uuid.uuid4(), "hello")],
+        )
+    connection.close()
+    index = SearchIndex(str(tmp_path), max_connections=4)
+
+    rows = asyncio.run(index.search(str(user_id), "hello", None, limit=10, offset=0))
+    index.stop()
+
+    assert [row["message_id"] for row in rows].count(str(message_id)) == 1
+    assert len(rows) == 2
@@ -0,0 +1,88 @@
+import asyncio
+import json
+import uuid
+
+from src.broker import InMemoryBroker, InMemoryBus
+from src.config import Config as settings
+from src.websockets_conn import ConnectionManager
+
+
+class StalledWebSocket:
+    # accepts the connection and then never completes a send, like a client that stopped reading.
+    def __init__(self):
+        self.closed_with = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        await asyncio.Event().wait()
+
+    async def close(self, code: int):
+        self.closed_with.append(code)
+
+
+def test_slow_consumer_is_disconnected_once_and_stats_hold_no_user_id():
+    user_id, sender_id = str(uuid.uuid4()), str(uuid.uuid4())
+
+    async def scenario():
+        manager = ConnectionManager(InMemoryBroker(bus=InMemoryBus()), overflow_policy="disconnect")
+        websocket = StalledWebSocket()
+        await manager.connect(websocket, user_id)
+        stats = manager.stats()
+        for i in range(settings.WS_OUTBOUND_QUEUE_SIZE * 2):
+            await manager.deliver_local([user_id], {"message": {"n": i}, "sender_id": sender_id})
+        pending = len(manager._background_tasks)
+        await asyncio.sleep(0.05)
+        await manager.stop()
+        return websocket, pending, manager, stats
+
+    websocket, pending, manager, stats = asyncio.run(scenario())
+
+    # one disconnect, referenced until it ran, however many messages overflowed.
+    assert pending == 1
+    assert not manager._background_tasks
+    assert len(websocket.closed_with) == 1
+    assert manager.slow_consumers_disconnected == 1
+    assert (stats["users"], stats["connections"]) == (1, 1)
+    assert user_id not in str(stats)
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        self.sent.append(data)
+
+
+def test_catch_up_and_live_delivery_send_each_seq_once():
+    user_id, sender_id = str(uuid.uuid4()), str(uuid.uuid4())
+
+    async def scenario():
+        manager = ConnectionManager(InMemoryBroker(bus=InMemoryBus()))
+        websocket = RecordingWebSocket()
+        await manager.connect(websocket, user_id, catching_up=True)
+
+        async def deliver(seq: int):
+            await manager.deliver_local([user_id], {"message": {"data": {"seq": seq}}, "sender_id": sender_id})
+            await manager.flush(websocket, user_id)
+
+        # sent live while the queue is being replayed, then found again by the replay.
+        await deliver(5)
+        replayed = manager.claim_seqs(websocket, user_id, [4, 5])
+        # a late live copy of a replayed message.
+        await deliver(4)
+        manager.end_catch_up(websocket, user_id, 5)
+        await deliver(4)
+        await deliver(6)
+        await manager.stop()
+        return websocket, replayed
+
+    websocket, replayed = asyncio.run(scenario())
+
+    assert replayed == {4}
+    assert [json.loads(data)["data"]["seq"] for data in websocket.sent] == [5, 6]
@@ -0,0 +1,73 @@
+import asyncio
+import uuid
+
+import jwt
+import pytest
+from fastapi import WebSocketDisconnect, status
+from fastapi.testclient import TestClient
+
+from auth.routes import get_current_user
+from message.ws_session import WebSocketSession
+from src import app
+from src.db_config import async_session, settings
+
+
+def test_bad_read_frames_are_rejected_one_by_one():
+    message_id = uuid.uuid4()
+
+    async def scenario():
+        session = WebSocketSession(websocket=None, user_id=str(uuid.uuid4()), conversation_with=str(uuid.uuid4()))
+        replies = []
+        session._reply = replies.append
+        for frame in (
+            {"type": "read", "message_ids": "not-a-list"},
+            {"type": "read", "message_ids": [str(message_id), "not-an-id"]},
+            {"type": "read", "message_ids": [message_id.hex]},
+            {"type": "read", "message_ids": [], "conversation_id": 5, "up_to": None},
+            {"type": "read", "up_to": 5},
+            {"type": "read", "up_to": ["not", "a", "cursor"]},
+        ):
+            session._parse_message(frame)
+        session.receipts._flusher.cancel()
+        return session.receipts.message_ids, replies
+
+    message_ids, replies = asyncio.run(scenario())
+
+    assert [reply["type"] for reply in replies] == ["error"] * 5
+    # only the valid frame reached the buffer, with the id in its canonical form.
+    assert message_ids == {str(message_id)}
+
+
+def test_bad_acks_are_rejected():
+    async def scenario():
+        session = WebSocketSession(websocket=None, user_id=str(uuid.uuid4()), conversation_with=str(uuid.uuid4()))
+        replies = []
+        session._reply = replies.append
+        for seq in (-1, 2**31, "5", True, 3):
+            session._parse_message({"type": "ack", "seq": seq})
+        return session.acked_seq, replies
+
+    acked_seq, replies = asyncio.run(scenario())
+
+    assert [reply["type"] for reply in replies] == ["error"] * 4
+    assert acked_seq == 3
+
+
+def test_socket_to_a_recipient_that_is_not_an_id_is_refused(database, run, make_user):
+    async def scenario():
+        async with async_session() as session:
+            user = await make_user(session)
+        token = jwt.encode({"sub": user.username}, settings.JWT_SECRET, algorithm=settings.JWT_ALGORITHM)
+        # cached here, the socket below authenticates without a database round trip from another loop.
+        await get_current_user(token)
+        return token
+
+    token = run(scenario())
+
+    # no lifespan: the socket is refused before it needs the broker.
+    client = TestClient(app)
+    with pytest.raises(WebSocketDisconnect) as closed:
+        with client.websocket_connect("/messages/not-an-id", headers={"Authorization": token}) as websocket:
+            websocket.receive_json()
+
+    assert closed.value.code == status.WS_1008_POLICY_VIOLATION